@@ -0,0 +1,201 @@
+"""
+A stand-in LLM backend for offline benchmarking.
+
+Speaks enough of the Ollama HTTP API (which litellm uses for `ollama/` and
+`ollama_chat/` models) and of the OpenAI chat completions API for NAIRO to run
+unchanged against it. Every answer is synthetic: it starts after a configurable
+latency and then streams tokens at a configurable rate. The first request
+also pays a simulated model-load time, like a cold Ollama model, and a generate
+request with an empty prompt only loads the model, as Ollama's warm-up does.
+
+Usage:
+    python benchmarks/fake_llm_server.py --port 11500 --first-token-latency 0.2 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+WORDS = (
+    "Certainly Sir the systems are nominal and I have prepared the summary you asked for "
+    "with the relevant figures the forecast and a short list of follow up items"
+).split()
+
+
+class FakeLLM:
+    def __init__(
+        self, model: str, first_token_latency: float, tokens_per_second: float, response_tokens: int,
+        load_latency: float = 0.0,
+    ):
+        self.model = model
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.load_latency = load_latency
+        self.requests = 0
+        self.loads = 0
+        self._loaded = None
+
+    async def load(self):
+        """Simulates loading the model into memory; only the first call waits."""
+        if self._loaded is None:
+            self._loaded = asyncio.ensure_future(asyncio.sleep(self.load_latency))
+        await asyncio.shield(self._loaded)
+
+    async def tokens(self):
+        """Yields the synthetic answer token by token, paced like a real model."""
+        self.requests += 1
+        await self.load()
+        await asyncio.sleep(self.first_token_latency)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        words = itertools.islice(itertools.cycle(WORDS), self.response_tokens)
+        for i, word in enumerate(words):
+            if i and interval:
+                await asyncio.sleep(interval)
+            yield word if i == 0 else " " + word
+
+    def _model_name(self, body: dict) -> str:
+        return body.get("model") or self.model
+
+    @staticmethod
+    def _prompt_tokens(body: dict) -> int:
+        text = body.get("prompt") or " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        return len(text.split())
+
+    # --- Ollama ---
+
+    async def tags(self, request):
+        return web.json_response({"models": [{"name": self.model, "model": self.model, "size": 0}]})
+
+    async def show(self, request):
+        return web.json_response({
+            "modelfile": "",
+            "parameters": "",
+            "template": "{{ .Prompt }}",
+            "details": {"family": "fake", "parameter_size": "0B"},
+            "model_info": {"general.architecture": "fake", "fake.context_length": 4096},
+        })
+
+    async def _ollama(self, request, chunk_for):
+        body = await request.json()
+        model = self._model_name(body)
+        started = time.perf_counter_ns()
+
+        def frame(**fields):
+            return {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), **fields}
+
+        def final(count):
+            return frame(
+                **chunk_for(""), done=True, done_reason="stop",
+                total_duration=time.perf_counter_ns() - started,
+                prompt_eval_count=self._prompt_tokens(body), eval_count=count,
+            )
+
+        if not body.get("stream", True):
+            text = "".join([token async for token in self.tokens()])
+            return web.json_response({**final(self.response_tokens), **chunk_for(text)})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        count = 0
+        async for token in self.tokens():
+            count += 1
+            await response.write((json.dumps(frame(**chunk_for(token), done=False)) + "\n").encode())
+        await response.write((json.dumps(final(count)) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def generate(self, request):
+        body = await request.json()
+        if not body.get("prompt"):
+            # Ollama loads the model (and refreshes keep_alive) without generating anything
+            self.loads += 1
+            await self.load()
+            return web.json_response({
+                "model": self._model_name(body), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "response": "", "done": True, "done_reason": "load",
+            })
+        return await self._ollama(request, lambda text: {"response": text})
+
+    async def chat(self, request):
+        return await self._ollama(request, lambda text: {"message": {"role": "assistant", "content": text}})
+
+    # --- OpenAI-compatible ---
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        model = self._model_name(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            text = "".join([token async for token in self.tokens()])
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": self._prompt_tokens(body),
+                    "completion_tokens": self.response_tokens,
+                    "total_tokens": self._prompt_tokens(body) + self.response_tokens,
+                },
+            })
+
+        def event(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(event({"role": "assistant", "content": ""}))
+        async for token in self.tokens():
+            await response.write(event({"content": token}))
+        await response.write(event({}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def stats(self, request):
+        return web.json_response({"requests": self.requests, "loads": self.loads})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/", lambda request: web.Response(text="Ollama is running"))
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_post("/api/show", self.show)
+        app.router.add_post("/api/generate", self.generate)
+        app.router.add_post("/api/chat", self.chat)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Ollama/OpenAI-compatible LLM server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--model", default="phi3:mini")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Token rate after the first token (0 = instant).")
+    parser.add_argument("--response-tokens", type=int, default=64, help="Tokens in every answer.")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Seconds the first request spends loading the model.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    llm = FakeLLM(
+        args.model, args.first_token_latency, args.tokens_per_second, args.response_tokens, args.load_latency
+    )
+    web.run_app(llm.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
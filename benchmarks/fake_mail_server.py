@@ -0,0 +1,243 @@
+"""
+A stand-in IMAP and SMTP server for running the email sense offline.
+
+Speaks enough of both protocols for `senses/email.py` (and for imaplib and
+smtplib clients in general): plain-text connections, any login accepted,
+one INBOX per address with UIDs, flags, SEARCH, FETCH, STORE and IDLE. Every
+message accepted over SMTP is delivered to the INBOX of each recipient, and
+connections idling on that INBOX are told at once, so NAIRO's replies can be
+read back by logging in as the address they were sent to.
+
+Usage:
+    python benchmarks/fake_mail_server.py --imap-port 1143 --smtp-port 1025
+
+with config.py pointing at it:
+    EMAIL_IMAP_HOST / EMAIL_SMTP_HOST = "127.0.0.1", EMAIL_IMAP_PORT = 1143,
+    EMAIL_IMAP_SSL = False, EMAIL_SMTP_PORT = 1025, EMAIL_SMTP_SECURITY = "none",
+    EMAIL_ALLOWED_SENDERS = ["*"], EMAIL_REQUIRE_DMARC_PASS = False
+(it adds no Authentication-Results headers).
+"""
+import argparse
+import asyncio
+import shlex
+
+
+class Mailbox:
+    def __init__(self, uidvalidity: int):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = []  # [uid, flags, data]
+        # Replaced on every delivery, so each waiter sees the delivery after it started waiting
+        self.changed = asyncio.Event()
+
+    async def deliver(self, data: bytes):
+        self.messages.append([self.uidnext, set(), data])
+        self.uidnext += 1
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def select_uids(self, uid_set: str):
+        """Messages whose UIDs are in an IMAP set such as "3,5:7" or "4:*"."""
+        last = self.messages[-1][0] if self.messages else 0
+        selected = []
+        for part in uid_set.split(","):
+            low, _, high = part.partition(":")
+            low = last if low == "*" else int(low)
+            high = low if not high else last if high == "*" else int(high)
+            low, high = min(low, high), max(low, high)
+            selected.extend(m for m in self.messages if low <= m[0] <= high and m not in selected)
+        return selected
+
+
+class FakeMailServer:
+    def __init__(self, idle: bool = True):
+        self.idle = idle
+        self.mailboxes = {}
+        self.delivered = 0
+
+    def mailbox(self, address: str) -> Mailbox:
+        address = address.lower()
+        if address not in self.mailboxes:
+            self.mailboxes[address] = Mailbox(uidvalidity=len(self.mailboxes) + 1)
+        return self.mailboxes[address]
+
+    # -- SMTP --
+
+    async def smtp_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def reply(line):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 fake-mail ESMTP ready")
+        sender, recipients = None, []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode(errors="replace").strip().partition(" ")
+                command = command.upper()
+                if command == "EHLO":
+                    reply("250-fake-mail")
+                    reply("250-AUTH PLAIN LOGIN")
+                    reply("250 8BITMIME")
+                elif command == "HELO":
+                    reply("250 fake-mail")
+                elif command == "AUTH":
+                    reply("235 Authentication succeeded")
+                elif command == "MAIL":
+                    sender, recipients = argument, []
+                    reply("250 OK")
+                elif command == "RCPT":
+                    recipients.append(argument.partition(":")[2].split()[0].strip("<>"))
+                    reply("250 OK")
+                elif command == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    lines = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith(b".") else data_line)
+                    for recipient in recipients:
+                        await self.mailbox(recipient).deliver(b"".join(lines))
+                    self.delivered += 1
+                    sender, recipients = None, []
+                    reply("250 OK: queued")
+                elif command == "RSET":
+                    sender, recipients = None, []
+                    reply("250 OK")
+                elif command == "NOOP":
+                    reply("250 OK")
+                elif command == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    # -- IMAP --
+
+    async def imap_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        capabilities = "IMAP4rev1 IDLE" if self.idle else "IMAP4rev1"
+        mailbox = None
+
+        def send(line):
+            writer.write(line.encode() + b"\r\n")
+
+        send(f"* OK [CAPABILITY {capabilities}] fake-mail IMAP ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tag, _, rest = line.decode(errors="replace").strip().partition(" ")
+                command, _, argument = rest.partition(" ")
+                command = command.upper()
+                uid = command == "UID"
+                if uid:
+                    command, _, argument = argument.partition(" ")
+                    command = command.upper()
+
+                if command == "CAPABILITY":
+                    send(f"* CAPABILITY {capabilities}")
+                elif command == "LOGIN":
+                    user = shlex.split(argument)[0]
+                    mailbox = self.mailbox(user)
+                elif command == "SELECT" or command == "EXAMINE":
+                    if mailbox is None:
+                        send(f"{tag} NO Log in first")
+                        continue
+                    send(f"* {len(mailbox.messages)} EXISTS")
+                    send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+                    send(f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID")
+                elif command == "SEARCH":
+                    criteria = argument.split()
+                    if criteria[:1] == ["UNSEEN"]:
+                        found = [m for m in mailbox.messages if "\\Seen" not in m[1]]
+                    elif criteria[:1] == ["UID"]:
+                        found = mailbox.select_uids(criteria[1])
+                    else:
+                        found = mailbox.messages
+                    send("* SEARCH" + "".join(f" {m[0]}" for m in found))
+                elif command == "FETCH":
+                    uid_set, _, items = argument.partition(" ")
+                    peek = "PEEK" in items.upper()
+                    for m in mailbox.select_uids(uid_set):
+                        sequence = mailbox.messages.index(m) + 1
+                        writer.write(f"* {sequence} FETCH (UID {m[0]} BODY[] {{{len(m[2])}}}\r\n".encode())
+                        writer.write(m[2] + b")\r\n")
+                        if not peek:
+                            m[1].add("\\Seen")
+                elif command == "STORE":
+                    uid_set, _, rest = argument.partition(" ")
+                    action, _, flags = rest.partition(" ")
+                    flags = set(flags.strip("()").split())
+                    for m in mailbox.select_uids(uid_set):
+                        if action.startswith("+"):
+                            m[1] |= flags
+                        elif action.startswith("-"):
+                            m[1] -= flags
+                        else:
+                            m[1] = set(flags)
+                elif command == "IDLE":
+                    await self._idle(tag, mailbox, reader, writer)
+                    continue
+                elif command == "LOGOUT":
+                    send("* BYE fake-mail logging out")
+                    send(f"{tag} OK LOGOUT completed")
+                    break
+                elif command not in ("NOOP", "CLOSE"):
+                    send(f"{tag} BAD Unknown command {command}")
+                    await writer.drain()
+                    continue
+                send(f"{tag} OK {'UID ' if uid else ''}{command} completed")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _idle(self, tag, mailbox, reader, writer):
+        writer.write(b"+ idling\r\n")
+        await writer.drain()
+        known = len(mailbox.messages)
+        done = asyncio.ensure_future(reader.readline())
+        try:
+            while not done.done():
+                changed = asyncio.ensure_future(mailbox.changed.wait())
+                await asyncio.wait({done, changed}, return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+                if len(mailbox.messages) != known:
+                    known = len(mailbox.messages)
+                    writer.write(f"* {known} EXISTS\r\n".encode())
+                    await writer.drain()
+        finally:
+            done.cancel()
+        writer.write(f"{tag} OK IDLE terminated\r\n".encode())
+        await writer.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fake IMAP/SMTP server for running the email sense offline.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--imap-port", type=int, default=1143)
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    parser.add_argument("--no-idle", action="store_true", help="Do not offer IMAP IDLE, so clients have to poll.")
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    server = FakeMailServer(idle=not args.no_idle)
+    imap = await asyncio.start_server(server.imap_session, args.host, args.imap_port)
+    smtp = await asyncio.start_server(server.smtp_session, args.host, args.smtp_port)
+    async with imap, smtp:
+        await asyncio.gather(imap.serve_forever(), smtp.serve_forever())
+
+
+def main(argv=None):
+    asyncio.run(serve(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
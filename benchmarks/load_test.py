@@ -0,0 +1,438 @@
+"""
+Offline load test for NAIRO.
+
+Starts the fake LLM server, runs the real `main.main()` orchestration against it
+(local model route only, web sense enabled) and drives it at increasing
+concurrency through three scenarios:
+
+    web_chat     POST /chat
+    web_stream   POST /chat/stream, which also gives time to first token
+    discord      simulated Discord messages fed through DiscordBotSense
+
+Each virtual user has its own conversation. Results (requests per second,
+latency and time-to-first-token percentiles, memory growth) are written as JSON
+so runs from different commits can be compared with `--baseline`.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1 2 4 8 --requests 32
+    python benchmarks/load_test.py --baseline benchmarks/results/abc1234.json
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "src"))
+
+# Keep the run offline: no telemetry and no model cost map download
+os.environ.setdefault("DISABLE_TELEMETRY", "true")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import aiohttp
+
+SCENARIOS = ("web_chat", "web_stream", "discord")
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process, in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def summarize(samples):
+    from core.latency import LatencyTracker
+
+    if not samples:
+        return None
+    tracker = LatencyTracker(window=len(samples))
+    for sample in samples:
+        tracker.record(sample)
+    return {
+        "p50": tracker.percentile(50),
+        "p95": tracker.percentile(95),
+        "p99": tracker.percentile(99),
+        "mean": sum(samples) / len(samples),
+        "max": max(samples),
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(dirty)
+
+
+# --- Fake LLM server ---
+
+async def start_fake_llm(args):
+    """Runs fake_llm_server.py in a subprocess and waits until it answers."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(Path(__file__).with_name("fake_llm_server.py")),
+        "--host", "127.0.0.1", "--port", str(args.llm_port),
+        "--first-token-latency", str(args.first_token_latency),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--response-tokens", str(args.response_tokens),
+    )
+    url = f"http://127.0.0.1:{args.llm_port}"
+    await wait_until_up(f"{url}/api/tags", process)
+    return process, url
+
+
+async def wait_until_up(url, process=None, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process is not None and process.returncode is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+# --- Scenarios ---
+
+class FakeMessage:
+    """Just enough of discord.Message for DiscordBotSense."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, channel, author, content):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.mentions = []
+        self.guild = None
+        self.created_at = datetime.now(timezone.utc)
+
+    async def edit(self, content):
+        self.content = content
+        self.channel.shown(content)
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.first_content_at = None
+
+    def shown(self, content):
+        from senses.discord_bot import STREAM_PLACEHOLDER
+
+        if self.first_content_at is None and content != STREAM_PLACEHOLDER:
+            self.first_content_at = time.perf_counter()
+
+    async def send(self, content):
+        self.shown(content)
+        return FakeMessage(self, None, content)
+
+
+class Scenarios:
+    """One method per scenario; each sends a prompt and returns (ok, ttft or None)."""
+
+    def __init__(self, web_url, http, discord_sense):
+        self.web_url = web_url
+        self.http = http
+        self.discord_sense = discord_sense
+
+    async def web_chat(self, user, prompt):
+        payload = {"message": prompt, "session_id": f"bench-{user}"}
+        async with self.http.post(f"{self.web_url}/chat", json=payload) as response:
+            await response.read()
+            return response.status == 200, None
+
+    async def web_stream(self, user, prompt):
+        payload = {"message": prompt, "session_id": f"bench-{user}"}
+        started = time.perf_counter()
+        ttft = None
+        async with self.http.post(f"{self.web_url}/chat/stream", json=payload) as response:
+            if response.status != 200:
+                await response.read()
+                return False, None
+            async for line in response.content:
+                if ttft is None and line.startswith(b"data:"):
+                    ttft = time.perf_counter() - started
+        return True, ttft
+
+    async def discord(self, user, prompt):
+        from config import DISCORD_COMMAND_PREFIX
+
+        sense = self.discord_sense
+        channel = FakeChannel(10_000 + user)
+        author = SimpleNamespace(id=user, bot=False)
+        started = time.perf_counter()
+        await sense.client.on_message(FakeMessage(channel, author, f"{DISCORD_COMMAND_PREFIX} {prompt}"))
+        burst = sense._bursts.get((channel.id, author.id))
+        if burst is None:
+            return False, None
+        await burst.timer
+        if channel.first_content_at is None:
+            return False, None
+        return True, channel.first_content_at - started
+
+
+async def run_level(scenarios, scenario, concurrency, total, tag):
+    """Closed loop: `concurrency` virtual users send `total` prompts between them."""
+    send = getattr(scenarios, scenario)
+    counter = itertools.count()
+    latencies, ttfts = [], []
+    errors = 0
+
+    async def user(index):
+        nonlocal errors
+        while (n := next(counter)) < total:
+            # Unique prompts, so neither the response cache nor coalescing short-circuits the model
+            prompt = f"[{tag}-{n}] Give me a short status report."
+            started = time.perf_counter()
+            try:
+                ok, ttft = await send(index, prompt)
+            except Exception as e:
+                logging.getLogger("benchmark").warning(f"{scenario} request failed: {e!r}")
+                ok, ttft = False, None
+            if not ok:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if ttft is not None:
+                ttfts.append(ttft)
+
+    gc.collect()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    duration = time.perf_counter() - started
+    gc.collect()
+    rss_after = rss_mb()
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "completed": len(latencies),
+        "errors": errors,
+        "duration_seconds": duration,
+        "requests_per_second": len(latencies) / duration if duration else None,
+        "latency_seconds": summarize(latencies),
+        "ttft_seconds": summarize(ttfts),
+        "rss_mb": {"before": rss_before, "after": rss_after, "growth": rss_after - rss_before},
+    }
+
+
+# --- Orchestration ---
+
+def configure(args, llm_url, data_dir):
+    import config
+
+    config.ENABLED_SENSES = ["web"]
+    config.GEMINI_API_KEY = None  # Route everything to the (fake) local model
+    config.LOCAL_MODEL_API_BASE = llm_url
+    os.environ["NAIRO_LOCAL_MODEL_API_BASE"] = llm_url  # Worker processes read config afresh
+    config.CONNECTIVITY_PROBE_URL = llm_url  # Keep probes off the internet
+    config.DATABASE_PATH = str(Path(data_dir) / "bench.db")
+    config.WEB_HOST = "127.0.0.1"
+    config.WEB_PORT = args.web_port
+    if args.local_pool_size is not None:
+        config.LOCAL_INTERPRETER_POOL_SIZE = args.local_pool_size
+    if args.scheduler_workers is not None:
+        config.SCHEDULER_MAX_WORKERS = args.scheduler_workers
+    if args.worker_processes is not None:
+        config.WORKER_PROCESSES = args.worker_processes
+    if args.discord_debounce is not None:
+        config.DISCORD_DEBOUNCE_SECONDS = args.discord_debounce
+    return {
+        "local_model": config.LOCAL_MODEL_NAME,
+        "local_interpreter_pool_size": config.LOCAL_INTERPRETER_POOL_SIZE,
+        "scheduler_max_workers": config.SCHEDULER_MAX_WORKERS,
+        "worker_processes": config.WORKER_PROCESSES,
+        "scheduler_senses": config.SCHEDULER_SENSES,
+        "response_cache_enabled": config.RESPONSE_CACHE_ENABLED,
+        "discord_debounce_seconds": config.DISCORD_DEBOUNCE_SECONDS,
+        "discord_stream_edit_interval_seconds": config.DISCORD_STREAM_EDIT_INTERVAL_SECONDS,
+    }
+
+
+def make_discord_sense(main):
+    import functools
+    from core.model_manager import get_model_response, stream_model_response
+    from senses.discord_bot import DiscordBotSense
+
+    sense = DiscordBotSense(
+        functools.partial(get_model_response, sense="discord_bot"),
+        main.shutdown_event,
+        functools.partial(stream_model_response, sense="discord_bot"),
+    )
+    sense.logger = logging.getLogger("sense.discord_bot")
+    return sense
+
+
+async def run(args):
+    rss_start = rss_mb()
+    llm_process, llm_url = (None, args.llm_url) if args.llm_url else await start_fake_llm(args)
+    data_dir = tempfile.TemporaryDirectory(prefix="nairo-bench-")
+    settings = configure(args, llm_url, data_dir.name)
+
+    import main
+
+    logging.getLogger().setLevel(args.log_level)
+    main_task = asyncio.create_task(main.main(), name="NAIRO")
+    web_url = f"http://127.0.0.1:{args.web_port}"
+    results = []
+    try:
+        await wait_until_up(f"{web_url}/metrics")
+        discord_sense = make_discord_sense(main) if "discord" in args.scenarios else None
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as http:
+            scenarios = Scenarios(web_url, http, discord_sense)
+            for scenario in args.scenarios:
+                if args.warmup:
+                    await run_level(scenarios, scenario, 1, args.warmup, f"warmup-{scenario}")
+                for concurrency in args.concurrency:
+                    result = await run_level(
+                        scenarios, scenario, concurrency, args.requests, f"{scenario}-{concurrency}"
+                    )
+                    results.append(result)
+                    print(format_result(result), flush=True)
+        if discord_sense is not None:
+            await discord_sense.stop()
+    finally:
+        main.shutdown_event.set()
+        try:
+            await asyncio.wait_for(main_task, timeout=30)
+        except Exception as e:
+            print(f"NAIRO did not shut down cleanly: {e!r}", file=sys.stderr)
+        if llm_process is not None:
+            llm_process.terminate()
+            await llm_process.wait()
+        data_dir.cleanup()
+
+    commit, dirty = git_commit()
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_llm": {
+            "url": llm_url,
+            "first_token_latency_seconds": args.first_token_latency,
+            "tokens_per_second": args.tokens_per_second,
+            "response_tokens": args.response_tokens,
+        },
+        "settings": settings,
+        "results": results,
+        "rss_mb": {"start": rss_start, "end": rss_mb(), "growth": rss_mb() - rss_start},
+    }
+
+
+# --- Reporting ---
+
+def _ms(summary, key):
+    return f"{summary[key] * 1000:8.1f}" if summary else "       -"
+
+
+def format_result(result):
+    latency, ttft = result["latency_seconds"], result["ttft_seconds"]
+    rps = result["requests_per_second"] or 0.0
+    return (
+        f"{result['scenario']:<10} c={result['concurrency']:<3} "
+        f"rps={rps:7.2f} p50={_ms(latency, 'p50')}ms p95={_ms(latency, 'p95')}ms "
+        f"p99={_ms(latency, 'p99')}ms ttft50={_ms(ttft, 'p50')}ms "
+        f"errors={result['errors']} rss+={result['rss_mb']['growth']:.1f}MiB"
+    )
+
+
+def compare(report, baseline_path):
+    """Prints throughput and tail latency relative to an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit') or baseline_path}:")
+    for result in report["results"]:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None or not before["requests_per_second"] or not before["latency_seconds"]:
+            continue
+        rps_change = (result["requests_per_second"] or 0) / before["requests_per_second"] - 1
+        p95_change = (
+            result["latency_seconds"]["p95"] / before["latency_seconds"]["p95"] - 1
+            if result["latency_seconds"] else float("nan")
+        )
+        print(
+            f"{result['scenario']:<10} c={result['concurrency']:<3} "
+            f"rps {rps_change:+7.1%}  p95 {p95_change:+7.1%}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline NAIRO load test against a fake LLM backend.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per scenario and concurrency level.")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each scenario.")
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=64)
+    parser.add_argument("--llm-port", type=int, default=11500)
+    parser.add_argument("--llm-url", help="Use an already running LLM server instead of starting the fake one.")
+    parser.add_argument("--web-port", type=int, default=5050)
+    parser.add_argument("--local-pool-size", type=int, help="Override LOCAL_INTERPRETER_POOL_SIZE.")
+    parser.add_argument("--scheduler-workers", type=int, help="Override SCHEDULER_MAX_WORKERS.")
+    parser.add_argument("--worker-processes", type=int, help="Override WORKER_PROCESSES.")
+    parser.add_argument("--discord-debounce", type=float, help="Override DISCORD_DEBOUNCE_SECONDS.")
+    parser.add_argument("--output", type=Path, help="Results file (default: benchmarks/results/<commit>.json).")
+    parser.add_argument("--baseline", type=Path, help="Earlier results file to compare against.")
+    parser.add_argument("--log-level", default="ERROR")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        name = (report["commit"] or "uncommitted")[:12] + ("-dirty" if report["dirty"] else "")
+        output = RESULTS_DIR / f"{name}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,24 +11,229 @@ ENABLED_SENSES = [
 ]
 LOG_LEVEL = "INFO"
 LOG_FILE = "logs/nairo.log"
+# Hand log records to a background thread for formatting and disk writes
+LOG_QUEUE = True
+# Write the log file as JSON lines
+LOG_JSON = False
+# INFO/DEBUG records allowed per second from any single call site (burst allowance); 0 disables
+LOG_RATE_LIMIT_PER_SECOND = 5
+LOG_RATE_LIMIT_BURST = 20
+# A startup timeline is logged once every sense is ready, or after this long
+STARTUP_REPORT_TIMEOUT_SECONDS = 60
+# Import open-interpreter in the background after startup instead of on the first request
+PRELOAD_INTERPRETER = True
+# Also write a full metrics snapshot to the log this often (0 disables); live metrics are at /metrics
+METRICS_LOG_INTERVAL_SECONDS = 0
+# On shutdown, requests in flight are cancelled and given this long to stop before NAIRO exits anyway
+SHUTDOWN_TIMEOUT_SECONDS = 10
 
 # -- Model and API Keys --
 # Loaded from .env file
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 # Add other API keys here if needed
 
 # -- Interpreter Settings --
 MODEL_NAME = "gemini/gemini-2.5-flash-preview-09-2025"
+LOCAL_MODEL_NAME = "ollama/phi3:mini"
+# Ollama server for the local model; unset uses litellm's default (http://localhost:11434)
+LOCAL_MODEL_API_BASE = os.getenv("NAIRO_LOCAL_MODEL_API_BASE")
+# Context window and output limit per route, in tokens
+ONLINE_MODEL_CONTEXT_WINDOW = 16000
+LOCAL_MODEL_CONTEXT_WINDOW = 4096
+MODEL_MAX_TOKENS = 2048
+# Load the local model at startup and ping it this often so failover never waits for a cold load.
+# Keep-alive is how long Ollama keeps the model loaded after each request (an Ollama duration).
+LOCAL_MODEL_WARM_UP = True
+LOCAL_MODEL_KEEP_ALIVE = "10m"
+LOCAL_MODEL_KEEP_ALIVE_INTERVAL_SECONDS = 240
+LOCAL_MODEL_WARM_UP_TIMEOUT_SECONDS = 120
 INTERPRETER_AUTO_RUN = True
+# Number of independent interpreter instances per model route
+ONLINE_INTERPRETER_POOL_SIZE = 4
+LOCAL_INTERPRETER_POOL_SIZE = 1
+# Run interpreters in this many worker processes (0 runs them on threads in the main process).
+# Each (route, session) sticks to one worker; crashed workers are restarted.
+WORKER_PROCESSES = 0
+
+# -- Code Execution Sandbox --
+# Code the interpreter auto-runs (Python and shell only) executes in a pool of
+# pre-started sandbox processes instead of in the thread serving the request
+SANDBOX_ENABLED = True
+SANDBOX_POOL_SIZE = 2
+# Limits per run; a sandbox that breaks one is killed and replaced
+SANDBOX_WALL_TIMEOUT_SECONDS = 60
+SANDBOX_CPU_SECONDS = 30
+SANDBOX_MEMORY_MB = 1024
+# Output past this many characters is cut off before it reaches the model
+SANDBOX_MAX_OUTPUT_CHARS = 20000
+# A sandbox is replaced by a fresh one after this many runs
+SANDBOX_MAX_EXECUTIONS = 50
+
+# -- Discord Sense Settings --
+# Minimum time between edits of a streamed reply
+DISCORD_STREAM_EDIT_INTERVAL_SECONDS = 1.0
+# Outside DMs, only answer mentions and messages starting with the prefix unless this is set
+DISCORD_RESPOND_TO_ALL = False
+DISCORD_COMMAND_PREFIX = "!nairo"
+# A burst of messages from one author in one channel is folded into a single prompt
+# once they have been quiet this long (or the burst reaches the message cap)
+DISCORD_DEBOUNCE_SECONDS = 1.5
+DISCORD_DEBOUNCE_MAX_MESSAGES = 10
+# Model calls allowed in flight per channel
+DISCORD_CHANNEL_CONCURRENCY = 1
+# Outbound sends and edits per channel, paced to Discord's per-channel rate limit
+DISCORD_SEND_RATE_LIMIT = 5
+DISCORD_SEND_RATE_PERIOD_SECONDS = 5.0
+# Run the bot as an AutoShardedClient, one gateway connection per shard (required past 2,500 servers)
+DISCORD_SHARDING = False
+# Total shard count; None uses the count Discord recommends for the bot's server count
+DISCORD_SHARD_COUNT = None
+# 0 runs every shard in this process. Otherwise shards are split into groups of this
+# size, each run by its own process with its own model-call budget, so more servers
+# mean more processes.
+DISCORD_SHARDS_PER_PROCESS = 0
+# Model calls each shard process runs at once
+DISCORD_SHARD_PROCESS_MODEL_CALLS = 2
+# How often the recommended shard count is checked again; the bot reshards when it
+# grows (only with DISCORD_SHARD_COUNT = None; 0 disables)
+DISCORD_RESHARD_CHECK_SECONDS = 3600
+# How often shard processes report their per-shard metrics to this process
+DISCORD_SHARD_METRICS_INTERVAL_SECONDS = 5
+
+# -- Email Sense Settings --
+# The mailbox NAIRO watches and answers from; the password is EMAIL_PASSWORD in .env
+EMAIL_ADDRESS = os.getenv("NAIRO_EMAIL_ADDRESS")
+# Login name for both servers, if it is not the address
+EMAIL_USERNAME = os.getenv("NAIRO_EMAIL_USERNAME") or EMAIL_ADDRESS
+EMAIL_IMAP_HOST = os.getenv("NAIRO_EMAIL_IMAP_HOST")
+EMAIL_IMAP_PORT = 993
+# Turn off (and use port 143) for a server without TLS, such as a local stand-in
+EMAIL_IMAP_SSL = True
+EMAIL_MAILBOX = "INBOX"
+EMAIL_SMTP_HOST = os.getenv("NAIRO_EMAIL_SMTP_HOST")
+EMAIL_SMTP_PORT = 587
+# "starttls", "ssl" or "none"
+EMAIL_SMTP_SECURITY = "starttls"
+# SMTP connections kept open and reused for replies
+EMAIL_SMTP_POOL_SIZE = 2
+# New messages fetched per IMAP request
+EMAIL_FETCH_BATCH_SIZE = 50
+# IMAP IDLE is re-issued this often, inside the 29 minutes servers allow (RFC 2177)
+EMAIL_IDLE_SECONDS = 1500
+# Servers without IDLE support are polled this often instead
+EMAIL_POLL_SECONDS = 60
+EMAIL_TIMEOUT_SECONDS = 30
+EMAIL_RECONNECT_SECONDS = 30
+# Model calls tried per email before giving up on it, and the wait between tries
+# after a failed or timed-out answer (an overloaded scheduler sets its own wait)
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_SECONDS = 60
+# Only answer these senders (case-insensitive). Nobody is answered until this is set:
+# with INTERPRETER_AUTO_RUN on, whoever NAIRO answers can run code on this machine.
+# ["*"] answers every sender.
+EMAIL_ALLOWED_SENDERS = []
+# Only answer mail whose receiving server recorded a DMARC pass for the sender's
+# domain (Authentication-Results), since a From: address alone is easily forged
+EMAIL_REQUIRE_DMARC_PASS = True
 
 # -- Network Settings --
-INTERNET_CHECK_INTERVAL_SECONDS = 60
+# Connectivity is mostly judged from real model calls; probes are a fallback.
+# Probe interval while the online route is healthy
+INTERNET_CHECK_INTERVAL_SECONDS = 300
+# While offline, probes back off exponentially between these bounds
+CONNECTIVITY_OFFLINE_PROBE_MIN_SECONDS = 2
+CONNECTIVITY_OFFLINE_PROBE_MAX_SECONDS = 120
+CONNECTIVITY_PROBE_URL = os.getenv("NAIRO_CONNECTIVITY_PROBE_URL", "https://www.google.com")
+CONNECTIVITY_PROBE_TIMEOUT_SECONDS = 3
+# Circuit breaker over recent online model calls
+CIRCUIT_BREAKER_WINDOW = 10
+CIRCUIT_BREAKER_MIN_CALLS = 3
+CIRCUIT_BREAKER_FAILURE_RATE = 0.5
+# Calls slower than this count as failures
+CIRCUIT_BREAKER_SLOW_CALL_SECONDS = 45
 
 # -- Database and Memory --
 DATABASE_PATH = "nairo.db"
-MEMORY_FILE_PATH = "memory.txt"
+DATABASE_READ_POOL_SIZE = 2
+DATABASE_VALUE_CACHE_SIZE = 1024
+# Maximum number of queued writes committed in one transaction
+DATABASE_WRITE_BATCH_SIZE = 256
+# Memory-mapped copy of the long-term memory index, used once it outgrows the threshold below
+MEMORY_FILE_PATH = "memory.f32"
+
+# -- Long-Term Memory --
+# Every answered exchange is embedded and stored in the database; the most similar
+# past exchanges are shown to the model ahead of each prompt.
+LONG_TERM_MEMORY_ENABLED = True
+# "session" only recalls a session's own exchanges, "global" recalls across all sessions
+LONG_TERM_MEMORY_SCOPE = "session"
+LONG_TERM_MEMORY_TOP_K = 3
+# Minimum cosine similarity for a memory to be recalled
+LONG_TERM_MEMORY_MIN_SCORE = 0.3
+# Embedding function as "module:function", mapping a list of texts to an array of shape
+# (len(texts), dim). Unset uses a built-in hashing embedding that needs no model.
+LONG_TERM_MEMORY_EMBEDDING_FUNCTION = None
+LONG_TERM_MEMORY_EMBEDDING_DIM = 256
+LONG_TERM_MEMORY_MMAP_THRESHOLD_MB = 64
+
+# -- Conversation History --
+# Per-session histories are persisted in the database. Once a session's history
+# (plus its summary) exceeds the token budget, its oldest turns are folded into a
+# short summary, so every prompt carries at most this much context.
+CONVERSATION_TOKEN_BUDGET = 3000
+CONVERSATION_SUMMARY_TOKEN_BUDGET = 400
+# Sessions whose histories are kept in memory (least recently used are reloaded on demand)
+CONVERSATION_CACHE_SIZE = 256
+
+# -- Hedged Routing --
+# If the online model has not answered (or, when streaming, started answering)
+# within the hedge delay, the local model is raced against it.
+HEDGING_ENABLED = True
+# Static hedge delay, used until enough online latencies have been observed
+HEDGE_DELAY_SECONDS = 8
+# Afterwards the delay tracks this percentile of recent online latencies, clamped
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY_SECONDS = 2
+HEDGE_MAX_DELAY_SECONDS = 20
+# Deadline for a request to be answered (or, when streamed, to start) by either route
+MODEL_REQUEST_DEADLINE_SECONDS = 120
+# Per-sense overrides of the deadline above, e.g. {"web": 60}
+REQUEST_DEADLINES = {}
+
+# -- Response Cache --
+# Deterministic answers (temperature 0.0, no code execution) are reused for identical prompts
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_TTL_SECONDS = 60 * 60
+
+# -- Model Scheduler --
+# Size of the dedicated thread pool for blocking model calls (one slot per thread)
+SCHEDULER_MAX_WORKERS = 8
+# Per-sense admission settings. A higher weight gets a proportionally larger share
+# of slots under contention; requests beyond `max_queue`, or waiting longer than
+# `queue_timeout_seconds`, are rejected as overloaded.
+SCHEDULER_SENSES = {
+    "web": {"weight": 3, "max_queue": 32, "queue_timeout_seconds": 30},
+    "discord_bot": {"weight": 1, "max_queue": 64, "queue_timeout_seconds": 60},
+    "email": {"weight": 1, "max_queue": 128, "queue_timeout_seconds": 300},
+}
+SCHEDULER_DEFAULT_SENSE = {"weight": 1, "max_queue": 16, "queue_timeout_seconds": 30}
+
+# -- Request Coalescing --
+# Per sense: "session" shares an identical in-flight prompt only within the same
+# conversation (e.g. one Discord channel), "global" across those of the sense's
+# conversations whose context matches, "off" disables it.
+REQUEST_COALESCING = {
+    "web": "session",
+    "discord_bot": "session",
+    "email": "session",
+}
 
 # -- Web Sense Settings --
 WEB_HOST = "127.0.0.1"
 WEB_PORT = 5000
+# Prompts a single chat WebSocket connection may have in flight at once
+WEB_SOCKET_MAX_IN_FLIGHT = 4
@@ -0,0 +1,26 @@
+import contextlib
+import threading
+from typing import Optional
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def scope(event: threading.Event):
+    """
+    Makes `event` the cancellation signal of blocking work run on this thread.
+    Code deep inside the interpreter (such as the code sandbox) checks it with
+    `requested` and stops early once it is set.
+    """
+    previous: Optional[threading.Event] = getattr(_local, "event", None)
+    _local.event = event
+    try:
+        yield event
+    finally:
+        _local.event = previous
+
+
+def requested() -> bool:
+    """True if the request this thread is working for has been cancelled."""
+    event = getattr(_local, "event", None)
+    return event is not None and event.is_set()
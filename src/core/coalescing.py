@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List
+
+log = logging.getLogger(__name__)
+
+
+class _SharedStream:
+    """Buffers the chunks of one in-flight stream so late subscribers can replay them."""
+
+    def __init__(self):
+        self.chunks: List = []
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class RequestCoalescer:
+    """
+    Single-flight deduplication for identical concurrent requests.
+
+    Callers that arrive while a request with the same key is still in flight
+    attach to it and share its result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Whether a call or stream with this key is currently running."""
+        return key in self._calls or key in self._streams
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        """
+        Awaits `factory()` unless a call with the same key is already running,
+        in which case that call's result is returned. The call is cancelled once
+        every caller waiting on it has been cancelled.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            log.info(f"Coalesced a duplicate in-flight request ({self.coalesced} so far).")
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Shielded so one caller giving up does not cancel the call for the others
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                if not task.done():
+                    task.cancel()
+
+    async def stream(self, key: Hashable, factory: Callable):
+        """
+        Async generator variant of `run` for streaming responses. Subscribers that
+        join late first receive the chunks produced so far. The underlying stream
+        is cancelled once every subscriber has gone away.
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            self.leaders += 1
+            shared = _SharedStream()
+            self._streams[key] = shared
+            shared.task = asyncio.ensure_future(self._pump(key, shared, factory))
+        else:
+            self.coalesced += 1
+            log.info(f"Coalesced a duplicate in-flight stream ({self.coalesced} so far).")
+
+        shared.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with shared.changed:
+                    await shared.changed.wait_for(
+                        lambda: index < len(shared.chunks) or shared.done
+                    )
+                    pending = shared.chunks[index:]
+                    finished = shared.done
+                for chunk in pending:
+                    yield chunk
+                index += len(pending)
+                if finished and index >= len(shared.chunks):
+                    break
+            if shared.error is not None:
+                raise shared.error
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                shared.task.cancel()
+
+    async def _pump(self, key: Hashable, shared: _SharedStream, factory: Callable):
+        source = factory()
+        try:
+            async for chunk in source:
+                async with shared.changed:
+                    shared.chunks.append(chunk)
+                    shared.changed.notify_all()
+        except Exception as e:
+            shared.error = e
+        finally:
+            await source.aclose()
+            self._streams.pop(key, None)
+            shared.done = True
+            async with shared.changed:
+                shared.changed.notify_all()
+
+    def stats(self) -> dict:
+        """Leader/coalesced counters for logging and metrics."""
+        return {"leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,89 @@
+import logging
+from collections import deque
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of the online model route from the outcomes of real calls.
+
+    Outcomes are kept in a sliding window. Slow calls count as failures. The
+    breaker opens once the failure rate over at least `min_calls` calls reaches
+    `failure_rate_threshold`. While open, only a successful probe can move it to
+    half-open. In half-open the next real call decides whether it closes again
+    or re-opens.
+    """
+
+    def __init__(
+        self,
+        window_size: int,
+        min_calls: int,
+        failure_rate_threshold: float,
+        slow_call_seconds: float,
+        on_state_change: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.on_state_change = on_state_change
+        self.state = OPEN  # Nothing is known to work until the first probe or call succeeds
+        self._outcomes: deque = deque(maxlen=window_size)
+        self.trips = 0
+
+    @property
+    def allows_requests(self) -> bool:
+        return self.state != OPEN
+
+    def _transition(self, state: str, reason: str):
+        if state == self.state:
+            return
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self.trips += 1
+        self._outcomes.clear()
+        log.info(f"Circuit breaker {previous} -> {state}: {reason}")
+        if self.on_state_change is not None:
+            self.on_state_change(previous, state)
+
+    def record_success(self, latency: float):
+        """Records a completed call and how long it took."""
+        if latency > self.slow_call_seconds:
+            self._record(False, f"slow call ({latency:.1f}s)")
+            return
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED, "trial call succeeded")
+            return
+        self._outcomes.append(True)
+
+    def record_failure(self, reason: str = "call failed"):
+        """Records a failed or timed-out call."""
+        self._record(False, reason)
+
+    def _record(self, success: bool, reason: str):
+        if self.state == HALF_OPEN:
+            self._transition(OPEN, f"trial call failed: {reason}")
+            return
+        self._outcomes.append(success)
+        failures = self._outcomes.count(False)
+        if (
+            self.state == CLOSED
+            and len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_rate_threshold
+        ):
+            self._transition(OPEN, f"{failures}/{len(self._outcomes)} recent calls failed, last: {reason}")
+
+    def probe_succeeded(self):
+        """A connectivity probe got through."""
+        if self.state == OPEN:
+            self._transition(HALF_OPEN, "probe succeeded")
+
+    def probe_failed(self, reason: str):
+        """A connectivity probe failed, which means the online route is unreachable."""
+        self._transition(OPEN, f"probe failed: {reason}")
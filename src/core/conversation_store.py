@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+
+from core import metrics
+
+log = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio; close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+# Fixed per-message overhead (role, type and framing)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Longest excerpt of a user prompt or an answer kept in the summary of a trimmed turn
+SUMMARY_EXCERPT_CHARS = 200
+
+CONTEXT_TOKENS = metrics.histogram(
+    "nairo_context_tokens", "Estimated tokens of conversation history sent with a prompt.",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+
+
+def estimate_tokens(message: dict) -> int:
+    """Estimates how many tokens an interpreter message costs in the prompt."""
+    content = message.get("content", "")
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    return len(content) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def _excerpt(text: str) -> str:
+    text = " ".join(str(text).split())
+    if len(text) <= SUMMARY_EXCERPT_CHARS:
+        return text
+    return text[:SUMMARY_EXCERPT_CHARS].rsplit(" ", 1)[0] + "..."
+
+
+class _Conversation:
+    def __init__(self, summary: str = "", first_position: int = 0):
+        self.summary = summary
+        self.summary_tokens = len(summary) // CHARS_PER_TOKEN
+        self.messages: List[dict] = []
+        self.tokens: List[int] = []
+        self.total_tokens = 0
+        # Position of messages[0] in the session's full history, used as the storage key
+        self.first_position = first_position
+
+    @property
+    def next_position(self) -> int:
+        return self.first_position + len(self.messages)
+
+    def add(self, message: dict, tokens: int):
+        self.messages.append(message)
+        self.tokens.append(tokens)
+        self.total_tokens += tokens
+
+    def second_turn_start(self) -> Optional[int]:
+        """Index where the second turn begins, or None if only one turn is held."""
+        for i, message in enumerate(self.messages[1:], start=1):
+            if message.get("role") == "user":
+                return i
+        return None
+
+
+class ConversationStore:
+    """
+    Conversation history per session, kept within a token budget.
+
+    Every message carries an estimated token count and each conversation keeps a
+    running total. When a conversation outgrows `token_budget`, its oldest turns
+    are folded into a short extractive summary (itself capped at
+    `summary_token_budget`), so the context sent with every prompt stays bounded
+    however long a session runs.
+
+    Histories are persisted through `core.database.Database` when one is given,
+    and the most recently used `max_cached_sessions` are kept in memory. Without
+    a database nothing is evicted.
+    """
+
+    def __init__(self, token_budget: int, summary_token_budget: int, max_cached_sessions: int, database=None):
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.max_cached_sessions = max_cached_sessions
+        self.database = database
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._loading = {}  # session id -> asyncio.Task
+        self.trimmed_turns = 0
+
+    async def _get(self, session_id: str) -> _Conversation:
+        conversation = self._conversations.get(session_id)
+        if conversation is not None:
+            self._conversations.move_to_end(session_id)
+            return conversation
+
+        if self.database is None:
+            conversation = _Conversation()
+        else:
+            # Concurrent first requests for a session share one load
+            task = self._loading.get(session_id)
+            if task is None:
+                task = self._loading[session_id] = asyncio.ensure_future(self._load(session_id))
+                task.add_done_callback(lambda _: self._loading.pop(session_id, None))
+            conversation = await task
+            if session_id in self._conversations:
+                return self._conversations[session_id]
+
+        self._conversations[session_id] = conversation
+        if self.database is not None:
+            while len(self._conversations) > self.max_cached_sessions:
+                self._conversations.popitem(last=False)
+        return conversation
+
+    async def _load(self, session_id: str) -> _Conversation:
+        try:
+            summary, rows = await self.database.load_conversation(session_id)
+        except Exception as e:
+            log.warning(f"Failed to load the conversation for session '{session_id}': {e}")
+            return _Conversation()
+        conversation = _Conversation(summary, rows[0][0] if rows else 0)
+        for _, message, tokens in rows:
+            conversation.add(json.loads(message), tokens)
+        return conversation
+
+    async def context(self, session_id: str) -> List[dict]:
+        """
+        Returns the history to send with the next prompt of `session_id`, with
+        the summary of trimmed turns folded into its first message.
+        """
+        conversation = await self._get(session_id)
+        messages = list(conversation.messages)
+        tokens = conversation.total_tokens + conversation.summary_tokens
+        if tokens > self.token_budget:
+            # A single turn larger than the whole budget is not resent
+            messages, tokens = [], conversation.summary_tokens
+        if conversation.summary:
+            note = f"(Summary of our earlier conversation:\n{conversation.summary})"
+            if messages and messages[0].get("role") == "user" and isinstance(messages[0].get("content"), str):
+                messages[0] = {**messages[0], "content": f"{note}\n\n{messages[0]['content']}"}
+            else:
+                messages.insert(0, {"role": "user", "type": "message", "content": note})
+        CONTEXT_TOKENS.observe(tokens)
+        return messages
+
+    async def append(self, session_id: str, messages: List[dict]):
+        """Adds the messages of a completed turn and trims the session back under budget."""
+        if not messages:
+            return
+        conversation = await self._get(session_id)
+        rows = []
+        for message in messages:
+            tokens = estimate_tokens(message)
+            rows.append((conversation.next_position, json.dumps(message), tokens))
+            conversation.add(message, tokens)
+        if self.database is not None:
+            await self.database.append_conversation_messages(session_id, rows)
+
+        trimmed = 0
+        while conversation.total_tokens + conversation.summary_tokens > self.token_budget:
+            end = conversation.second_turn_start()
+            if end is None:
+                break
+            self._fold(conversation, end)
+            trimmed += 1
+        if trimmed:
+            self.trimmed_turns += trimmed
+            log.debug(f"Folded {trimmed} old turn(s) of session '{session_id}' into its summary.")
+            if self.database is not None:
+                await self.database.trim_conversation(
+                    session_id, conversation.first_position, conversation.summary
+                )
+
+    def _fold(self, conversation: _Conversation, end: int):
+        """Replaces the first `end` messages (one turn) with a line in the summary."""
+        turn = conversation.messages[:end]
+        prompt = next((m.get("content", "") for m in turn if m.get("role") == "user"), "")
+        answer = next(
+            (
+                m.get("content", "") for m in turn
+                if m.get("role") == "assistant" and m.get("type", "message") == "message"
+            ),
+            "",
+        )
+        line = f"- Sir: {_excerpt(prompt)}"
+        if answer:
+            line += f" / NAIRO: {_excerpt(answer)}"
+
+        lines = conversation.summary.splitlines() + [line]
+        while len(lines) > 1 and len("\n".join(lines)) // CHARS_PER_TOKEN > self.summary_token_budget:
+            lines.pop(0)
+        conversation.summary = "\n".join(lines)
+        conversation.summary_tokens = len(conversation.summary) // CHARS_PER_TOKEN
+
+        conversation.total_tokens -= sum(conversation.tokens[:end])
+        del conversation.messages[:end]
+        del conversation.tokens[:end]
+        conversation.first_position += end
+
+    def stats(self) -> dict:
+        """Cached sessions, tokens they hold and turns folded into summaries so far."""
+        return {
+            "cached_sessions": len(self._conversations),
+            "cached_tokens": sum(c.total_tokens + c.summary_tokens for c in self._conversations.values()),
+            "trimmed_turns": self.trimmed_turns,
+        }
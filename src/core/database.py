@@ -1,31 +1,311 @@
 # For future database logic
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict
 import aiosqlite
 
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
 class Database:
-    def __init__(self, db_path):
+    """
+    SQLite store backed by one long-lived WAL-mode connection for writes and a
+    small pool of read connections.
+
+    Writes are queued and flushed by a background task that groups everything
+    pending into a single transaction. `get_value` is served through a
+    read-through cache that is updated as soon as a write is queued, so callers
+    always read their own writes.
+    """
+
+    def __init__(self, db_path, read_pool_size=2, value_cache_size=1024, write_batch_size=256):
         self.db_path = db_path
+        # An in-memory database is private to its connection, so reads must share the writer
+        self.read_pool_size = 0 if db_path == ":memory:" else read_pool_size
+        self.value_cache_size = value_cache_size
+        self.write_batch_size = write_batch_size
+        self._writer = None
+        self._readers = []
+        self._read_pool: asyncio.Queue = asyncio.Queue()
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        # Writes queued and writes done so far; writes are done in queue order
+        self._writes_queued = 0
+        self._writes_done = 0
+        self._writes_done_changed = asyncio.Condition()
+        self._flusher_task = None
+        self._value_cache: "OrderedDict[str, object]" = OrderedDict()
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.db_path, cached_statements=256)
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA busy_timeout=5000")
+        return db
 
     async def initialize(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS memory (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    key TEXT NOT NULL UNIQUE,
-                    value TEXT NOT NULL
-                )
-            """)
-            await db.commit()
+        self._writer = await self._connect()
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS memory (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                value TEXT NOT NULL
+            )
+        """)
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                updated_at REAL NOT NULL
+            )
+        """)
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                session_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (session_id, position)
+            )
+        """)
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS memory_embeddings (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL DEFAULT '',
+                embedder TEXT NOT NULL,
+                embedding BLOB NOT NULL
+            )
+        """)
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS processed_emails (
+                message_id TEXT PRIMARY KEY,
+                processed_at REAL NOT NULL
+            )
+        """)
+        await self._writer.commit()
+
+        for _ in range(self.read_pool_size):
+            reader = await self._connect()
+            self._readers.append(reader)
+            self._read_pool.put_nowait(reader)
+
+        self._flusher_task = asyncio.create_task(self._flush_writes())
+        self._flusher_task.set_name("DatabaseWriteBehind")
+        log.info(f"Database opened at {self.db_path} with {self.read_pool_size} read connection(s).")
+
+    async def close(self):
+        """Flushes queued writes and closes every connection."""
+        if self._writer is None:
+            return
+        await self.flush()
+        if self._flusher_task is not None:
+            self._flusher_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flusher_task
+            self._flusher_task = None
+        for reader in self._readers:
+            await reader.close()
+        self._readers.clear()
+        await self._writer.close()
+        self._writer = None
+        log.info("Database closed.")
+
+    async def flush(self):
+        """
+        Waits until every write queued before the call has been committed. Writes
+        queued meanwhile are not waited for, so a flush ends even under steady load.
+        """
+        target = self._writes_queued
+        async with self._writes_done_changed:
+            await self._writes_done_changed.wait_for(lambda: self._writes_done >= target)
+
+    def _queue_write(self, sql, params):
+        self._write_queue.put_nowait((sql, params))
+        self._writes_queued += 1
+
+    async def _flush_writes(self):
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < self.write_batch_size and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            try:
+                if len(batch) == 1:
+                    await self._write_alone(*batch[0])
+                    continue
+                try:
+                    for sql, params in batch:
+                        await self._writer.execute(sql, params)
+                    await self._writer.commit()
+                except Exception as e:
+                    with contextlib.suppress(Exception):
+                        await self._writer.rollback()
+                    # One bad write must not cost the rest of the batch, so replay them one by one
+                    log.warning(f"A batch of {len(batch)} database writes failed ({e}). Retrying them one at a time.")
+                    for sql, params in batch:
+                        await self._write_alone(sql, params)
+            finally:
+                async with self._writes_done_changed:
+                    self._writes_done += len(batch)
+                    self._writes_done_changed.notify_all()
+
+    async def _write_alone(self, sql, params):
+        """Commits one write in its own transaction, dropping it (with a log) if it fails."""
+        try:
+            await self._writer.execute(sql, params)
+            await self._writer.commit()
+        except Exception:
+            log.exception(f"Dropped a database write that failed: {' '.join(sql.split())[:120]}")
+            with contextlib.suppress(Exception):
+                await self._writer.rollback()
+
+    @contextlib.asynccontextmanager
+    async def _reader(self):
+        if not self._readers:
+            yield self._writer
+            return
+        reader = await self._read_pool.get()
+        try:
+            yield reader
+        finally:
+            self._read_pool.put_nowait(reader)
+
+    async def _fetchone(self, sql, params):
+        async with self._reader() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def _fetchall(self, sql, params):
+        async with self._reader() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    def _cache_value(self, key, value):
+        self._value_cache[key] = value
+        self._value_cache.move_to_end(key)
+        while len(self._value_cache) > self.value_cache_size:
+            self._value_cache.popitem(last=False)
 
     async def set_value(self, key, value):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "INSERT OR REPLACE INTO memory (key, value) VALUES (?, ?)",
-                (key, value)
-            )
-            await db.commit()
+        self._cache_value(key, value)
+        self._queue_write(
+            "INSERT OR REPLACE INTO memory (key, value) VALUES (?, ?)",
+            (key, value)
+        )
 
     async def get_value(self, key):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT value FROM memory WHERE key = ?", (key,)) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else None
+        cached = self._value_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            self._value_cache.move_to_end(key)
+            return cached
+        row = await self._fetchone("SELECT value FROM memory WHERE key = ?", (key,))
+        value = row[0] if row else None
+        self._cache_value(key, value)
+        return value
+
+    async def get_cached_response(self, key, max_age):
+        row = await self._fetchone(
+            "SELECT response FROM response_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - max_age)
+        )
+        return row[0] if row else None
+
+    async def set_cached_response(self, key, response):
+        self._queue_write(
+            "INSERT OR REPLACE INTO response_cache (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, time.time())
+        )
+
+    async def purge_cached_responses(self, max_age):
+        self._queue_write(
+            "DELETE FROM response_cache WHERE created_at < ?",
+            (time.time() - max_age,)
+        )
+
+    async def load_conversation(self, session_id):
+        """Returns `(summary, [(position, message_json, tokens), ...])` for a session."""
+        # Conversations are not read-through cached, so queued writes must land first
+        await self.flush()
+        row = await self._fetchone("SELECT summary FROM conversations WHERE session_id = ?", (session_id,))
+        rows = await self._fetchall(
+            "SELECT position, message, tokens FROM conversation_messages WHERE session_id = ? ORDER BY position",
+            (session_id,)
+        )
+        return (row[0] if row else ""), rows
+
+    async def append_conversation_messages(self, session_id, rows):
+        """Queues `(position, message_json, tokens)` rows for a session."""
+        self._queue_write(
+            "INSERT INTO conversations (session_id, updated_at) VALUES (?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (session_id, time.time())
+        )
+        for position, message, tokens in rows:
+            self._queue_write(
+                "INSERT OR REPLACE INTO conversation_messages (session_id, position, message, tokens) VALUES (?, ?, ?, ?)",
+                (session_id, position, message, tokens)
+            )
+
+    async def trim_conversation(self, session_id, first_position, summary):
+        """Drops a session's messages before `first_position` and stores its new summary."""
+        self._queue_write(
+            "DELETE FROM conversation_messages WHERE session_id = ? AND position < ?",
+            (session_id, first_position)
+        )
+        self._queue_write(
+            "UPDATE conversations SET summary = ?, updated_at = ? WHERE session_id = ?",
+            (summary, time.time(), session_id)
+        )
+
+    async def set_memory(self, key, value, scope, embedder, embedding):
+        """Stores a long-term memory in the memory table with its float32 embedding bytes."""
+        await self.set_value(key, value)
+        self._queue_write(
+            "INSERT OR REPLACE INTO memory_embeddings (key, scope, embedder, embedding) VALUES (?, ?, ?, ?)",
+            (key, scope, embedder, embedding)
+        )
+
+    async def iter_memory_embeddings(self, embedder, batch_size=1024):
+        """Yields batches of `(key, scope, embedding)` rows made by `embedder`, oldest memory first."""
+        await self.flush()
+        async with self._reader() as db:
+            async with db.execute(
+                "SELECT e.key, e.scope, e.embedding FROM memory_embeddings e JOIN memory m ON m.key = e.key "
+                "WHERE e.embedder = ? ORDER BY m.id",
+                (embedder,)
+            ) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    async def processed_email_ids(self, message_ids):
+        """Returns the ones among `message_ids` already recorded as processed."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+        await self.flush()
+        placeholders = ", ".join("?" * len(message_ids))
+        rows = await self._fetchall(
+            f"SELECT message_id FROM processed_emails WHERE message_id IN ({placeholders})",
+            message_ids
+        )
+        return {row[0] for row in rows}
+
+    async def mark_emails_processed(self, message_ids):
+        """Records email Message-IDs as processed, so they are never answered twice."""
+        processed_at = time.time()
+        for message_id in message_ids:
+            self._queue_write(
+                "INSERT OR IGNORE INTO processed_emails (message_id, processed_at) VALUES (?, ?)",
+                (message_id, processed_at)
+            )
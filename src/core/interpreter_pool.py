@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import logging
+from typing import Callable, List
+
+log = logging.getLogger(__name__)
+
+
+class InterpreterPool:
+    """
+    A bounded pool of independent interpreter instances for a single model route.
+
+    Instances are created lazily by `factory` (up to `size` of them), checked out
+    for the duration of one request and returned afterwards, so no two concurrent
+    requests ever touch the same interpreter state.
+    """
+
+    def __init__(self, route: str, factory: Callable, size: int):
+        if size < 1:
+            raise ValueError(f"Pool size for route '{route}' must be at least 1, got {size}.")
+        self.route = route
+        self.size = size
+        self._factory = factory
+        self._idle: List = []
+        self._slots = asyncio.Semaphore(size)
+        self._created = 0
+
+    @property
+    def in_use(self) -> int:
+        """Number of instances currently checked out."""
+        return self._created - len(self._idle)
+
+    async def acquire(self):
+        """
+        Waits for a free slot and returns an idle instance, creating one if needed.
+        """
+        await self._slots.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+            # Building an interpreter touches disk and imports plugins, keep it off the loop.
+            loop = asyncio.get_running_loop()
+            instance = await loop.run_in_executor(None, self._factory)
+            self._created += 1
+            log.debug(f"Created interpreter #{self._created} for route '{self.route}'.")
+            return instance
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def warm(self):
+        """Creates one idle instance ahead of the first request, unless one already exists."""
+        if self._created:
+            return
+        self.release(await self.acquire())
+
+    def release(self, instance):
+        """Returns an instance to the pool, dropping any per-request history."""
+        instance.messages = []
+        self._idle.append(instance)
+        self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def instance(self):
+        """Async context manager wrapping `acquire` and `release`."""
+        interpreter = await self.acquire()
+        try:
+            yield interpreter
+        finally:
+            self.release(interpreter)
@@ -0,0 +1,32 @@
+import contextlib
+from typing import Callable, Dict, Hashable, List
+
+
+class KeyedLocks:
+    """
+    One lock (or semaphore) per key, such as a session or channel, created on
+    first use and dropped again once nobody holds or waits on it, so keys that
+    come and go do not pile up.
+    """
+
+    def __init__(self, factory: Callable):
+        self._factory = factory
+        self._entries: Dict[Hashable, List] = {}  # key -> [lock, holders and waiters]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Hashable):
+        """Holds the lock for `key` for the duration of the block."""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [self._factory(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._entries[key]
@@ -0,0 +1,29 @@
+import math
+from collections import deque
+from typing import Optional
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent latency samples, in seconds, with percentile queries.
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Returns the nearest-rank `q`-th percentile (0-100) of the window,
+        or None if there are no samples yet.
+        """
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        return ordered[rank - 1]
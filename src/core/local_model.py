@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from core import metrics
+from core.route_profiles import RouteProfile
+
+log = logging.getLogger(__name__)
+
+PINGS = metrics.counter(
+    "nairo_local_model_pings_total", "Warm-up and keep-alive requests to the local model server.", ["result"]
+)
+
+
+async def ping_local_model(
+    session: aiohttp.ClientSession, profile: RouteProfile, keep_alive: str, timeout: float
+) -> bool:
+    """
+    Asks the Ollama server to load the profile's model, or keep it loaded, for
+    `keep_alive` (an Ollama duration such as "10m"). A generate request with an
+    empty prompt does exactly that without producing any tokens.
+    """
+    payload = {"model": profile.ollama_model, "prompt": "", "keep_alive": keep_alive, "stream": False}
+    try:
+        async with session.post(
+            f"{profile.ollama_api_base}/api/generate", json=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            response.raise_for_status()
+            await response.read()
+    except Exception as e:
+        PINGS.inc(result="failed")
+        log.debug(f"Local model ping failed: {e!r}")
+        return False
+    PINGS.inc(result="ok")
+    return True
+
+
+async def keep_local_model_warm(
+    shutdown_event: asyncio.Event, profile: RouteProfile, interval: float, keep_alive: str, timeout: float
+):
+    """
+    Loads the local model right away, then pings it every `interval` seconds so
+    a failover to the local route never waits for the model to load.
+    """
+    if not profile.is_ollama:
+        log.info(f"Local model {profile.model} is not served by Ollama; skipping warm-up.")
+        return
+
+    warm = None
+    async with aiohttp.ClientSession() as session:
+        while not shutdown_event.is_set():
+            started = time.perf_counter()
+            ok = await ping_local_model(session, profile, keep_alive, timeout)
+            if ok and warm is None:
+                log.info(f"Local model {profile.model} warmed up in {time.perf_counter() - started:.1f}s.")
+            elif ok and not warm:
+                log.info(f"Local model server at {profile.ollama_api_base} is reachable again.")
+            elif not ok and warm is not False:
+                log.warning(f"Could not warm up local model {profile.model} at {profile.ollama_api_base}.")
+            warm = ok
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
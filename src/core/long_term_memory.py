@@ -0,0 +1,296 @@
+import asyncio
+import contextlib
+import functools
+import glob
+import hashlib
+import importlib
+import itertools
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core import metrics
+
+log = logging.getLogger(__name__)
+
+SEARCH_SECONDS = metrics.histogram(
+    "nairo_memory_search_seconds", "Time to embed a prompt and search long-term memory."
+)
+
+# Rows the matrix starts with; capacity doubles from there
+INITIAL_CAPACITY = 64
+LOAD_BATCH_SIZE = 1024
+# Longest excerpt of a prompt or answer kept in a remembered exchange
+TURN_EXCERPT_CHARS = 300
+
+_WORD = re.compile(r"\w+")
+# Words too common to say anything about what a text is about
+_STOP_WORDS = frozenset("""
+    a about am an and are as asked at be been but by can could did do does for from had has have he her
+    here him his how i if in into is it its just let me my no not of on or our please she sir so that the
+    their them then there these they this to too up us was we were what when where which who why will
+    with would you answered your
+""".split())
+
+
+def hashing_embedding(texts: Sequence[str], dim: int = 256) -> np.ndarray:
+    """
+    A local embedding that needs no model: words other than stop words, and
+    pairs of them, are hashed into `dim` signed buckets. It only captures shared
+    vocabulary, but it works offline and gives the same vectors in every process.
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = [word for word in _WORD.findall(text.lower()) if word not in _STOP_WORDS]
+        for feature in itertools.chain(words, map(" ".join, zip(words, words[1:]))):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            matrix[row, digest % dim] += 1.0 if digest >> 63 else -1.0
+    return matrix
+
+
+def load_embedding_function(spec: Optional[str], dim: int) -> Tuple[str, Callable]:
+    """
+    Returns `(name, function)` for an embedding function given as "module:function",
+    or the built-in hashing embedding when `spec` is empty. The function maps a
+    list of texts to an array of shape (len(texts), dim); the name is stored with
+    each embedding so vectors from another function are never mixed in.
+    """
+    if not spec:
+        return f"hashing-{dim}", functools.partial(hashing_embedding, dim=dim)
+    module_name, _, attribute = spec.partition(":")
+    return spec, getattr(importlib.import_module(module_name), attribute)
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class VectorIndex:
+    """
+    Unit-length float32 embeddings in one contiguous matrix, searched by cosine
+    similarity with a single matrix-vector product.
+
+    Rows are added in place and the capacity doubles when full, so indexing a
+    new memory costs O(dim). Once the matrix would outgrow `mmap_threshold_bytes`
+    it moves to a memory-mapped file next to `mmap_path`, leaving it to the OS
+    to page in what searches touch.
+    """
+
+    def __init__(self, dim: int, mmap_path: Optional[str] = None, mmap_threshold_bytes: int = 0):
+        self.dim = dim
+        self.mmap_path = mmap_path
+        self.mmap_threshold_bytes = mmap_threshold_bytes
+        self.keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._scope_ids: Dict[str, int] = {}
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._scopes = np.empty(0, dtype=np.int32)
+        self._mapped_file: Optional[str] = None
+        self._generation = 0
+        if mmap_path:
+            # Files an earlier run left behind (`<mmap_path>.<generation>`); the index is always rebuilt
+            # from the database. Files of other indexes, such as those of shard processes, are kept.
+            for stale in glob.glob(f"{glob.escape(mmap_path)}.*"):
+                if stale[len(mmap_path) + 1:].isdigit():
+                    with contextlib.suppress(OSError):
+                        os.remove(stale)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def memory_mapped(self) -> bool:
+        return self._mapped_file is not None
+
+    def _reserve(self, count: int):
+        if count <= len(self._matrix):
+            return
+        capacity = max(count, 2 * len(self._matrix), INITIAL_CAPACITY)
+        used = len(self.keys)
+        if self.mmap_path and capacity * self.dim * 4 > self.mmap_threshold_bytes:
+            self._generation += 1
+            path = f"{self.mmap_path}.{self._generation}"
+            matrix = np.memmap(path, dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+        else:
+            path, matrix = None, np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:used] = self._matrix[:used]
+        scopes = np.empty(capacity, dtype=np.int32)
+        scopes[:used] = self._scopes[:used]
+        previous = self._mapped_file
+        self._matrix, self._scopes, self._mapped_file = matrix, scopes, path
+        if previous is not None:
+            # Searches still holding the old mapping keep it alive; where the OS refuses, it goes at close
+            with contextlib.suppress(OSError):
+                os.remove(previous)
+        if path is not None and previous is None:
+            log.info(f"Long-term memory index moved to memory-mapped file {path}.")
+
+    def _scope_id(self, scope: str) -> int:
+        return self._scope_ids.setdefault(scope, len(self._scope_ids))
+
+    def add(self, keys: Sequence[str], vectors: np.ndarray, scopes: Sequence[str]):
+        """Indexes rows of `vectors` under `keys`, replacing the vector of keys already present."""
+        vectors = _normalise(np.asarray(vectors).reshape(len(keys), self.dim))
+        self._reserve(len(self.keys) + len(keys))
+        for key, vector, scope in zip(keys, vectors, scopes):
+            row = self._rows.get(key)
+            new = row is None
+            if new:
+                row = len(self.keys)
+            self._matrix[row] = vector
+            self._scopes[row] = self._scope_id(scope)
+            if new:
+                # Published only once the row is written, as searches read up to `len(self.keys)`
+                self._rows[key] = row
+                self.keys.append(key)
+
+    def search(self, query: np.ndarray, k: int, scope: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Returns up to `k` `(key, cosine similarity)` pairs, most similar first."""
+        # Snapshot first: rows may be added while a search runs in another thread
+        count = len(self.keys)
+        matrix, scopes = self._matrix, self._scopes
+        if not count or k < 1:
+            return []
+        scores = matrix[:count] @ _normalise(query)
+        if scope is not None:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                return []
+            scores = np.where(scopes[:count] == scope_id, scores, -np.inf)
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+    def close(self):
+        """Drops the matrix and removes its memory-mapped file, if any."""
+        path = self._mapped_file
+        self.keys, self._rows = [], {}
+        self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        self._scopes = np.empty(0, dtype=np.int32)
+        self._mapped_file = None
+        if path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+
+class LongTermMemory:
+    """
+    Memories kept in the database's `memory` table, each with an embedding in
+    `memory_embeddings`, recalled by similarity to a prompt.
+
+    The embeddings are loaded once into a `VectorIndex` (on the first search or
+    through `load`) and new memories are added to it as they are stored. Only
+    the keys of the best matches are looked up in the database afterwards.
+    """
+
+    def __init__(
+        self,
+        database,
+        embedding_function: Optional[str] = None,
+        dim: int = 256,
+        mmap_path: Optional[str] = None,
+        mmap_threshold_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.database = database
+        self.embedder, self._embed = load_embedding_function(embedding_function, dim)
+        self.mmap_path = mmap_path
+        self.mmap_threshold_bytes = mmap_threshold_bytes
+        self.index: Optional[VectorIndex] = None
+        self._load_task: Optional[asyncio.Task] = None
+
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self._embed(texts), dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(texts):
+            raise ValueError(f"Embedding function {self.embedder} returned an array of shape {vectors.shape}.")
+        return _normalise(vectors)
+
+    async def _load(self):
+        started = time.perf_counter()
+        dim = (await asyncio.to_thread(self._embed_texts, [""])).shape[1]
+        index = VectorIndex(dim, self.mmap_path, self.mmap_threshold_bytes)
+        async for rows in self.database.iter_memory_embeddings(self.embedder, LOAD_BATCH_SIZE):
+            keys, scopes, blobs = zip(*rows)
+            vectors = np.frombuffer(b"".join(blobs), dtype=np.float32)
+            index.add(keys, vectors.reshape(len(keys), dim), scopes)
+        self.index = index
+        log.info(
+            f"Loaded {len(index)} long-term memories ({self.embedder}, {dim} dimensions) "
+            f"in {time.perf_counter() - started:.2f}s."
+        )
+
+    async def load(self):
+        """Loads the index from the database; concurrent callers share one load."""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._load())
+        try:
+            await asyncio.shield(self._load_task)
+        except Exception:
+            # Let the next caller try again
+            self._load_task = None
+            raise
+
+    def __len__(self) -> int:
+        return len(self.index) if self.index is not None else 0
+
+    async def remember(self, text: str, scope: str = "", key: Optional[str] = None) -> str:
+        """Stores `text` (under `key`, or a new one) and indexes it. Returns the key."""
+        await self.load()
+        key = key or f"memory:{uuid.uuid4().hex}"
+        vector = (await asyncio.to_thread(self._embed_texts, [text]))[0]
+        await self.database.set_memory(key, text, scope, self.embedder, vector.tobytes())
+        self.index.add([key], vector[None, :], [scope])
+        return key
+
+    async def search(
+        self, text: str, k: int, min_score: float = 0.0, scope: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """Returns up to `k` `(memory text, score)` pairs at least `min_score` similar to `text`."""
+        await self.load()
+        if not len(self.index):
+            return []
+        with SEARCH_SECONDS.time():
+            matches = await asyncio.to_thread(self._search, text, k, scope)
+        results = []
+        for key, score in matches:
+            if score < min_score:
+                break
+            value = await self.database.get_value(key)
+            if value is not None:
+                results.append((value, score))
+        return results
+
+    def _search(self, text: str, k: int, scope: Optional[str]) -> List[Tuple[str, float]]:
+        return self.index.search(self._embed_texts([text])[0], k, scope)
+
+    def close(self):
+        """Releases the index and its memory-mapped file; the next search loads it again."""
+        index, self.index, self._load_task = self.index, None, None
+        if index is not None:
+            index.close()
+
+
+def format_memories(memories: Iterable[Tuple[str, float]]) -> str:
+    """Renders recalled memories as a note to put in front of the model."""
+    return "(Notes from earlier conversations that may be relevant:\n" + "\n".join(
+        f"- {text}" for text, _ in memories
+    ) + ")"
+
+
+def _excerpt(text: str) -> str:
+    text = " ".join(str(text).split())
+    if len(text) <= TURN_EXCERPT_CHARS:
+        return text
+    return text[:TURN_EXCERPT_CHARS].rsplit(" ", 1)[0] + "..."
+
+
+def format_turn(prompt: str, answer: str) -> str:
+    """The text remembered for one exchange."""
+    return f"Sir asked: {_excerpt(prompt)} / You answered: {_excerpt(answer)}"
@@ -0,0 +1,222 @@
+import asyncio
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """
+    Base for in-process metrics. Values are keyed by label values. They are
+    updated from executor threads as well as the event loop (sandboxes and
+    worker proxies run in threads), so updates and reads take the metric's lock.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._function: Optional[Callable] = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def set_function(self, function: Callable):
+        """
+        Computes the value at scrape time instead. `function` returns a number,
+        or a dict mapping label-value tuples to numbers for labelled metrics.
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            value = self._function()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+        else:
+            items = self.values().items()
+        for key, value in items:
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return lines
+
+    def values(self) -> dict:
+        """A copy of the current values, keyed by label values."""
+        with self._lock:
+            return dict(self._values)
+
+    def update(self, values: dict):
+        """Replaces the values of the label sets in `values`."""
+        with self._lock:
+            self._values.update(values)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, the +Inf overflow, sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bucket] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the wall-clock duration of the block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def values(self) -> dict:
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, (counts, total, count) in self.values().items():
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self, names: Sequence[str]) -> dict:
+        """Current values of the named metrics, in a picklable form `merge` accepts."""
+        snapshot = {}
+        for name in names:
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            if metric._function is not None:
+                value = metric._function()
+                snapshot[name] = dict(value) if isinstance(value, dict) else {(): value}
+            else:
+                snapshot[name] = metric.values()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """
+        Takes over values reported by another process's `snapshot`. Each label set
+        it contains replaces the one held here, so processes must report disjoint
+        label sets (for example, one shard each).
+        """
+        for name, values in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.update(values)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                log.warning(f"Failed to render metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
+snapshot = REGISTRY.snapshot
+merge = REGISTRY.merge
+
+
+async def log_metrics_periodically(shutdown_event: asyncio.Event, interval: float):
+    """Writes the full metrics snapshot to the log every `interval` seconds."""
+    while not shutdown_event.is_set():
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=interval)
+            break
+        except asyncio.TimeoutError:
+            log.info("Metrics snapshot:\n" + render())
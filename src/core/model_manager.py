@@ -1,8 +1,31 @@
 import asyncio
+import contextlib
 import logging
+import threading
+import time
+from collections import defaultdict
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Set
 import aiohttp
-from interpreter import interpreter
 import config
+from core import cancellation, metrics
+from core.coalescing import RequestCoalescer
+from core.connectivity import CircuitBreaker, OPEN
+from core.conversation_store import ConversationStore
+from core.interpreter_pool import InterpreterPool
+from core.keyed_locks import KeyedLocks
+from core.latency import LatencyTracker
+from core.local_model import keep_local_model_warm
+from core.long_term_memory import LongTermMemory, format_memories, format_turn
+from core.response_cache import ResponseCache
+from core.route_profiles import RouteProfile
+from core.sandbox import get_pool, sandbox_computer
+from core.scheduler import Scheduler, SchedulerOverloaded
+from core.workers import WorkerSupervisor
+from utils.startup import timeline
+
+if TYPE_CHECKING:
+    from interpreter import OpenInterpreter
 
 log = logging.getLogger(__name__)
 
@@ -17,104 +40,971 @@ You are NAIRO, a high-level AI assistant.
 - Avoid conversational pleasantries and filler. Get straight to the task.
 """.strip()
 
+# --- Metrics ---
+REQUESTS = metrics.counter("nairo_requests_total", "Requests received from senses.", ["sense", "mode"])
+REQUEST_SECONDS = metrics.histogram(
+    "nairo_request_duration_seconds", "Time from receiving a prompt to the full answer.", ["sense", "mode"]
+)
+FIRST_CHUNK_SECONDS = metrics.histogram(
+    "nairo_time_to_first_chunk_seconds", "Time from receiving a prompt to the first streamed chunk.", ["sense"]
+)
+EXECUTOR_WAIT_SECONDS = metrics.histogram(
+    "nairo_executor_wait_seconds", "Time blocking model work waited for an executor thread."
+)
+MODEL_CALL_SECONDS = metrics.histogram(
+    "nairo_model_call_seconds", "Duration of interpreter.chat per model route.", ["route", "mode"]
+)
+MODEL_ERRORS = metrics.counter("nairo_model_errors_total", "Failed interpreter.chat calls.", ["route"])
+OUTPUT_CHUNKS = metrics.counter(
+    "nairo_output_chunks_total", "Assistant message chunks streamed by the interpreter.", ["route"]
+)
+ONLINE_GAUGE = metrics.gauge("nairo_online", "1 while the online model route is considered reachable.")
+CONNECTIVITY_TRANSITIONS = metrics.counter(
+    "nairo_connectivity_transitions_total", "Circuit breaker state changes.", ["state"]
+)
+
+class FailedResponse(str):
+    """
+    The apology returned (or streamed) instead of an answer when no model could
+    answer. Senses that would rather retry than pass it on can check for it.
+    """
+
 # This event will be used to signal the online status across the application
 IS_ONLINE = asyncio.Event()
+# Set whenever the circuit breaker changes state, to wake the connectivity prober
+_breaker_state_changed = asyncio.Event()
+
+def _on_breaker_state_change(previous: str, state: str):
+    CONNECTIVITY_TRANSITIONS.inc(state=state)
+    if state == OPEN:
+        log.warning("Online model route is unreachable. NAIRO is offline.")
+        IS_ONLINE.clear()
+        ONLINE_GAUGE.set(0)
+    elif previous == OPEN:
+        log.info("Online model route is reachable. NAIRO is online.")
+        IS_ONLINE.set()
+        ONLINE_GAUGE.set(1)
+    _breaker_state_changed.set()
+
+# Health of the online route, fed by real model calls and by connectivity probes
+_breaker = CircuitBreaker(
+    config.CIRCUIT_BREAKER_WINDOW,
+    config.CIRCUIT_BREAKER_MIN_CALLS,
+    config.CIRCUIT_BREAKER_FAILURE_RATE,
+    config.CIRCUIT_BREAKER_SLOW_CALL_SECONDS,
+    on_state_change=_on_breaker_state_change,
+)
+
+# Model routes, each served by its own pool of pre-configured interpreters
+ONLINE_ROUTE = "online"
+LOCAL_ROUTE = "local"
+
+_pools: Dict[str, InterpreterPool] = {}
+
+# Immutable LLM settings per route, built from the config on first use
+_route_profiles: Mapping[str, RouteProfile] = MappingProxyType({})
+
+# Token-budgeted conversation history per session, swapped into whichever
+# interpreter serves it; set up by `initialize_model_manager`
+_conversations: Optional[ConversationStore] = None
+_session_locks = KeyedLocks(asyncio.Lock)
+
+# Recent latencies per (route, "first_chunk" | "complete"), used to tune the hedge delay
+_latency: Dict[tuple, LatencyTracker] = defaultdict(LatencyTracker)
+
+# Embedding-indexed memory of past exchanges, set up by `initialize_model_manager`
+_memory: Optional[LongTermMemory] = None
+
+# Cache of deterministic answers, set up by `initialize_model_manager`
+_response_cache: Optional[ResponseCache] = None
+
+# Admission control and executor for blocking model work, set up by `initialize_model_manager`
+_scheduler: Optional[Scheduler] = None
+
+# Worker processes that run interpreters out of process, if enabled by `initialize_model_manager`
+_workers: Optional[WorkerSupervisor] = None
+
+# Single-flight deduplication of identical concurrent prompts
+_coalescer = RequestCoalescer()
+
+# Cleanups of abandoned streams still running; the event loop only keeps weak references to tasks
+_discarding: Set[asyncio.Task] = set()
+
+# Coalescing scopes: share in-flight answers within one session, across all sessions, or not at all
+COALESCE_OFF = "off"
+COALESCE_SESSION = "session"
+COALESCE_GLOBAL = "global"
+
+metrics.counter(
+    "nairo_response_cache_lookups_total", "Response cache lookups by result.", ["result"]
+).set_function(lambda: {
+    ("hit",): get_cache_stats().get("hits", 0), ("miss",): get_cache_stats().get("misses", 0)
+})
+metrics.counter(
+    "nairo_coalesced_requests_total", "Requests that attached to an identical in-flight call."
+).set_function(lambda: _coalescer.coalesced)
+metrics.gauge(
+    "nairo_conversation_tokens", "Estimated tokens held by in-memory conversation histories."
+).set_function(lambda: _conversations.stats()["cached_tokens"] if _conversations is not None else 0)
+metrics.counter(
+    "nairo_conversation_turns_trimmed_total", "Old turns folded into conversation summaries."
+).set_function(lambda: _conversations.trimmed_turns if _conversations is not None else 0)
+metrics.gauge(
+    "nairo_long_term_memories", "Memories in the long-term memory index."
+).set_function(lambda: len(_memory) if _memory is not None else 0)
+metrics.gauge(
+    "nairo_interpreters_in_use", "Interpreter instances checked out, per route.", ["route"]
+).set_function(lambda: {(route,): pool.in_use for route, pool in _pools.items()})
+
+# Chunk types that mean the interpreter ran code, so the answer depends on the machine state
+UNCACHEABLE_CHUNK_TYPES = {"code", "console"}
 
-def initialize_model_manager():
+def preload_interpreter():
     """
-    Initializes the interpreter with settings from the config file.
+    Imports open-interpreter (and with it litellm), which takes seconds. This
+    happens on the first model call anyway; calling it from a background thread
+    after startup keeps that cost off the first request.
     """
+    return timeline.import_module("interpreter").OpenInterpreter
+
+def _build_route_profiles() -> Mapping[str, RouteProfile]:
+    return MappingProxyType({
+        ONLINE_ROUTE: RouteProfile(
+            ONLINE_ROUTE,
+            config.MODEL_NAME,
+            config.ONLINE_MODEL_CONTEXT_WINDOW,
+            config.MODEL_MAX_TOKENS,
+            api_key=config.GEMINI_API_KEY,
+        ),
+        LOCAL_ROUTE: RouteProfile(
+            LOCAL_ROUTE,
+            config.LOCAL_MODEL_NAME,
+            config.LOCAL_MODEL_CONTEXT_WINDOW,
+            config.MODEL_MAX_TOKENS,
+            api_base=config.LOCAL_MODEL_API_BASE,
+        ),
+    })
+
+def route_profile(route: str) -> RouteProfile:
+    """Returns the immutable LLM settings of a model route."""
+    global _route_profiles
+    if not _route_profiles:
+        # Worker processes never call `initialize_model_manager`
+        _route_profiles = _build_route_profiles()
+    return _route_profiles[route]
+
+def _create_interpreter(route: str) -> "OpenInterpreter":
+    """
+    Builds a fresh interpreter instance configured with the route's profile.
+    """
+    instance = preload_interpreter()()
+    instance.auto_run = config.INTERPRETER_AUTO_RUN
+    instance.system_message = CONCISE_SYSTEM_MESSAGE
+    route_profile(route).apply(instance.llm)
+    if config.SANDBOX_ENABLED:
+        sandbox_computer(instance.computer)
+    return instance
+
+def initialize_model_manager(
+    database=None, scheduler: Optional[Scheduler] = None, workers: Optional[WorkerSupervisor] = None
+):
+    """
+    Creates the interpreter pools, the conversation store and the response cache with
+    settings from the config file. If a `core.database.Database` is given, conversation
+    histories and cached responses are persisted there.
+    If a `core.scheduler.Scheduler` is given, every model call is admitted through it
+    and runs on its executor. If a `core.workers.WorkerSupervisor` is given, the
+    interpreters run in its worker processes instead of in this one.
+    """
+    global _conversations, _memory, _response_cache, _scheduler, _workers, _route_profiles
+    _scheduler = scheduler
+    _workers = workers
     log.info("Initializing Model Manager...")
-    interpreter.auto_run = config.INTERPRETER_AUTO_RUN
-    interpreter.system_message = CONCISE_SYSTEM_MESSAGE
-    interpreter.llm.context_window = 16000  # 16k context
-    interpreter.llm.max_tokens = 2048  # 2k output
-    interpreter.llm.temperature = 0.0
-    interpreter.llm.api_key = config.GEMINI_API_KEY # Using GEMINI_API_KEY from config
-    log.info("Model Manager initialized.")
+    _route_profiles = _build_route_profiles()
+    _pools[ONLINE_ROUTE] = InterpreterPool(
+        ONLINE_ROUTE, lambda: _create_interpreter(ONLINE_ROUTE), config.ONLINE_INTERPRETER_POOL_SIZE
+    )
+    _pools[LOCAL_ROUTE] = InterpreterPool(
+        LOCAL_ROUTE, lambda: _create_interpreter(LOCAL_ROUTE), config.LOCAL_INTERPRETER_POOL_SIZE
+    )
+    _conversations = ConversationStore(
+        config.CONVERSATION_TOKEN_BUDGET,
+        config.CONVERSATION_SUMMARY_TOKEN_BUDGET,
+        config.CONVERSATION_CACHE_SIZE,
+        database,
+    )
+    if config.LONG_TERM_MEMORY_ENABLED and database is not None:
+        _memory = LongTermMemory(
+            database,
+            config.LONG_TERM_MEMORY_EMBEDDING_FUNCTION,
+            config.LONG_TERM_MEMORY_EMBEDDING_DIM,
+            config.MEMORY_FILE_PATH,
+            config.LONG_TERM_MEMORY_MMAP_THRESHOLD_MB * 1024 * 1024,
+        )
+    if config.RESPONSE_CACHE_ENABLED:
+        _response_cache = ResponseCache(
+            config.RESPONSE_CACHE_MAX_ENTRIES, config.RESPONSE_CACHE_TTL_SECONDS, database
+        )
+    if config.SANDBOX_ENABLED and workers is None:
+        # Start the sandboxes now so the first code run does not wait for them
+        get_pool()
+    if workers is not None:
+        log.info("Model Manager initialized; interpreters run in worker processes.")
+    else:
+        log.info(
+            f"Model Manager initialized with {config.ONLINE_INTERPRETER_POOL_SIZE} online and "
+            f"{config.LOCAL_INTERPRETER_POOL_SIZE} local interpreter slots."
+        )
+
+async def load_long_term_memory():
+    """Loads the long-term memory index ahead of the first prompt, if memory is enabled."""
+    if _memory is not None:
+        await _memory.load()
+
+def close_long_term_memory():
+    """Releases the long-term memory index, removing its memory-mapped file if it has one."""
+    if _memory is not None:
+        _memory.close()
+
+async def _recall(session_id: str, prompt: str, history: List[dict]) -> List[dict]:
+    """
+    Returns `history` followed by a note of the past exchanges most similar to
+    `prompt`, if long-term memory has any. The note is not stored in the history.
+    """
+    if _memory is None:
+        return history
+    scope = session_id if config.LONG_TERM_MEMORY_SCOPE == "session" else None
+    try:
+        memories = await _memory.search(
+            prompt, config.LONG_TERM_MEMORY_TOP_K, config.LONG_TERM_MEMORY_MIN_SCORE, scope
+        )
+    except Exception as e:
+        log.warning(f"Long-term memory search failed: {e}")
+        return history
+    if not memories:
+        return history
+    log.debug(f"Recalled {len(memories)} memories for session '{session_id}'.")
+    return history + [{"role": "user", "type": "message", "content": format_memories(memories)}]
 
-async def has_internet_connection_async():
+async def _remember_turn(session_id: str, prompt: str, response: str):
+    """Adds a completed exchange to long-term memory."""
+    if _memory is None:
+        return
+    try:
+        await _memory.remember(format_turn(prompt, response), scope=session_id)
+    except Exception as e:
+        log.warning(f"Could not store an exchange in long-term memory: {e}")
+
+async def warm_up_local_route(shutdown_event: asyncio.Event):
+    """
+    Loads the local model as soon as the model manager is up and keeps it loaded
+    with periodic pings, so a failover to the local route is instant. Without
+    worker processes, one local interpreter is also built ahead of time.
+    """
+    if _workers is None and LOCAL_ROUTE in _pools:
+        try:
+            await _pools[LOCAL_ROUTE].warm()
+        except Exception as e:
+            log.warning(f"Could not pre-create a local interpreter: {e}")
+    await keep_local_model_warm(
+        shutdown_event,
+        route_profile(LOCAL_ROUTE),
+        config.LOCAL_MODEL_KEEP_ALIVE_INTERVAL_SECONDS,
+        config.LOCAL_MODEL_KEEP_ALIVE,
+        config.LOCAL_MODEL_WARM_UP_TIMEOUT_SECONDS,
+    )
+
+@contextlib.asynccontextmanager
+async def checkout_interpreter(route: str, history: List[dict], session_id: Optional[str] = None):
+    """
+    Checks out an interpreter for `route` loaded with a copy of `history`. With
+    worker processes, this is a proxy on the worker that serves `session_id`.
+    """
+    if _workers is not None:
+        async with _workers.interpreter(route, session_id) as instance:
+            instance.messages = list(history)
+            yield instance
+        return
+    async with _pools[route].instance() as instance:
+        instance.messages = list(history)
+        yield instance
+
+def _session_lock(session_id: str):
+    """
+    Requests within one session are serialized so their turns stay in order;
+    different sessions run in parallel up to the pool size.
+    """
+    return _session_locks.hold(session_id)
+
+def _admission(sense: Optional[str]):
+    """Returns the scheduler slot for `sense`, or a no-op context without a scheduler."""
+    if _scheduler is None:
+        return contextlib.nullcontext()
+    return _scheduler.slot(sense or "default")
+
+def _executor():
+    return _scheduler.executor if _scheduler is not None else None
+
+def get_cache_stats() -> dict:
+    """Returns the response cache's hit/miss counters (empty if caching is disabled)."""
+    return _response_cache.stats() if _response_cache is not None else {}
+
+async def _lookup_cached_response(prompt: str, model: str, session_id: str, history: List[dict]):
+    """
+    Returns `(cache_key, cached_response)` for `prompt` sent with `history` (the
+    session's context and recalled memories). On a hit, the turn is recorded in
+    the session history so the conversation stays coherent.
+    """
+    if _response_cache is None:
+        return None, None
+    cache_key = ResponseCache.make_key(prompt, model, CONCISE_SYSTEM_MESSAGE, history)
+    cached = await _response_cache.get(cache_key)
+    if cached is not None:
+        log.debug(f"Response cache hit for session '{session_id}' ({_response_cache.stats()}).")
+        await _record_turn(session_id, prompt, cached)
+    return cache_key, cached
+
+async def _record_turn(session_id: str, prompt: str, response: str):
+    """Appends a turn that was answered without running an interpreter for this session."""
+    await _conversations.append(session_id, [
+        {"role": "user", "type": "message", "content": prompt},
+        {"role": "assistant", "type": "message", "content": response},
+    ])
+
+def get_coalesce_stats() -> dict:
+    """Returns how many requests led a model call and how many were coalesced onto one."""
+    return _coalescer.stats()
+
+async def _coalesce_key(prompt: str, model: str, session_id: str, coalesce: str):
+    """
+    Returns the single-flight key for a request, or None if it must not be coalesced.
+    Across sessions, the key also covers the session's context the way the response
+    cache key does, so only sessions whose conversations match share an answer.
+    """
+    if coalesce == COALESCE_OFF:
+        return None
+    if coalesce == COALESCE_SESSION:
+        return (model, session_id, " ".join(prompt.split()).casefold())
+    # Recalled memories differ per session when memory is session-scoped
+    scope = session_id if _memory is not None and config.LONG_TERM_MEMORY_SCOPE == "session" else None
+    context = await _conversations.context(session_id)
+    return (model, scope, ResponseCache.make_key(prompt, model, CONCISE_SYSTEM_MESSAGE, context))
+
+async def has_internet_connection_async(session: aiohttp.ClientSession):
     """
     Checks for a stable internet connection asynchronously using aiohttp.
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://www.google.com", timeout=3) as response:
-                response.raise_for_status()
-                return True
+        timeout = aiohttp.ClientTimeout(total=config.CONNECTIVITY_PROBE_TIMEOUT_SECONDS)
+        async with session.get(config.CONNECTIVITY_PROBE_URL, timeout=timeout) as response:
+            response.raise_for_status()
+            return True
     except Exception as e:
         log.warning(f"Async internet connection check failed: {e}")
         return False
 
+async def _wait_for_next_probe(shutdown_event: asyncio.Event, delay: float) -> bool:
+    """
+    Sleeps up to `delay` seconds. Returns True if woken early by a breaker state change.
+    """
+    waiters = {
+        asyncio.create_task(shutdown_event.wait()),
+        asyncio.create_task(_breaker_state_changed.wait()),
+    }
+    try:
+        await asyncio.wait(waiters, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+    woken = _breaker_state_changed.is_set()
+    _breaker_state_changed.clear()
+    return woken
+
 async def check_internet_periodically(shutdown_event: asyncio.Event):
     """
-    Periodically checks for internet connection and sets the IS_ONLINE event.
+    Probes connectivity adaptively and feeds the results to the circuit breaker.
+    Probes are rare while the online route is healthy and back off exponentially
+    while it is not. In between, real model calls keep the breaker up to date.
     """
-    while not shutdown_event.is_set():
-        if await has_internet_connection_async():
-            if not IS_ONLINE.is_set():
-                log.info("Internet connection established. NAIRO is online.")
-                IS_ONLINE.set()
-        else:
-            if IS_ONLINE.is_set():
-                log.warning("Internet connection lost. NAIRO is offline.")
-                IS_ONLINE.clear()
-        
-        try:
-            # Wait for the specified interval or until shutdown is triggered
-            await asyncio.wait_for(shutdown_event.wait(), timeout=config.INTERNET_CHECK_INTERVAL_SECONDS)
-            # If wait() completes, it means the event was set, so we break
-            break
-        except asyncio.TimeoutError:
-            # This is the normal path, continue the loop
-            pass
+    offline_delay = config.CONNECTIVITY_OFFLINE_PROBE_MIN_SECONDS
+    delay = 0
+    async with aiohttp.ClientSession() as session:
+        while not shutdown_event.is_set():
+            if await _wait_for_next_probe(shutdown_event, delay):
+                # The breaker changed on its own, so restart the probe schedule
+                offline_delay = config.CONNECTIVITY_OFFLINE_PROBE_MIN_SECONDS
+                if _breaker.allows_requests:
+                    delay = config.INTERNET_CHECK_INTERVAL_SECONDS
+                else:
+                    delay = offline_delay
+                continue
+            if shutdown_event.is_set():
+                break
+
+            if await has_internet_connection_async(session):
+                _breaker.probe_succeeded()
+            else:
+                _breaker.probe_failed("connectivity probe failed")
+            # The probe's own state changes need no wake-up
+            _breaker_state_changed.clear()
+
+            if _breaker.allows_requests:
+                offline_delay = config.CONNECTIVITY_OFFLINE_PROBE_MIN_SECONDS
+                delay = config.INTERNET_CHECK_INTERVAL_SECONDS
+            else:
+                delay = offline_delay
+                offline_delay = min(offline_delay * 2, config.CONNECTIVITY_OFFLINE_PROBE_MAX_SECONDS)
 
-async def get_model_response(prompt: str, force_local: bool = False):
+def _select_route(force_local: bool = False):
     """
-    Selects the best model (online vs. local) and gets a response asynchronously.
-    The blocking `interpreter.chat()` call is run in a separate thread.
+    Picks the model route for a request. Returns a `(route, model_name)` tuple.
     """
     online = IS_ONLINE.is_set() and config.GEMINI_API_KEY
-    model_to_use = ""
 
     if force_local or not online:
-        model_to_use = "ollama/phi3:mini"
+        model_to_use = config.LOCAL_MODEL_NAME
         if not online:
             log.warning(f"No internet or no API key. Routing to local model: {model_to_use}")
         else:
             log.info(f"Forcing local model: {model_to_use}")
-        
-        interpreter.llm.model = model_to_use
-        interpreter.llm.context_window = 0
-        interpreter.llm.api_key = None
-    else:
-        model_to_use = config.MODEL_NAME
-        log.debug(f"Routing to online model: {model_to_use}")
-        interpreter.llm.model = model_to_use
-        interpreter.llm.api_key = config.GEMINI_API_KEY
+        return LOCAL_ROUTE, model_to_use
+
+    log.debug(f"Routing to online model: {config.MODEL_NAME}")
+    return ONLINE_ROUTE, config.MODEL_NAME
 
+async def get_model_response(
+    prompt: str,
+    force_local: bool = False,
+    session_id: str = "default",
+    coalesce: str = COALESCE_SESSION,
+    sense: Optional[str] = None,
+    timeout: Optional[float] = None,
+):
+    """
+    Selects the best model (online vs. local) and gets a response asynchronously.
+    The blocking `interpreter.chat()` call is run in a separate thread on an
+    interpreter checked out from the route's pool. Identical prompts already in
+    flight within the `coalesce` scope share that call's answer.
+    The model call must finish within `timeout` seconds (by default the sense's
+    configured deadline). Cancelling the caller stops the call in progress.
+    Raises `SchedulerOverloaded` if the scheduler cannot admit the request for `sense`.
+    """
+    sense_label = sense or "default"
+    REQUESTS.inc(sense=sense_label, mode="complete")
+    deadline = _request_deadline(sense, timeout)
+    with REQUEST_SECONDS.time(sense=sense_label, mode="complete"):
+        route, model_to_use = _select_route(force_local)
+
+        key = await _coalesce_key(prompt, model_to_use, session_id, coalesce)
+        if key is None:
+            return await _generate_response(prompt, route, model_to_use, session_id, sense, deadline)
+
+        follower = _coalescer.in_flight(key)
+        response = await _coalescer.run(
+            key, lambda: _generate_response(prompt, route, model_to_use, session_id, sense, deadline)
+        )
+        if follower and coalesce == COALESCE_GLOBAL and not isinstance(response, FailedResponse):
+            await _record_turn(session_id, prompt, response)
+        return response
+
+def _request_deadline(sense: Optional[str], timeout: Optional[float]) -> float:
+    """The loop time by which a request's model call must finish (or, when streaming, start)."""
+    if timeout is None:
+        timeout = config.REQUEST_DEADLINES.get(sense, config.MODEL_REQUEST_DEADLINE_SECONDS)
+    return asyncio.get_running_loop().time() + timeout
+
+def _chat(interpreter, prompt: str) -> List[dict]:
+    """
+    Blocking `interpreter.chat(prompt)` that stops between chunks once the
+    request is cancelled. Runs the chat as a stream, which is what a non-streamed
+    chat does internally, and returns the new messages like it does.
+    """
+    start = len(interpreter.messages)
+    stream = interpreter.chat(prompt, stream=True, display=False)
     try:
-        log.debug(f"Sending prompt to {model_to_use}...")
-        
-        # Run the blocking `interpreter.chat` in a separate thread
+        for _ in stream:
+            if cancellation.requested():
+                break
+    finally:
+        # Closing the generator also stops code still running in a sandbox
+        stream.close()
+    return interpreter.messages[start:]
+
+async def _run_blocking(fn):
+    """
+    Runs `fn` on the model executor under a `core.cancellation` scope. A running
+    thread cannot be interrupted, so if the caller is cancelled this signals the
+    scope and waits for `fn` to notice and return before propagating the
+    cancellation. The interpreter it uses is never returned to its pool while busy.
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    cancelled = threading.Event()
+
+    def run():
+        loop.call_soon_threadsafe(EXECUTOR_WAIT_SECONDS.observe, time.perf_counter() - submitted)
+        with cancellation.scope(cancelled):
+            return fn()
+
+    future = loop.run_in_executor(_executor(), run)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        while not future.done():
+            with contextlib.suppress(asyncio.CancelledError):
+                await asyncio.wait({future})
+        raise
+
+def _hedge_delay(kind: str) -> float:
+    """
+    How long to wait on the online route before also asking the local model: the
+    configured percentile of recent online latencies of this kind, clamped to the
+    configured bounds, or the static default until there are enough samples.
+    """
+    tracker = _latency[(ONLINE_ROUTE, kind)]
+    if len(tracker) < config.HEDGE_MIN_SAMPLES:
+        return config.HEDGE_DELAY_SECONDS
+    observed = tracker.percentile(config.HEDGE_PERCENTILE)
+    return min(max(observed, config.HEDGE_MIN_DELAY_SECONDS), config.HEDGE_MAX_DELAY_SECONDS)
+
+def _discard(task: asyncio.Future):
+    """Cancels an abandoned attempt and swallows whatever it ends with."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def _call_route(route: str, prompt: str, history: List[dict], sense: Optional[str], session_id: str):
+    """
+    Runs one prompt on an interpreter from the route's pool, seeded with `history`.
+    Returns the response chunks and the interpreter's resulting message history.
+    """
+    # The scheduler slot is only taken once an interpreter is free, so a call
+    # waiting on a busy pool does not hold a slot other senses could use
+    async with checkout_interpreter(route, history, session_id) as interpreter, _admission(sense):
         loop = asyncio.get_running_loop()
-        response_chunks = await loop.run_in_executor(
-            None,  # Use the default thread pool executor
-            lambda: interpreter.chat(prompt, stream=False, display=False)
-        )
-        
-        if response_chunks:
-            last_message = response_chunks[-1]
-            if last_message.get('type') == 'message' and last_message.get('role') == 'assistant':
-                log.debug(f"Response received from {model_to_use}.")
-                return last_message.get('content', "No content in message.")
-        
+        started = loop.time()
+        try:
+            response_chunks = await _run_blocking(lambda: _chat(interpreter, prompt))
+        except Exception as e:
+            MODEL_ERRORS.inc(route=route)
+            if route == ONLINE_ROUTE:
+                _breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        elapsed = loop.time() - started
+        _latency[(route, "complete")].record(elapsed)
+        MODEL_CALL_SECONDS.observe(elapsed, route=route, mode="complete")
+        if route == ONLINE_ROUTE:
+            _breaker.record_success(elapsed)
+        return response_chunks, list(interpreter.messages)
+
+async def _call_online(
+    prompt: str, history: List[dict], sense: Optional[str], session_id: str, deadline: float
+):
+    """
+    Runs a prompt on the online route with the local model as backup.
+
+    If the online call fails, the request fails over to the local model. If it is
+    still running after the hedge delay, the local model is started alongside it
+    and the first successful answer wins; the other attempt is cancelled. Raises
+    `asyncio.TimeoutError` if nothing answers by `deadline` (a loop time), and
+    `SchedulerOverloaded` if the online call is not admitted, rather than adding
+    a local call to the load. Returns `(route, response_chunks, messages)`.
+    An online call abandoned at the deadline or beaten by the local model counts
+    as a failure for the circuit breaker.
+    """
+    loop = asyncio.get_running_loop()
+    attempts = {asyncio.ensure_future(_call_route(ONLINE_ROUTE, prompt, history, sense, session_id)): ONLINE_ROUTE}
+    errors = []
+    local_started = False
+    abandoned = None  # why a still-running online call counts as failed
+    try:
+        # The request deadline bounds the first wait too, hedging or not
+        remaining = max(deadline - loop.time(), 0)
+        delay = _hedge_delay("complete") if config.HEDGING_ENABLED else None
+        hedge = delay is not None and delay < remaining
+        done, _ = await asyncio.wait(set(attempts), timeout=delay if hedge else remaining)
+        if not done:
+            if not hedge:
+                raise asyncio.TimeoutError()
+            log.info(f"Online model has not answered within {delay:.1f}s. Hedging with {config.LOCAL_MODEL_NAME}.")
+        while True:
+            for task in [t for t in attempts if t.done()]:
+                route = attempts.pop(task)
+                if task.exception() is None:
+                    if route == LOCAL_ROUTE:
+                        abandoned = "slower than the local model"
+                    return (route, *task.result())
+                if isinstance(task.exception(), SchedulerOverloaded) and route == ONLINE_ROUTE:
+                    raise task.exception()
+                errors.append(task.exception())
+                if route == ONLINE_ROUTE:
+                    log.warning(
+                        f"Online model {config.MODEL_NAME} failed ({task.exception()}). "
+                        f"Failing over to {config.LOCAL_MODEL_NAME}."
+                    )
+            if not local_started and (errors or not done):
+                local_started = True
+                attempts[asyncio.ensure_future(_call_route(LOCAL_ROUTE, prompt, history, sense, session_id))] = LOCAL_ROUTE
+            if not attempts:
+                raise errors[0]
+            timeout = deadline - loop.time()
+            done, _ = await asyncio.wait(set(attempts), timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+    except asyncio.TimeoutError:
+        abandoned = "no answer by the request deadline"
+        raise
+    finally:
+        if abandoned and ONLINE_ROUTE in attempts.values():
+            _breaker.record_failure(abandoned)
+        for task in attempts:
+            _discard(task)
+
+def _extract_answer(response_chunks) -> Optional[str]:
+    """Returns the final assistant message of a non-streamed chat, if there is one."""
+    if response_chunks:
+        last_message = response_chunks[-1]
+        if last_message.get('type') == 'message' and last_message.get('role') == 'assistant':
+            return last_message.get('content', "No content in message.")
+    return None
+
+async def _generate_response(
+    prompt: str, route: str, model_to_use: str, session_id: str, sense: Optional[str], deadline: float
+):
+    """
+    Runs one prompt for a session, unless the response cache already has an answer
+    for it in the same context, and records the completed turn in its history.
+    """
+    requested_route = route
+    async with _session_lock(session_id):
+        history = await _recall(session_id, prompt, await _conversations.context(session_id))
+        cache_key, cached = await _lookup_cached_response(prompt, model_to_use, session_id, history)
+        if cached is not None:
+            return cached
+        try:
+            log.debug(f"Sending prompt to {model_to_use} (session '{session_id}')...")
+            if route == ONLINE_ROUTE:
+                route, response_chunks, messages = await _call_online(prompt, history, sense, session_id, deadline)
+            else:
+                async with asyncio.timeout_at(deadline):
+                    response_chunks, messages = await _call_route(route, prompt, history, sense, session_id)
+        except SchedulerOverloaded:
+            raise
+        except asyncio.TimeoutError:
+            log.warning(f"No model answered before the request deadline (session '{session_id}').")
+            return FailedResponse("Sorry, that took too long. Please try again.")
+        except Exception as e:
+            log.error(f"An error occurred while running the model {model_to_use}: {e}", exc_info=True)
+            return FailedResponse(f"Sorry, an error occurred: {e}")
+        # Only completed turns are kept, so a failed call can be retried cleanly
+        await _conversations.append(session_id, messages[len(history):])
+
+    content = _extract_answer(response_chunks)
+    if content is None:
         log.warning("Interpreter finished but returned no valid message.")
-        return "Sorry, I ran into an issue and couldn't generate a response."
+        return FailedResponse("Sorry, I ran into an issue and couldn't generate a response.")
 
-    except Exception as e:
-        log.error(f"An error occurred while running the model {model_to_use}: {e}", exc_info=True)
-        return f"Sorry, an error occurred: {e}"
+    log.debug(f"Response received from the {route} route.")
+    await _remember_turn(session_id, prompt, content)
+    if (
+        cache_key is not None
+        and route == requested_route
+        and not any(chunk.get('type') in UNCACHEABLE_CHUNK_TYPES for chunk in response_chunks)
+    ):
+        await _response_cache.set(cache_key, content)
+    return content
+
+async def _iterate_in_thread(make_iterator):
+    """
+    Bridges a blocking iterator into an async generator.
+
+    The iterator is consumed in an executor thread and its items are handed to
+    the event loop through a queue. If the consumer stops early, the thread is
+    told to stop at the next item (and through its `core.cancellation` scope, to
+    stop code it is running) and is awaited before this generator returns, so
+    the caller can safely release whatever the iterator was using.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop_requested = threading.Event()
+    done = object()
+
+    submitted = time.perf_counter()
+
+    def produce():
+        loop.call_soon_threadsafe(EXECUTOR_WAIT_SECONDS.observe, time.perf_counter() - submitted)
+        with cancellation.scope(stop_requested):
+            consume()
+
+    def consume():
+        iterator = make_iterator()
+        try:
+            for item in iterator:
+                if stop_requested.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(_executor(), produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_requested.set()
+        await asyncio.shield(producer)
+
+async def stream_model_response(
+    prompt: str,
+    force_local: bool = False,
+    session_id: str = "default",
+    coalesce: str = COALESCE_SESSION,
+    sense: Optional[str] = None,
+    timeout: Optional[float] = None,
+):
+    """
+    Streaming variant of `get_model_response`.
+    Yields the assistant's message text in chunks as the model produces them.
+    The model must start answering within `timeout` seconds; closing the stream
+    early stops the call in progress.
+    """
+    sense_label = sense or "default"
+    REQUESTS.inc(sense=sense_label, mode="stream")
+    started = time.perf_counter()
+    first_chunk_seen = False
+    deadline = _request_deadline(sense, timeout)
+    try:
+        async for chunk in _stream_response(prompt, force_local, session_id, coalesce, sense, deadline):
+            if not first_chunk_seen:
+                first_chunk_seen = True
+                FIRST_CHUNK_SECONDS.observe(time.perf_counter() - started, sense=sense_label)
+            yield chunk
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, sense=sense_label, mode="stream")
+
+async def _stream_response(
+    prompt: str, force_local: bool, session_id: str, coalesce: str, sense: Optional[str], deadline: float
+):
+    """
+    Body of `stream_model_response`: coalescing and generation.
+    """
+    route, model_to_use = _select_route(force_local)
+
+    key = await _coalesce_key(prompt, model_to_use, session_id, coalesce)
+    if key is None:
+        async for chunk in _generate_stream(prompt, route, model_to_use, session_id, sense, deadline):
+            yield chunk
+        return
+
+    follower = _coalescer.in_flight(key)
+    text = ""
+    failed = False
+    async for chunk in _coalescer.stream(
+        key, lambda: _generate_stream(prompt, route, model_to_use, session_id, sense, deadline)
+    ):
+        text += chunk
+        failed = failed or isinstance(chunk, FailedResponse)
+        yield chunk
+    if follower and coalesce == COALESCE_GLOBAL and not failed:
+        await _record_turn(session_id, prompt, text)
+
+async def _stream_route(
+    route: str, prompt: str, history: List[dict], sense: Optional[str], session_id: str, outcome: dict
+):
+    """
+    Streams one prompt on an interpreter from the route's pool, seeded with `history`.
+    Yields the raw interpreter chunks. Once the stream completes, the interpreter's
+    resulting message history is stored in `outcome['messages']`.
+    """
+    # Interpreter first, then the scheduler slot, as in `_call_route`
+    async with checkout_interpreter(route, history, session_id) as interpreter, _admission(sense):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first_chunk_seen = False
+        chunks = _iterate_in_thread(
+            lambda: interpreter.chat(prompt, stream=True, display=False)
+        )
+        try:
+            async for chunk in chunks:
+                if not first_chunk_seen:
+                    first_chunk_seen = True
+                    _latency[(route, "first_chunk")].record(loop.time() - started)
+                if chunk.get('type') == 'message' and chunk.get('content'):
+                    OUTPUT_CHUNKS.inc(route=route)
+                yield chunk
+        except Exception as e:
+            MODEL_ERRORS.inc(route=route)
+            if route == ONLINE_ROUTE:
+                _breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            await chunks.aclose()
+        elapsed = loop.time() - started
+        _latency[(route, "complete")].record(elapsed)
+        MODEL_CALL_SECONDS.observe(elapsed, route=route, mode="stream")
+        if route == ONLINE_ROUTE:
+            _breaker.record_success(elapsed)
+        outcome["messages"] = list(interpreter.messages)
+
+async def _discard_stream(pending_chunk: asyncio.Future, stream):
+    """Abandons a losing stream; its interpreter is released once its thread stops."""
+    pending_chunk.cancel()
+    with contextlib.suppress(BaseException):
+        await pending_chunk
+    with contextlib.suppress(Exception):
+        await stream.aclose()
+
+async def _open_online_stream(
+    prompt: str, history: List[dict], sense: Optional[str], session_id: str, deadline: float
+):
+    """
+    Streaming counterpart of `_call_online`: the race is decided by which route
+    produces its first chunk first, which must happen by `deadline`. Like it,
+    raises `SchedulerOverloaded` if the online stream is not admitted. Returns
+    `(route, first_chunk, stream, outcome)`, where `first_chunk` is None if the
+    winning stream ended without any chunk.
+    """
+    loop = asyncio.get_running_loop()
+    attempts = {}  # pending first chunk -> (route, stream, outcome)
+    errors = []
+    local_started = False
+    abandoned = None  # why a still-running online stream counts as failed
+
+    def start(route):
+        outcome = {}
+        stream = _stream_route(route, prompt, history, sense, session_id, outcome)
+        attempts[asyncio.ensure_future(stream.__anext__())] = (route, stream, outcome)
+
+    start(ONLINE_ROUTE)
+    try:
+        # The request deadline bounds the first wait too, hedging or not
+        remaining = max(deadline - loop.time(), 0)
+        delay = _hedge_delay("first_chunk") if config.HEDGING_ENABLED else None
+        hedge = delay is not None and delay < remaining
+        done, _ = await asyncio.wait(set(attempts), timeout=delay if hedge else remaining)
+        if not done:
+            if not hedge:
+                raise asyncio.TimeoutError()
+            log.info(f"Online model has not started within {delay:.1f}s. Hedging with {config.LOCAL_MODEL_NAME}.")
+        while True:
+            for task in [t for t in attempts if t.done()]:
+                route, stream, outcome = attempts.pop(task)
+                error = task.exception()
+                if error is None or isinstance(error, StopAsyncIteration):
+                    if route == LOCAL_ROUTE:
+                        abandoned = "slower to start than the local model"
+                    return route, None if error else task.result(), stream, outcome
+                if isinstance(error, SchedulerOverloaded) and route == ONLINE_ROUTE:
+                    raise error
+                errors.append(error)
+                if route == ONLINE_ROUTE:
+                    log.warning(
+                        f"Online model {config.MODEL_NAME} failed ({error}). "
+                        f"Failing over to {config.LOCAL_MODEL_NAME}."
+                    )
+            if not local_started and (errors or not done):
+                local_started = True
+                start(LOCAL_ROUTE)
+            if not attempts:
+                raise errors[0]
+            timeout = deadline - loop.time()
+            done, _ = await asyncio.wait(set(attempts), timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+    except asyncio.TimeoutError:
+        abandoned = "no first chunk by the request deadline"
+        raise
+    finally:
+        if abandoned and any(route == ONLINE_ROUTE for route, _, _ in attempts.values()):
+            _breaker.record_failure(abandoned)
+        for task, (_, stream, _) in attempts.items():
+            cleanup = asyncio.ensure_future(_discard_stream(task, stream))
+            _discarding.add(cleanup)
+            cleanup.add_done_callback(_discarding.discard)
+
+async def _generate_stream(
+    prompt: str, route: str, model_to_use: str, session_id: str, sense: Optional[str], deadline: float
+):
+    """
+    Streams one prompt for a session, unless the response cache already has an answer
+    for it in the same context, and records the completed turn in its history.
+    """
+    requested_route = route
+    text = ""
+    async with _session_lock(session_id):
+        history = await _recall(session_id, prompt, await _conversations.context(session_id))
+        cache_key, cached = await _lookup_cached_response(prompt, model_to_use, session_id, history)
+        if cached is not None:
+            yield cached
+            return
+        stream = None
+        try:
+            log.debug(f"Streaming prompt to {model_to_use} (session '{session_id}')...")
+            if route == ONLINE_ROUTE:
+                route, first_chunk, stream, outcome = await _open_online_stream(
+                    prompt, history, sense, session_id, deadline
+                )
+            else:
+                outcome = {}
+                stream = _stream_route(route, prompt, history, sense, session_id, outcome)
+                async with asyncio.timeout_at(deadline):
+                    first_chunk = await anext(stream, None)
+            pending = [first_chunk] if first_chunk is not None else []
+            cacheable = cache_key is not None and route == requested_route
+
+            async def chunks():
+                for chunk in pending:
+                    yield chunk
+                async for chunk in stream:
+                    yield chunk
+
+            async for chunk in chunks():
+                if chunk.get('type') in UNCACHEABLE_CHUNK_TYPES:
+                    cacheable = False
+                if (
+                    chunk.get('role') == 'assistant'
+                    and chunk.get('type') == 'message'
+                    and chunk.get('content')
+                ):
+                    text += chunk['content']
+                    yield chunk['content']
+
+        except SchedulerOverloaded:
+            raise
+        except asyncio.TimeoutError:
+            log.warning(f"No model started answering before the request deadline (session '{session_id}').")
+            yield FailedResponse("Sorry, that took too long. Please try again.")
+            return
+        except Exception as e:
+            log.error(f"An error occurred while streaming from the model {model_to_use}: {e}", exc_info=True)
+            yield FailedResponse(f"Sorry, an error occurred: {e}")
+            return
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
+        # Only completed turns are kept, so a failed call can be retried cleanly
+        if "messages" in outcome:
+            await _conversations.append(session_id, outcome["messages"][len(history):])
+
+    if not text:
+        log.warning("Interpreter finished streaming but produced no message.")
+        yield FailedResponse("Sorry, I ran into an issue and couldn't generate a response.")
+    else:
+        log.debug(f"Stream from the {route} route complete.")
+        await _remember_turn(session_id, prompt, text)
+        if cacheable:
+            await _response_cache.set(cache_key, text)
 
 if __name__ == "__main__":
     # This part is for direct testing and will not run in the main application
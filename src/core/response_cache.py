@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for model responses.
+
+    The first tier is an in-memory LRU with a TTL. The second, optional tier is
+    persisted through `core.database.Database` so entries survive restarts.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, database=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.database = database
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+
+    @staticmethod
+    def make_key(prompt: str, model: str, system_message: str, context: List[dict] = ()) -> str:
+        """
+        Builds a cache key from the normalized prompt, the model, the system message
+        and the `context` sent along with the prompt (history and recalled memories),
+        so an answer is only reused in a conversation that led to the same prompt.
+        """
+        normalized = " ".join(prompt.split()).casefold()
+        system_hash = hashlib.sha256(system_message.encode("utf-8")).hexdigest()
+        context_hash = hashlib.sha256(
+            json.dumps(list(context), sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        raw = f"{model}\x00{system_hash}\x00{context_hash}\x00{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Returns the cached response for `key`, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self.database is not None:
+            try:
+                value = await self.database.get_cached_response(key, self.ttl_seconds)
+            except Exception as e:
+                log.warning(f"Persistent response cache lookup failed: {e}")
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                self.hits += 1
+                self.persistent_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        """Stores `value` in both tiers."""
+        self._remember(key, value)
+        if self.database is not None:
+            try:
+                await self.database.set_cached_response(key, value)
+            except Exception as e:
+                log.warning(f"Persistent response cache write failed: {e}")
+
+    def _remember(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Hit/miss counters for logging and metrics."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent_hits": self.persistent_hits,
+            "entries": len(self._entries),
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from typing import Optional
+
+# litellm provider prefixes served by an Ollama server
+OLLAMA_PREFIXES = ("ollama/", "ollama_chat/")
+DEFAULT_OLLAMA_API_BASE = "http://localhost:11434"
+
+
+@dataclass(frozen=True)
+class RouteProfile:
+    """
+    The LLM settings of one model route. Profiles are immutable: each is applied
+    to the interpreters built for its route and never changed afterwards, so
+    using one route cannot leak settings into another.
+    """
+
+    route: str
+    model: str
+    context_window: int
+    max_tokens: int
+    temperature: float = 0.0
+    api_key: Optional[str] = None
+    api_base: Optional[str] = None
+
+    def apply(self, llm):
+        """Configures an interpreter's `llm` object with this profile."""
+        llm.model = self.model
+        llm.context_window = self.context_window
+        llm.max_tokens = self.max_tokens
+        llm.temperature = self.temperature
+        llm.api_key = self.api_key
+        if self.api_base:
+            llm.api_base = self.api_base
+
+    @property
+    def is_ollama(self) -> bool:
+        return self.model.startswith(OLLAMA_PREFIXES)
+
+    @property
+    def ollama_model(self) -> str:
+        """The model name as the Ollama server knows it, without the litellm provider prefix."""
+        return self.model.split("/", 1)[1] if self.is_ollama else self.model
+
+    @property
+    def ollama_api_base(self) -> str:
+        return (self.api_base or DEFAULT_OLLAMA_API_BASE).rstrip("/")
@@ -0,0 +1,268 @@
+import contextlib
+import json
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Iterator, Optional
+
+import config
+from core import cancellation, metrics
+
+log = logging.getLogger(__name__)
+
+EXECUTION_SECONDS = metrics.histogram(
+    "nairo_sandbox_execution_seconds", "Wall-clock time of code runs in a sandbox.", ["language", "outcome"]
+)
+EXECUTION_CPU_SECONDS = metrics.histogram(
+    "nairo_sandbox_cpu_seconds", "CPU time used by code runs that finished in a sandbox.", ["language"]
+)
+SANDBOXES_KILLED = metrics.counter(
+    "nairo_sandboxes_killed_total", "Sandboxes killed for breaking a limit or being abandoned.", ["reason"]
+)
+
+RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_runner.py")
+SUPPORTED_LANGUAGES = {"python", "shell", "sh", "bash", "zsh"}
+
+# Runs slower than this are logged at INFO rather than DEBUG
+SLOW_EXECUTION_SECONDS = 5
+# How often a silent run checks whether its request was cancelled
+CANCEL_POLL_SECONDS = 0.25
+
+
+def _output(text: str) -> dict:
+    """An open-interpreter console output chunk."""
+    return {"type": "console", "format": "output", "content": text}
+
+
+class _Sandbox:
+    """One runner process, in its own process group so everything it starts can be killed with it."""
+
+    def __init__(self, memory_mb: int):
+        if os.name == "posix":
+            isolation = {"start_new_session": True}
+        else:
+            isolation = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", RUNNER_PATH, str(memory_mb)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            **isolation,
+        )
+        self.executions = 0
+        self.replies: queue.Queue = queue.Queue()
+        threading.Thread(target=self._read, name=f"sandbox-{self.process.pid}", daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.replies.put(json.loads(line))
+        self.replies.put(None)
+
+    def send(self, request: dict):
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        if self.alive:
+            with contextlib.suppress(ProcessLookupError, PermissionError):
+                if os.name == "posix":
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+        with contextlib.suppress(subprocess.TimeoutExpired):
+            self.process.wait(timeout=5)
+        with contextlib.suppress(OSError):
+            self.process.stdin.close()
+
+
+class SandboxPool:
+    """
+    A pool of pre-started sandbox processes that run the code the interpreter
+    executes, so a runaway script never holds the thread serving a request.
+
+    Each run gets a CPU-time limit (enforced by the kernel), a memory limit set
+    when the sandbox starts, a wall-clock limit after which the sandbox's whole
+    process group is killed, and a cap on the output it returns. Sandboxes are
+    reused while they behave, each run starting from a fresh namespace; a
+    killed or worn-out sandbox is replaced by a new one straight away, so the
+    next run does not wait for a process to start.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        wall_seconds: float,
+        cpu_seconds: float,
+        memory_mb: int,
+        max_output_chars: int,
+        max_executions: int,
+    ):
+        if size < 1:
+            raise ValueError(f"Sandbox pool size must be at least 1, got {size}.")
+        self.size = size
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_output_chars = max_output_chars
+        self.max_executions = max_executions
+        self._idle: queue.Queue = queue.Queue()
+        self._slots = threading.Semaphore(size)
+        self._active = set()
+        self._stopped = False
+
+    def start(self):
+        for _ in range(self.size):
+            self._idle.put(_Sandbox(self.memory_mb))
+        log.info(f"Started {self.size} code sandbox(es).")
+
+    def _checkout(self) -> _Sandbox:
+        try:
+            sandbox = self._idle.get_nowait()
+        except queue.Empty:
+            return _Sandbox(self.memory_mb)
+        if not sandbox.alive:
+            sandbox.kill()
+            return _Sandbox(self.memory_mb)
+        return sandbox
+
+    def _checkin(self, sandbox: _Sandbox, reusable: bool):
+        self._active.discard(sandbox)
+        try:
+            if reusable and sandbox.executions < self.max_executions and not self._stopped:
+                self._idle.put(sandbox)
+                return
+            sandbox.kill()
+            if not self._stopped:
+                self._idle.put(_Sandbox(self.memory_mb))
+        finally:
+            self._slots.release()
+
+    def run(self, language: str, code: str) -> Iterator[dict]:
+        """
+        Runs `code` in a sandbox, yielding console output chunks. Blocks, so it is
+        called from the executor thread running the interpreter. Closing the
+        iterator early, or cancelling the request through `core.cancellation`,
+        kills the run.
+        """
+        language = language.lower()
+        if language not in SUPPORTED_LANGUAGES:
+            yield _output(f"Running {language} code is not supported here. Use Python or shell instead.\n")
+            return
+        if not self._slots.acquire(timeout=self.wall_seconds):
+            yield _output("Every code sandbox is busy. Try again shortly.\n")
+            return
+
+        try:
+            sandbox = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        sandbox.executions += 1
+        self._active.add(sandbox)
+        started = time.perf_counter()
+        deadline = started + self.wall_seconds
+        outcome = "abandoned"
+        try:
+            sandbox.send({
+                "language": language,
+                "code": code,
+                "cpu_seconds": self.cpu_seconds,
+                "max_output_chars": self.max_output_chars,
+            })
+            while True:
+                remaining = deadline - time.perf_counter()
+                try:
+                    reply = sandbox.replies.get(timeout=min(max(remaining, 0), CANCEL_POLL_SECONDS))
+                except queue.Empty:
+                    if cancellation.requested():
+                        outcome = "cancelled"
+                        break
+                    if remaining > CANCEL_POLL_SECONDS:
+                        continue
+                    outcome = "timeout"
+                    sandbox.kill()
+                    yield _output(f"\nExecution stopped: it ran for more than {self.wall_seconds:g}s.\n")
+                    break
+                if reply is None:
+                    outcome = "killed"
+                    yield _output("\nExecution stopped: it exceeded its CPU time or memory limit.\n")
+                    break
+                if "output" in reply:
+                    yield _output(reply["output"])
+                    continue
+                outcome = "ok"
+                EXECUTION_CPU_SECONDS.observe(reply["cpu_seconds"], language=language)
+                if reply["truncated"]:
+                    yield _output(f"\n[Output truncated after {self.max_output_chars} characters.]\n")
+                break
+        except OSError:
+            # The sandbox died before it could take the request
+            outcome = "killed"
+            yield _output("\nExecution failed: the sandbox stopped unexpectedly.\n")
+        finally:
+            elapsed = time.perf_counter() - started
+            EXECUTION_SECONDS.observe(elapsed, language=language, outcome=outcome)
+            if outcome != "ok":
+                SANDBOXES_KILLED.inc(reason=outcome)
+            log.log(
+                logging.INFO if elapsed >= SLOW_EXECUTION_SECONDS or outcome != "ok" else logging.DEBUG,
+                f"Sandboxed {language} run took {elapsed:.2f}s ({outcome}).",
+            )
+            self._checkin(sandbox, reusable=outcome == "ok")
+
+    def stop(self):
+        """Kills every sandbox, including those in the middle of a run."""
+        self._stopped = True
+        for sandbox in list(self._active):
+            sandbox.kill()
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+
+_pool: Optional[SandboxPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SandboxPool:
+    """Returns this process's sandbox pool, starting it with the config settings on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(
+                config.SANDBOX_POOL_SIZE,
+                config.SANDBOX_WALL_TIMEOUT_SECONDS,
+                config.SANDBOX_CPU_SECONDS,
+                config.SANDBOX_MEMORY_MB,
+                config.SANDBOX_MAX_OUTPUT_CHARS,
+                config.SANDBOX_MAX_EXECUTIONS,
+            )
+            _pool.start()
+        return _pool
+
+
+def stop_pool():
+    """Stops this process's sandbox pool, if one was started."""
+    if _pool is not None:
+        _pool.stop()
+
+
+def sandbox_computer(computer):
+    """Routes an open-interpreter `computer`'s code execution through the sandbox pool."""
+    def run(language, code, stream=False, display=False):
+        chunks = get_pool().run(language, code)
+        return chunks if stream else list(chunks)
+
+    computer.run = run
@@ -0,0 +1,158 @@
+"""
+Runs inside a sandbox process started by `core.sandbox`.
+
+Reads one JSON request per line, `{"language", "code", "cpu_seconds",
+"max_output_chars"}`, executes it and answers with JSON lines: `{"output": text}`
+while it runs, then `{"done": true, "cpu_seconds": used, "truncated": bool}`.
+It only uses the standard library so a sandbox is ready moments after it starts.
+"""
+import ast
+import io
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import traceback
+
+try:
+    import resource
+except ImportError:  # Windows: no CPU or memory limits
+    resource = None
+
+SHELLS = {"shell": "sh", "sh": "sh", "bash": "bash", "zsh": "zsh"}
+
+
+class _Output(io.TextIOBase):
+    """Sends everything written to it as output messages, up to a character cap."""
+
+    def __init__(self, channel, max_chars: int):
+        self.channel = channel
+        self.remaining = max_chars
+        self.truncated = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not text:
+            return 0
+        if self.remaining <= 0:
+            self.truncated = True
+            return len(text)
+        if len(text) > self.remaining:
+            self.truncated = True
+        _send(self.channel, {"output": text[:self.remaining]})
+        self.remaining -= len(text)
+        return len(text)
+
+
+def _send(channel, message: dict):
+    channel.write(json.dumps(message) + "\n")
+    channel.flush()
+
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _limit_cpu(seconds: float):
+    """Lets this process use `seconds` more CPU time; past that the kernel kills it."""
+    if resource is None or not seconds:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(_cpu_time() + seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _run_python(code: str, output: _Output):
+    """Executes `code` in a fresh namespace and prints the last expression's value, like a notebook cell."""
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    try:
+        tree = ast.parse(code, "<sandbox>", "exec")
+        last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+        exec(compile(tree, "<sandbox>", "exec"), namespace)
+        if last is not None:
+            value = eval(compile(ast.Expression(last.value), "<sandbox>", "eval"), namespace)
+            if value is not None:
+                output.write(repr(value) + "\n")
+    except SystemExit:
+        pass
+    except BaseException as e:
+        # Drop the runner's own frames so the traceback only shows the executed code
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != "<sandbox>":
+            tb = tb.tb_next
+        output.write("".join(traceback.format_exception(type(e), e, tb)))
+
+
+def _run_shell(language: str, code: str, cpu_seconds: float, output: _Output):
+    if os.name == "nt":
+        command = ["cmd", "/c", code]
+    else:
+        command = [SHELLS.get(language, "sh"), "-c", code]
+
+    def limit():
+        if resource is not None and cpu_seconds:
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            resource.setrlimit(resource.RLIMIT_CPU, (math.ceil(cpu_seconds), hard))
+
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        preexec_fn=limit if os.name == "posix" else None,
+    )
+    for line in process.stdout:
+        output.write(line)
+    code = process.wait()
+    if resource is not None and code == -signal.SIGXCPU:
+        output.write("(stopped: CPU time limit exceeded)\n")
+    elif code:
+        output.write(f"(exit code {code})\n")
+
+
+def main():
+    # The protocol uses private copies of stdin and stdout. Code that reads stdin gets
+    # EOF, and stray writes to fd 1 (C extensions, child processes) go to stderr.
+    requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    channel = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    sys.stdin = open(os.devnull)
+
+    memory_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    for line in requests:
+        request = json.loads(line)
+        language = request["language"]
+        output = _Output(channel, request["max_output_chars"])
+        started = _cpu_time() if resource is not None else 0.0
+        _limit_cpu(request["cpu_seconds"])
+        sys.stdout = sys.stderr = output
+        try:
+            if language == "python":
+                _run_python(request["code"], output)
+            else:
+                _run_shell(language, request["code"], request["cpu_seconds"], output)
+        except Exception as e:
+            output.write(f"{type(e).__name__}: {e}\n")
+        finally:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        used = _cpu_time() - started if resource is not None else 0.0
+        _send(channel, {"done": True, "cpu_seconds": used, "truncated": output.truncated})
+
+
+if __name__ == "__main__":
+    main()
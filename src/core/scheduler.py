@@ -0,0 +1,173 @@
+import asyncio
+import contextlib
+import logging
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from core import metrics
+
+log = logging.getLogger(__name__)
+
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "nairo_scheduler_queue_wait_seconds", "Time a model call waited for admission.", ["sense"]
+)
+REJECTIONS = metrics.counter(
+    "nairo_scheduler_rejections_total", "Model calls rejected by admission control.", ["sense", "reason"]
+)
+QUEUED = metrics.gauge("nairo_scheduler_queued", "Model calls waiting for admission.", ["sense"])
+
+
+class SchedulerOverloaded(Exception):
+    """
+    Raised when a request cannot be admitted, either because its sense's queue
+    is full or because it waited longer than the sense's queue deadline.
+    `retry_after` is a hint, in whole seconds, for when capacity is likely free.
+    """
+
+    def __init__(self, sense: str, reason: str, retry_after: int):
+        super().__init__(f"Model scheduler overloaded for sense '{sense}': {reason}")
+        self.sense = sense
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _SenseQueue:
+    def __init__(self, name: str, weight: float, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.weight = weight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiters: deque = deque()
+        self.virtual_time = 0.0
+        self.admitted = 0
+        self.rejected = 0
+
+
+class Scheduler:
+    """
+    Admission control for model calls.
+
+    Owns a bounded thread pool for blocking interpreter work and hands out one
+    execution slot per worker. Requests wait in a bounded queue per sense and
+    slots are shared between senses by weight (weighted fair queueing), so a
+    flood on one sense cannot starve the others.
+    """
+
+    def __init__(self, max_workers: int, sense_settings: Dict[str, dict], default_settings: dict):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nairo-model")
+        self._sense_settings = sense_settings
+        self._default_settings = default_settings
+        self._queues: Dict[str, _SenseQueue] = {}
+        self._free_slots = max_workers
+        self._virtual_time = 0.0
+        # Smoothed time a slot is held, used to estimate Retry-After
+        self._service_time = 1.0
+        QUEUED.set_function(lambda: {(name,): len(q.waiters) for name, q in self._queues.items()})
+
+    def _queue(self, sense: str) -> _SenseQueue:
+        queue = self._queues.get(sense)
+        if queue is None:
+            settings = {**self._default_settings, **self._sense_settings.get(sense, {})}
+            queue = _SenseQueue(
+                sense, settings["weight"], settings["max_queue"], settings["queue_timeout_seconds"]
+            )
+            self._queues[sense] = queue
+        return queue
+
+    def _retry_after(self, queue: _SenseQueue) -> int:
+        backlog = sum(len(q.waiters) for q in self._queues.values()) + 1
+        return max(1, math.ceil(self._service_time * backlog / self.max_workers))
+
+    def _grant(self, queue: _SenseQueue):
+        self._free_slots -= 1
+        queue.admitted += 1
+        queue.virtual_time += 1.0 / queue.weight
+        self._virtual_time = queue.virtual_time
+
+    def _dispatch(self):
+        while self._free_slots > 0:
+            waiting = [q for q in self._queues.values() if q.waiters]
+            if not waiting:
+                return
+            queue = min(waiting, key=lambda q: q.virtual_time)
+            waiter = queue.waiters.popleft()
+            if waiter.done():
+                continue
+            self._grant(queue)
+            waiter.set_result(None)
+
+    def _release(self):
+        self._free_slots += 1
+        self._dispatch()
+
+    async def _admit(self, sense: str):
+        queue = self._queue(sense)
+        if self._free_slots > 0 and not any(q.waiters for q in self._queues.values()):
+            self._grant(queue)
+            return
+
+        if len(queue.waiters) >= queue.max_queue:
+            queue.rejected += 1
+            REJECTIONS.inc(sense=sense, reason="queue_full")
+            raise SchedulerOverloaded(sense, "queue is full", self._retry_after(queue))
+
+        if not queue.waiters:
+            # A sense that was idle re-joins at the current virtual time instead of
+            # catching up on the share it did not use.
+            queue.virtual_time = max(queue.virtual_time, self._virtual_time)
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append(waiter)
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=queue.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(queue, waiter)
+            raise
+        if not done:
+            self._abandon(queue, waiter)
+            queue.rejected += 1
+            REJECTIONS.inc(sense=sense, reason="deadline")
+            raise SchedulerOverloaded(sense, "queue wait deadline exceeded", self._retry_after(queue))
+
+    def _abandon(self, queue: _SenseQueue, waiter: asyncio.Future):
+        if waiter.done():
+            # The slot was granted just as the caller gave up; hand it on.
+            self._release()
+            return
+        waiter.cancel()
+        with contextlib.suppress(ValueError):
+            queue.waiters.remove(waiter)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, sense: str):
+        """
+        Waits for an execution slot on behalf of `sense` and holds it for the
+        duration of the block. Raises `SchedulerOverloaded` if not admitted.
+        """
+        loop = asyncio.get_running_loop()
+        arrived = loop.time()
+        await self._admit(sense)
+        started = loop.time()
+        QUEUE_WAIT_SECONDS.observe(started - arrived, sense=sense)
+        try:
+            yield
+        finally:
+            self._service_time = 0.8 * self._service_time + 0.2 * (loop.time() - started)
+            self._release()
+
+    def stats(self) -> dict:
+        """Per-sense queue depth and admission counters."""
+        return {
+            "free_slots": self._free_slots,
+            "senses": {
+                name: {"queued": len(q.waiters), "admitted": q.admitted, "rejected": q.rejected}
+                for name, q in self._queues.items()
+            },
+        }
+
+    def shutdown(self):
+        """Stops the executor without waiting for running model calls."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
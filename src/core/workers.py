@@ -0,0 +1,284 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import config
+from core import metrics
+
+log = logging.getLogger(__name__)
+
+WORKER_RESTARTS = metrics.counter("nairo_worker_restarts_total", "Model worker processes restarted after exiting.")
+WORKERS_ALIVE = metrics.gauge("nairo_workers_alive", "Model worker processes currently running.")
+WORKER_BUSY = metrics.gauge("nairo_worker_busy", "1 while a model worker is serving a call.", ["worker"])
+
+# Most (route, session) pairs remembered for worker affinity
+MAX_AFFINITY_ENTRIES = 4096
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process serving a call exited before answering."""
+
+
+def worker_main(conn, worker_id: int):
+    """
+    Entry point of a worker process: serves chat calls received over `conn`
+    with one interpreter per model route, one call at a time.
+
+    Requests are `("chat", route, messages, prompt, stream)`. A streamed call
+    answers with `("chunk", chunk)` messages and may be stopped early by a
+    `("cancel",)` message. Every call ends with `("done", chunks, messages)`
+    (chunks is None when streamed) or `("error", exception)`.
+    """
+    # Ctrl+C reaches the whole process group; the supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Spawning re-imports main.py, which set up the parent's handlers; workers log to stderr instead
+    from utils.logger_config import shutdown_logging
+    shutdown_logging()
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format=f"[%(asctime)s] [worker {worker_id}] [%(levelname)-8s] [%(name)s] %(message)s",
+        force=True,
+    )
+    from core.model_manager import _create_interpreter, preload_interpreter
+    from core.sandbox import get_pool, stop_pool
+    try:
+        preload_interpreter()
+    except ImportError as e:
+        log.error(f"Could not import open-interpreter; model calls will fail: {e}")
+    if config.SANDBOX_ENABLED:
+        get_pool()
+
+    interpreters = {}
+    log.info(f"Model worker {worker_id} started.")
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request[0] != "chat":
+            continue
+        _, route, messages, prompt, stream = request
+        try:
+            instance = interpreters.get(route)
+            if instance is None:
+                instance = interpreters[route] = _create_interpreter(route)
+            instance.messages = messages
+            if stream:
+                for chunk in instance.chat(prompt, stream=True, display=False):
+                    conn.send(("chunk", chunk))
+                    if conn.poll() and conn.recv()[0] == "cancel":
+                        break
+                reply = ("done", None, list(instance.messages))
+            else:
+                chunks = instance.chat(prompt, stream=False, display=False)
+                reply = ("done", chunks, list(instance.messages))
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+        except Exception as e:
+            # The exception or the messages could not be pickled
+            conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+    stop_pool()
+    log.info(f"Model worker {worker_id} stopped.")
+
+
+class _Worker:
+    def __init__(self, worker_id: int):
+        self.id = worker_id
+        self.process = None
+        self.conn = None
+        # Held by the executor thread talking to the process, so calls never interleave
+        self.lock = threading.Lock()
+        # Waited on by the event loop before a call gets an executor thread, so
+        # a call queued behind another does not tie up a thread (or a scheduler slot)
+        self.turn = asyncio.Lock()
+        self.assigned = 0
+        self.restarts = []  # monotonic times of recent restarts
+
+
+class RemoteInterpreter:
+    """
+    Stands in for an interpreter by running `chat` in a worker process. Like an
+    interpreter, its methods block, so they are called from executor threads.
+    """
+
+    def __init__(self, worker: _Worker, route: str):
+        self._worker = worker
+        self.route = route
+        self.messages: List[dict] = []
+
+    def _receive(self):
+        try:
+            return self._worker.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"Model worker {self._worker.id} exited during a call") from e
+
+    def chat(self, prompt: str, stream: bool = False, display: bool = False):
+        if stream:
+            return self._stream(prompt)
+        with self._worker.lock:
+            WORKER_BUSY.set(1, worker=self._worker.id)
+            try:
+                self._send(prompt, stream=False)
+                reply = self._receive()
+            finally:
+                WORKER_BUSY.set(0, worker=self._worker.id)
+        if reply[0] == "error":
+            raise reply[1]
+        _, chunks, self.messages = reply
+        return chunks
+
+    def _send(self, prompt: str, stream: bool):
+        try:
+            self._worker.conn.send(("chat", self.route, self.messages, prompt, stream))
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"Model worker {self._worker.id} is not running") from e
+
+    def _stream(self, prompt: str):
+        with self._worker.lock:
+            WORKER_BUSY.set(1, worker=self._worker.id)
+            finished = False
+            try:
+                self._send(prompt, stream=True)
+                while True:
+                    reply = self._receive()
+                    if reply[0] != "chunk":
+                        finished = True
+                        break
+                    yield reply[1]
+            finally:
+                if not finished:
+                    # Stopped early: tell the worker, then drain the pipe up to its final reply
+                    try:
+                        self._worker.conn.send(("cancel",))
+                        while self._receive()[0] == "chunk":
+                            pass
+                    except (WorkerCrashed, OSError):
+                        pass
+                WORKER_BUSY.set(0, worker=self._worker.id)
+        if reply[0] == "error":
+            raise reply[1]
+        self.messages = reply[2]
+
+
+class WorkerSupervisor:
+    """
+    Runs model calls in `count` worker processes so parsing and tool execution in
+    open-interpreter can use more than one core.
+
+    Calls are routed with session affinity: each (route, session) pair sticks to
+    the worker it was first given, which is the least loaded one at that time, so
+    a session's interpreter state stays in one process. Workers that exit are
+    restarted by `supervise`, with a back-off if they keep crashing.
+    """
+
+    def __init__(self, count: int):
+        if count < 1:
+            raise ValueError(f"Worker count must be at least 1, got {count}.")
+        # Spawned rather than forked: the parent runs threads and an event loop
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(i) for i in range(count)]
+        self._affinity: "OrderedDict[tuple, _Worker]" = OrderedDict()
+        self._stopping = False
+        WORKERS_ALIVE.set_function(
+            lambda: sum(1 for w in self._workers if w.process is not None and w.process.is_alive())
+        )
+
+    def _spawn(self, worker: _Worker):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=worker_main, args=(child_conn, worker.id), name=f"nairo-worker-{worker.id}", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker.process, worker.conn = process, parent_conn
+
+    def start(self):
+        for worker in self._workers:
+            self._spawn(worker)
+        log.info(f"Started {len(self._workers)} model worker process(es).")
+
+    @contextlib.asynccontextmanager
+    async def interpreter(self, route: str, session_id: Optional[str]):
+        """
+        Checks out an interpreter proxy on the worker that serves this route and
+        session, once that worker has finished the calls queued before this one.
+        """
+        worker = self._worker_for(route, session_id)
+        async with worker.turn:
+            yield RemoteInterpreter(worker, route)
+
+    def _worker_for(self, route: str, session_id: Optional[str]) -> _Worker:
+        key = (route, session_id)
+        worker = self._affinity.get(key)
+        if worker is None:
+            worker = min(self._workers, key=lambda w: (w.turn.locked(), w.assigned))
+            worker.assigned += 1
+            self._affinity[key] = worker
+            while len(self._affinity) > MAX_AFFINITY_ENTRIES:
+                _, evicted = self._affinity.popitem(last=False)
+                evicted.assigned -= 1
+        else:
+            self._affinity.move_to_end(key)
+        return worker
+
+    def _restart_delay(self, worker: _Worker) -> float:
+        now = time.monotonic()
+        worker.restarts = [t for t in worker.restarts if now - t < 60]
+        return min(2 ** len(worker.restarts) - 1, 30)
+
+    def _restart(self, worker: _Worker):
+        # Wait for any thread still talking to the dead process to give up
+        with worker.lock:
+            if worker.conn is not None:
+                worker.conn.close()
+            worker.process.join(timeout=1)
+            self._spawn(worker)
+        worker.restarts.append(time.monotonic())
+        WORKER_RESTARTS.inc()
+
+    async def supervise(self, shutdown_event: asyncio.Event, interval: float = 1.0):
+        """Restarts workers that have exited until shutdown."""
+        while not shutdown_event.is_set():
+            for worker in self._workers:
+                if self._stopping or worker.process.is_alive():
+                    continue
+                delay = self._restart_delay(worker)
+                log.error(
+                    f"Model worker {worker.id} exited with code {worker.process.exitcode}. "
+                    f"Restarting in {delay:.0f}s."
+                )
+                await asyncio.sleep(delay)
+                if shutdown_event.is_set():
+                    return
+                await asyncio.to_thread(self._restart, worker)
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self, timeout: float = 5.0):
+        """Closes every worker's pipe, then terminates workers that do not exit in time."""
+        self._stopping = True
+        for worker in self._workers:
+            if worker.conn is not None:
+                worker.conn.close()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            worker.process.join(timeout=max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                log.warning(f"Model worker {worker.id} did not stop in time; terminating it.")
+                worker.process.terminate()
+                worker.process.join(timeout=1)
+        log.info("Model workers stopped.")
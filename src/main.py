@@ -4,25 +4,47 @@ import os
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Imported first so the startup timeline covers everything below
+from utils.startup import timeline
+
 import asyncio
 import logging
 import signal
-import importlib
+import functools
 from typing import Set, Dict
 
 import config
-from utils.logger_config import setup_logging
-from core.model_manager import initialize_model_manager, check_internet_periodically, get_model_response
+from utils.logger_config import setup_logging, shutdown_logging
+from core import metrics
+from core.database import Database
+from core.scheduler import Scheduler
+from core.sandbox import stop_pool
+from core.workers import WorkerSupervisor
+from core.model_manager import (
+    initialize_model_manager, check_internet_periodically, get_model_response, stream_model_response,
+    preload_interpreter, warm_up_local_route, load_long_term_memory, close_long_term_memory,
+)
 from senses._base import SenseModule
 
+timeline.mark("core modules imported")
+
 # Setup logging as early as possible
-setup_logging()
+setup_logging(
+    config.LOG_LEVEL,
+    use_queue=config.LOG_QUEUE,
+    json_format=config.LOG_JSON,
+    rate_limit_per_second=config.LOG_RATE_LIMIT_PER_SECOND,
+    rate_limit_burst=config.LOG_RATE_LIMIT_BURST,
+)
 log = logging.getLogger(__name__)
+timeline.mark("logging configured")
 
 # --- Globals for managing tasks and shutdown ---
 running_tasks: Set[asyncio.Task] = set()
 shutdown_event = asyncio.Event()
 
+metrics.gauge("nairo_running_tasks", "Live background and sense tasks.").set_function(lambda: len(running_tasks))
+
 def handle_task_completion(task: asyncio.Task):
     """Callback to handle task completion, logging exceptions."""
     try:
@@ -36,12 +58,65 @@ def handle_task_completion(task: asyncio.Task):
     
     running_tasks.discard(task)
 
+async def report_startup(senses: Dict[str, SenseModule]):
+    """
+    Once every sense is ready (or the report timeout passes), imports the model
+    libraries and loads long-term memory ahead of the first request, then logs
+    the startup timeline.
+    """
+    async def wait_until_ready(name: str, sense: SenseModule):
+        await sense.ready.wait()
+        timeline.mark(f"sense '{name}' ready")
+
+    waiters = [asyncio.create_task(wait_until_ready(name, sense)) for name, sense in senses.items()]
+    try:
+        if waiters:
+            await asyncio.wait(waiters, timeout=config.STARTUP_REPORT_TIMEOUT_SECONDS)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+    for name, sense in senses.items():
+        if not sense.ready.is_set():
+            timeline.mark(f"sense '{name}' not ready after {config.STARTUP_REPORT_TIMEOUT_SECONDS}s")
+
+    # Worker processes import it themselves
+    if config.PRELOAD_INTERPRETER and not config.WORKER_PROCESSES:
+        try:
+            await asyncio.to_thread(preload_interpreter)
+        except ImportError as e:
+            log.error(f"Could not import open-interpreter; model calls will fail: {e}")
+    try:
+        await load_long_term_memory()
+        timeline.mark("long-term memory loaded")
+    except Exception as e:
+        log.error(f"Could not load long-term memory: {e}")
+    timeline.log_report()
+
 async def main():
     """Main entry point for the NAIRO application."""
     log.info("--- Starting NAIRO ---")
 
     # Initialize core components
-    initialize_model_manager()
+    database = Database(
+        config.DATABASE_PATH,
+        read_pool_size=config.DATABASE_READ_POOL_SIZE,
+        value_cache_size=config.DATABASE_VALUE_CACHE_SIZE,
+        write_batch_size=config.DATABASE_WRITE_BATCH_SIZE,
+    )
+    await database.initialize()
+    await database.purge_cached_responses(config.RESPONSE_CACHE_TTL_SECONDS)
+    timeline.mark("database ready")
+    scheduler = Scheduler(
+        config.SCHEDULER_MAX_WORKERS, config.SCHEDULER_SENSES, config.SCHEDULER_DEFAULT_SENSE
+    )
+    # Supervisor mode: interpreters run in worker processes, the senses stay here
+    workers = None
+    if config.WORKER_PROCESSES:
+        workers = WorkerSupervisor(config.WORKER_PROCESSES)
+        workers.start()
+        timeline.mark(f"{config.WORKER_PROCESSES} worker process(es) spawned")
+    initialize_model_manager(database, scheduler, workers)
+    timeline.mark("model manager initialized")
 
     # --- Start background tasks ---
     log.info("Starting background tasks...")
@@ -52,23 +127,57 @@ async def main():
     internet_checker_task.add_done_callback(handle_task_completion)
     running_tasks.add(internet_checker_task)
 
+    # 2. Worker supervisor, restarting crashed worker processes
+    if workers is not None:
+        supervisor_task = asyncio.create_task(workers.supervise(shutdown_event))
+        supervisor_task.set_name("WorkerSupervisor")
+        supervisor_task.add_done_callback(handle_task_completion)
+        running_tasks.add(supervisor_task)
+
+    # 3. Local model warm-up and keep-alive, so failover to the local route is instant
+    if config.LOCAL_MODEL_WARM_UP:
+        warm_up_task = asyncio.create_task(warm_up_local_route(shutdown_event))
+        warm_up_task.set_name("LocalModelKeepAlive")
+        warm_up_task.add_done_callback(handle_task_completion)
+        running_tasks.add(warm_up_task)
+
+    # 4. Periodic metrics dump to the log (optional)
+    if config.METRICS_LOG_INTERVAL_SECONDS:
+        metrics_logger_task = asyncio.create_task(
+            metrics.log_metrics_periodically(shutdown_event, config.METRICS_LOG_INTERVAL_SECONDS)
+        )
+        metrics_logger_task.set_name("MetricsLogger")
+        metrics_logger_task.add_done_callback(handle_task_completion)
+        running_tasks.add(metrics_logger_task)
+
     # --- Dynamically load and start Senses ---
     log.info(f"Loading enabled senses: {config.ENABLED_SENSES}")
+    # Sense modules and the libraries they pull in are imported in parallel threads
+    sense_modules = await asyncio.gather(
+        *(asyncio.to_thread(timeline.import_module, f"senses.{name}") for name in config.ENABLED_SENSES),
+        return_exceptions=True,
+    )
     sense_classes: Dict[str, SenseModule] = {}
-    for sense_name in config.ENABLED_SENSES:
+    for sense_name, sense_module in zip(config.ENABLED_SENSES, sense_modules):
         try:
-            module_path = f"senses.{sense_name}"
-            sense_module = importlib.import_module(module_path)
+            if isinstance(sense_module, Exception):
+                raise sense_module
             
             # Convention: Class name is CamelCase version of module name + "Sense"
             # e.g., 'web' -> 'WebSense', 'discord_bot' -> 'DiscordBotSense'
             class_name = f"{''.join(word.capitalize() for word in sense_name.split('_'))}Sense"
             sense_class = getattr(sense_module, class_name)
             
-            sense_instance = sense_class(get_model_response, shutdown_event)
+            # Every model call from this sense is admitted through the scheduler under its name
+            sense_instance = sense_class(
+                functools.partial(get_model_response, sense=sense_name),
+                shutdown_event,
+                functools.partial(stream_model_response, sense=sense_name),
+            )
             
-            # Inject logger into the sense instance
+            # Inject logger and database into the sense instance
             sense_instance.logger = logging.getLogger(f"sense.{sense_name}")
+            sense_instance.database = database
 
             sense_task = asyncio.create_task(sense_instance.start())
             sense_task.set_name(f"Sense:{sense_name}")
@@ -83,19 +192,37 @@ async def main():
 
     if not sense_classes:
         log.warning("No senses were loaded. The application will have no functionality.")
+    timeline.mark("senses started")
+
+    # 5. Startup report, logged once the senses are ready
+    startup_report_task = asyncio.create_task(report_startup(sense_classes))
+    startup_report_task.set_name("StartupReport")
+    startup_report_task.add_done_callback(handle_task_completion)
+    running_tasks.add(startup_report_task)
 
     # --- Wait for shutdown signal ---
     await shutdown_event.wait()
 
     # --- Graceful Shutdown ---
     log.info("Shutdown signal received. Cleaning up...")
+    # Everything below shares one time budget, so a stuck sense or task cannot hold up the exit
+    shutdown_deadline = asyncio.get_running_loop().time() + config.SHUTDOWN_TIMEOUT_SECONDS
+
+    # Abandon requests still being answered, which stops their model calls
+    for name, sense in sense_classes.items():
+        abandoned = sense.abandon_all()
+        if abandoned:
+            log.info(f"Abandoned {abandoned} in-flight request(s) of sense '{name}'.")
 
     # Stop senses (optional, if they have a stop method)
     for name, sense in sense_classes.items():
         if hasattr(sense, 'stop') and asyncio.iscoroutinefunction(sense.stop):
             try:
                 log.info(f"Stopping sense '{name}'...")
-                await sense.stop()
+                async with asyncio.timeout_at(shutdown_deadline):
+                    await sense.stop()
+            except TimeoutError:
+                log.warning(f"Sense '{name}' did not stop within the shutdown timeout.")
             except Exception:
                 log.exception(f"Error while stopping sense '{name}':")
 
@@ -103,12 +230,42 @@ async def main():
     for task in list(running_tasks):
         task.cancel()
     
-    # Wait for all tasks to finish cancelling
+    # Wait for all tasks to finish cancelling, up to the shutdown deadline
+    still_running = set()
     if running_tasks:
-        await asyncio.gather(*running_tasks, return_exceptions=True)
+        _, still_running = await asyncio.wait(
+            running_tasks, timeout=max(shutdown_deadline - asyncio.get_running_loop().time(), 0)
+        )
+        if still_running:
+            names = ", ".join(sorted(task.get_name() for task in still_running))
+            log.warning(f"Shutting down without waiting for {len(still_running)} task(s): {names}")
+
+    # Stop the worker processes; threads still waiting on them see the pipe close
+    if workers is not None:
+        await asyncio.to_thread(workers.stop)
+
+    # Release the model executor without waiting on abandoned calls
+    scheduler.shutdown()
+
+    # Kill the code sandboxes, including runs still in progress
+    await asyncio.to_thread(stop_pool)
+
+    # Drop the long-term memory index and its memory-mapped file
+    close_long_term_memory()
+
+    # Flush queued writes and close the database connections
+    try:
+        await database.close()
+    except Exception:
+        log.exception("Error while closing the database:")
 
     log.info("--- NAIRO has shut down ---")
 
+    if still_running:
+        # asyncio.run would wait on those tasks, and the threads under them, indefinitely
+        shutdown_logging()
+        os._exit(0)
+
 def signal_handler(sig, frame):
     """Signal handler to initiate graceful shutdown."""
     log.info(f"Received signal {sig}. Initiating shutdown...")
@@ -126,4 +283,7 @@ if __name__ == "__main__":
         log.info("Shutdown initiated by KeyboardInterrupt.")
     except Exception:
         log.critical("A critical error occurred in the main application loop.", exc_info=True)
+    finally:
+        # Write out every queued log record before the process exits
+        shutdown_logging()
 
@@ -2,10 +2,14 @@ from abc import ABC, abstractmethod
 import asyncio
 
 class SenseModule(ABC):
-    def __init__(self, model_responder, shutdown_event: asyncio.Event):
+    def __init__(self, model_responder, shutdown_event: asyncio.Event, model_streamer=None):
         self.model_responder = model_responder
+        self.model_streamer = model_streamer # Async generator variant, yields response chunks
         self.shutdown_event = shutdown_event
         self.logger = None # Will be set by the factory
+        self.database = None # Will be set by the factory, for senses that keep their own state
+        self.ready = asyncio.Event() # Set by the sense once it can serve requests
+        self._requests = {} # request key -> set of tasks serving it
 
     @abstractmethod
     async def start(self):
@@ -13,3 +17,36 @@ class SenseModule(ABC):
 
     async def stop(self):
         pass
+
+    def track_request(self, key, task: asyncio.Task) -> asyncio.Task:
+        """Registers a task that serves a client request, so `abandon` can cancel it."""
+        tasks = self._requests.setdefault(key, set())
+        tasks.add(task)
+
+        def forget(task):
+            tasks.discard(task)
+            if not tasks and self._requests.get(key) is tasks:
+                del self._requests[key]
+
+        task.add_done_callback(forget)
+        return task
+
+    async def run_request(self, key, coroutine):
+        """Runs `coroutine` as a tracked task for `key` and returns its result."""
+        return await self.track_request(key, asyncio.ensure_future(coroutine))
+
+    def abandon(self, key) -> int:
+        """
+        Signals that the client behind `key` no longer wants an answer (it left,
+        or deleted its message). Cancelling the tasks serving it stops their model
+        calls, including generation and code still running. Returns how many
+        tasks were cancelled.
+        """
+        tasks = self._requests.pop(key, set())
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def abandon_all(self) -> int:
+        """Abandons every request in flight, e.g. on shutdown."""
+        return sum(self.abandon(key) for key in list(self._requests))
@@ -1,41 +1,331 @@
 import asyncio
+import collections
+import contextlib
+import math
+import re
 import discord
 import config
+from core import metrics
+from core.keyed_locks import KeyedLocks
+from core.scheduler import SchedulerOverloaded
 from senses._base import SenseModule
+from senses.discord_shards import ShardSupervisor
+
+DISCORD_MESSAGE_LIMIT = 2000
+STREAM_PLACEHOLDER = "..."
+BUSY_REPLY = "I'm a little overloaded at the moment, Sir. Please try again in {retry_after} seconds."
+DISCORD_COALESCE_SCOPE = config.REQUEST_COALESCING.get("discord_bot", "session")
+
+MESSAGES_RECEIVED = metrics.counter(
+    "nairo_discord_messages_total", "Discord messages received, by whether they were answered.", ["outcome"]
+)
+SEND_SECONDS = metrics.histogram(
+    "nairo_response_send_seconds", "Time to deliver a send or edit, including rate-limit pacing.", ["sense"]
+)
+SHARD_MESSAGES = metrics.counter(
+    "nairo_discord_shard_messages_total", "Discord messages delivered by each gateway shard.", ["shard"]
+)
+EVENT_LAG = metrics.histogram(
+    "nairo_discord_event_lag_seconds", "Time from a message being sent to the bot handling it, per shard.", ["shard"]
+)
+SHARD_LATENCY = metrics.gauge(
+    "nairo_discord_shard_latency_seconds", "Gateway heartbeat latency of each shard.", ["shard"]
+)
+GUILDS = metrics.gauge("nairo_discord_guilds", "Servers served by each shard.", ["shard"])
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT):
+    """
+    Splits `text` into parts no longer than `limit`, preferring to break at
+    paragraph, line and word boundaries. The split of a prefix never changes as
+    more text is appended, so streamed replies can be split incrementally.
+    """
+    parts = []
+    while len(text) > limit:
+        window = text[:limit]
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut > 0:
+                break
+        else:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ") if cut < limit else text[cut:]
+    parts.append(text)
+    return parts
+
+def _sendable_parts(text: str):
+    """The parts of `split_message(text)` with any content; Discord rejects blank messages."""
+    return [part for part in split_message(text) if part.strip()]
+
+class _TokenBucket:
+    """
+    Paces outbound requests for one Discord rate-limit bucket. Waiters are
+    served in arrival order, so queued sends keep their order.
+    """
+
+    def __init__(self, capacity: int, per_seconds: float):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = float(capacity)
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def idle(self, now: float) -> bool:
+        """Whether nobody is waiting and the bucket has refilled, so a new one would behave the same."""
+        return not self.lock.locked() and (self.updated is None or now - self.updated >= self.capacity / self.rate)
+
+class _Burst:
+    """Messages from one author in one channel waiting out the debounce window."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.prompts = {}  # message id -> prompt
+        self.timer = None
 
 class DiscordBotSense(SenseModule):
-    def __init__(self, model_responder, shutdown_event):
-        super().__init__(model_responder, shutdown_event)
+    def __init__(self, model_responder, shutdown_event, model_streamer=None, shard_ids=None, shard_count=None):
+        """
+        `shard_ids` and `shard_count` are given when this sense runs one group of
+        shards inside a shard process (see `senses.discord_shards`).
+        """
+        super().__init__(model_responder, shutdown_event, model_streamer)
+        self.token = config.DISCORD_BOT_TOKEN # We will need to add this to our config
+
+        self._bursts = {}  # (channel id, author id) -> _Burst
+        self._channel_slots = KeyedLocks(lambda: asyncio.Semaphore(config.DISCORD_CHANNEL_CONCURRENCY))
+        self._send_buckets = collections.OrderedDict()  # channel id -> _TokenBucket, least recently used first
+
+        self.shards = None
+        self._connecting = False  # the sharded client cannot be closed before it starts connecting
+        if shard_ids is None and config.DISCORD_SHARDING and config.DISCORD_SHARDS_PER_PROCESS:
+            # Shard processes run the bot; this process only supervises them
+            self.client = None
+            self.shards = ShardSupervisor(self.token, config.DISCORD_SHARD_COUNT, config.DISCORD_SHARDS_PER_PROCESS)
+            return
+
         # We'll use an intents object to declare what events our bot wants to receive.
         # This is now a required practice for discord.py.
         intents = discord.Intents.default()
         intents.messages = True  # Enable message-related events
         intents.message_content = True # Enable message content intent
-        self.client = discord.Client(intents=intents)
-        self.token = config.DISCORD_BOT_TOKEN # We will need to add this to our config
+        if shard_ids is not None or config.DISCORD_SHARDING:
+            self.client = discord.AutoShardedClient(
+                intents=intents, shard_ids=shard_ids, shard_count=shard_count or config.DISCORD_SHARD_COUNT
+            )
+        else:
+            self.client = discord.Client(intents=intents)
+        SHARD_LATENCY.set_function(self.shard_latencies)
+        GUILDS.set_function(
+            lambda: {(str(shard),): count for shard, count in collections.Counter(
+                guild.shard_id for guild in self.client.guilds
+            ).items()}
+        )
+        self.register_events()
+
+    def shard_latencies(self):
+        """Heartbeat latency in seconds per shard, for shards that are connected."""
+        if isinstance(self.client, discord.AutoShardedClient):
+            latencies = self.client.latencies
+        else:
+            latencies = [(0, self.client.latency)]
+        return {(str(shard),): latency for shard, latency in latencies if math.isfinite(latency)}
 
+    def register_events(self):
         # --- Event Handlers ---
         @self.client.event
         async def on_ready():
             """Called when the bot successfully connects to Discord."""
             self.logger.info(f'Logged in as {self.client.user}')
+            self.ready.set()
 
         @self.client.event
         async def on_message(message):
             """Called every time a message is received."""
-            # Ignore messages from the bot itself to prevent loops
-            if message.author == self.client.user:
+            shard = str(message.guild.shard_id if message.guild else 0)
+            SHARD_MESSAGES.inc(shard=shard)
+            EVENT_LAG.observe(max((discord.utils.utcnow() - message.created_at).total_seconds(), 0), shard=shard)
+
+            # Ignore messages from the bot itself and other bots to prevent loops
+            if message.author == self.client.user or message.author.bot:
+                return
+
+            prompt = self.extract_prompt(message)
+            if not prompt:
+                MESSAGES_RECEIVED.inc(outcome="ignored")
+                return
+            MESSAGES_RECEIVED.inc(outcome="accepted")
+
+            self.logger.info(f"Received message on Discord: \"{prompt}\"")
+            self.debounce(message, prompt)
+
+        @self.client.event
+        async def on_raw_message_delete(payload):
+            """Called when a message is deleted, even one that is no longer cached."""
+            self.withdraw(payload.channel_id, payload.message_id)
+
+    def extract_prompt(self, message):
+        """
+        Returns the prompt addressed to the bot, or None if the message should be ignored.
+        Unless configured to answer everything, only direct messages, mentions and
+        messages starting with the command prefix are answered.
+        """
+        content = message.content.strip()
+        if config.DISCORD_RESPOND_TO_ALL or isinstance(message.channel, discord.DMChannel):
+            return content or None
+
+        prefix = config.DISCORD_COMMAND_PREFIX
+        if prefix and content.lower().startswith(prefix.lower()):
+            return content[len(prefix):].strip() or None
+
+        if self.client.user in message.mentions:
+            mention = re.compile(rf"<@!?{self.client.user.id}>")
+            return mention.sub("", content).strip() or None
+
+        return None
+
+    def debounce(self, message, prompt):
+        """
+        Folds a burst of messages from the same author in the same channel into one
+        prompt, answered once the author has been quiet for the debounce window.
+        """
+        key = (message.channel.id, message.author.id)
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(message.channel)
+        else:
+            burst.timer.cancel()
+        burst.prompts[message.id] = prompt
+        burst.timer = asyncio.create_task(self._flush_burst(key, burst))
+        # The reply answers every message in the burst; deleting any of them abandons it
+        for message_id in burst.prompts:
+            self.track_request(message_id, burst.timer)
+
+    def withdraw(self, channel_id, message_id):
+        """
+        Takes back a deleted message. While its burst is still being debounced the
+        message is simply dropped from it; once the reply is under way, the reply
+        is abandoned, stopping its generation.
+        """
+        for key, burst in list(self._bursts.items()):
+            if key[0] == channel_id and burst.prompts.pop(message_id, None) is not None:
+                if not burst.prompts:
+                    burst.timer.cancel()
+                    del self._bursts[key]
+                self.logger.info(f"Discord message {message_id} was deleted before it was answered.")
+                return
+        if self.abandon(message_id):
+            self.logger.info(f"Abandoned the reply to deleted Discord message {message_id}.")
+
+    async def _flush_burst(self, key, burst):
+        if len(burst.prompts) < config.DISCORD_DEBOUNCE_MAX_MESSAGES:
+            await asyncio.sleep(config.DISCORD_DEBOUNCE_SECONDS)
+        # From here on the burst is closed; newer messages start a new one
+        if self._bursts.get(key) is burst:
+            del self._bursts[key]
+        prompt = "\n".join(burst.prompts.values())
+        try:
+            await self.reply(burst.channel, prompt)
+        except discord.HTTPException as e:
+            self.logger.error(f"Failed to send a Discord reply: {e}")
+        except Exception as e:
+            self.logger.error(f"Failed to answer a Discord message: {e}", exc_info=True)
+
+    async def _paced(self, channel_id, request):
+        """Runs one send or edit once the channel's rate-limit bucket allows it."""
+        bucket = self._send_buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._send_buckets[channel_id] = _TokenBucket(
+                config.DISCORD_SEND_RATE_LIMIT, config.DISCORD_SEND_RATE_PERIOD_SECONDS
+            )
+        else:
+            self._send_buckets.move_to_end(channel_id)
+        # Buckets of channels that went quiet have refilled and can be dropped
+        now = asyncio.get_running_loop().time()
+        while True:
+            oldest_id, oldest = next(iter(self._send_buckets.items()))
+            if oldest is bucket or not oldest.idle(now):
+                break
+            del self._send_buckets[oldest_id]
+        with SEND_SECONDS.time(sense="discord_bot"):
+            await bucket.acquire()
+            return await request()
+
+    async def reply(self, channel, prompt):
+        """Answers a prompt in `channel`, bounded by the per-channel concurrency limit."""
+        session_id = f"discord:{channel.id}"
+        async with self._channel_slots.hold(channel.id):
+            if self.model_streamer is None:
+                # Get the AI's response, keeping a separate conversation per channel
+                try:
+                    ai_response = await self.model_responder(
+                        prompt, session_id=session_id, coalesce=DISCORD_COALESCE_SCOPE
+                    )
+                except SchedulerOverloaded as e:
+                    self.logger.warning(f"Rejected Discord message: {e}")
+                    ai_response = BUSY_REPLY.format(retry_after=e.retry_after)
+
+                # Send the response back to the channel, split to fit Discord's limit
+                for part in _sendable_parts(ai_response):
+                    await self._paced(channel.id, lambda part=part: channel.send(part))
                 return
 
-            # For simplicity, let's have the bot respond to any message in a channel it's in.
-            # We can make this more specific later (e.g., mentions only).
-            self.logger.info(f"Received message on Discord: \"{message.content}\"")
-            
-            # Get the AI's response
-            ai_response = await self.model_responder(message.content)
-            
-            # Send the response back to the channel
-            await message.channel.send(ai_response)
+            await self.stream_reply(channel, prompt, session_id)
+
+    async def stream_reply(self, channel, prompt, session_id):
+        """
+        Sends a placeholder message and progressively edits it as response chunks arrive,
+        continuing in new messages once a reply outgrows Discord's message limit.
+        Edits are throttled to stay clear of Discord's rate limits.
+        """
+        loop = asyncio.get_running_loop()
+        first = await self._paced(channel.id, lambda: channel.send(STREAM_PLACEHOLDER))
+        replies = [[first, STREAM_PLACEHOLDER]]  # [message, content shown]
+        text = ""
+        last_edit = loop.time()
+
+        async def show(text):
+            for i, part in enumerate(_sendable_parts(text)):
+                if i < len(replies):
+                    reply, shown = replies[i]
+                    if part != shown:
+                        await self._paced(channel.id, lambda: reply.edit(content=part))
+                        replies[i][1] = part
+                else:
+                    reply = await self._paced(channel.id, lambda: channel.send(part))
+                    replies.append([reply, part])
+
+        try:
+            async for chunk in self.model_streamer(
+                prompt, session_id=session_id, coalesce=DISCORD_COALESCE_SCOPE
+            ):
+                text += chunk
+                if loop.time() - last_edit >= config.DISCORD_STREAM_EDIT_INTERVAL_SECONDS:
+                    await show(text)
+                    last_edit = loop.time()
+        except SchedulerOverloaded as e:
+            self.logger.warning(f"Rejected Discord message: {e}")
+            text = BUSY_REPLY.format(retry_after=e.retry_after)
+        except asyncio.CancelledError:
+            # Abandoned: what was already shown stays, a bare placeholder goes
+            if replies[0][1] == STREAM_PLACEHOLDER:
+                with contextlib.suppress(discord.HTTPException):
+                    await first.delete()
+            raise
+
+        await show(text or "Sorry, I couldn't generate a response.")
 
     async def start(self):
         """Starts the Discord bot."""
@@ -43,9 +333,13 @@ class DiscordBotSense(SenseModule):
         if not self.token:
             self.logger.error("Discord bot token is not configured. The Discord sense will not start.")
             return
-        
+
         try:
+            if self.shards is not None:
+                await self.shards.run(self.shutdown_event, self.ready)
+                return
             # The `start` method of the client is blocking, so we run it as a task.
+            self._connecting = True
             await self.client.start(self.token)
         except discord.LoginFailure:
             self.logger.error("Failed to log in to Discord. Please check your bot token.")
@@ -57,5 +351,8 @@ class DiscordBotSense(SenseModule):
     async def stop(self):
         """Stops the Discord bot."""
         self.logger.info("Stopping Discord Sense...")
-        if self.client.is_running():
-            await self.client.close()
\ No newline at end of file
+        self.abandon_all()
+        if self.shards is not None:
+            await asyncio.to_thread(self.shards.stop)
+        elif self._connecting and not self.client.is_closed():
+            await self.client.close()
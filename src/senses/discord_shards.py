@@ -0,0 +1,329 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import List, Tuple
+
+import aiohttp
+
+import config
+from core import metrics
+
+log = logging.getLogger(__name__)
+
+SHARD_PROCESS_RESTARTS = metrics.counter(
+    "nairo_discord_shard_process_restarts_total", "Discord shard processes restarted after exiting."
+)
+SHARD_PROCESSES_ALIVE = metrics.gauge(
+    "nairo_discord_shard_processes_alive", "Discord shard processes currently running."
+)
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord accepts one IDENTIFY per this many seconds in each max_concurrency bucket
+IDENTIFY_INTERVAL_SECONDS = 5
+# Per-shard metrics shard processes report to the supervisor, which serves them at /metrics
+SHARD_METRICS = (
+    "nairo_discord_shard_messages_total",
+    "nairo_discord_event_lag_seconds",
+    "nairo_discord_shard_latency_seconds",
+    "nairo_discord_guilds",
+)
+
+
+async def fetch_gateway_limits(token: str) -> Tuple[int, int]:
+    """Returns the shard count Discord recommends for the bot and how many shards may IDENTIFY at once."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            GATEWAY_URL, headers={"Authorization": f"Bot {token}"}, timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data["shards"], data.get("session_start_limit", {}).get("max_concurrency", 1)
+
+
+def shard_groups(shard_count: int, shards_per_process: int) -> List[List[int]]:
+    """Splits shard ids 0..shard_count-1 into consecutive groups of `shards_per_process`."""
+    return [
+        list(range(start, min(start + shards_per_process, shard_count)))
+        for start in range(0, shard_count, shards_per_process)
+    ]
+
+
+def shard_process_main(conn, group_id: int, shard_ids: List[int], shard_count: int, start_delay: float):
+    """
+    Entry point of a shard process: runs the Discord sense for `shard_ids` with
+    its own model manager, scheduler and sandboxes, until `conn` is closed.
+
+    Sends `("ready",)` once its shards are connected, then `("metrics", snapshot)`
+    with its per-shard metrics every few seconds.
+    """
+    # Ctrl+C reaches the whole process group; the supervisor decides when shard processes stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Spawning re-imports main.py, which set up the parent's handlers; shard processes log to stderr instead
+    from utils.logger_config import shutdown_logging
+    shutdown_logging()
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format=f"[%(asctime)s] [shards {shard_ids[0]}-{shard_ids[-1]}] [%(levelname)-8s] [%(name)s] %(message)s",
+        force=True,
+    )
+    stopped = asyncio.run(_run_shard_group(conn, group_id, shard_ids, shard_count, start_delay))
+    logging.shutdown()
+    # Exiting on its own (e.g. after a failed login) is reported as a failure, so the process is restarted.
+    # Threads still stuck in model calls must not keep the process alive.
+    os._exit(0 if stopped else 1)
+
+
+async def _run_shard_group(conn, group_id, shard_ids, shard_count, start_delay) -> bool:
+    from core.database import Database
+    from core.model_manager import (
+        initialize_model_manager, check_internet_periodically, get_model_response, stream_model_response,
+    )
+    from core.sandbox import stop_pool
+    from core.scheduler import Scheduler
+    from senses.discord_bot import DiscordBotSense
+
+    loop = asyncio.get_running_loop()
+    parent_gone = asyncio.Event()
+
+    def wait_for_parent():
+        # Nothing is sent this way; the pipe closing is the signal to stop
+        try:
+            while True:
+                conn.recv()
+        except (EOFError, OSError):
+            loop.call_soon_threadsafe(parent_gone.set)
+
+    threading.Thread(target=wait_for_parent, name="shard-supervisor-pipe", daemon=True).start()
+
+    # The memory index file belongs to the main process; each group keeps its own
+    config.MEMORY_FILE_PATH = f"{config.MEMORY_FILE_PATH}.shards{group_id}"
+    database = Database(
+        config.DATABASE_PATH,
+        read_pool_size=config.DATABASE_READ_POOL_SIZE,
+        value_cache_size=config.DATABASE_VALUE_CACHE_SIZE,
+        write_batch_size=config.DATABASE_WRITE_BATCH_SIZE,
+    )
+    await database.initialize()
+    # This group's own model-call budget
+    scheduler = Scheduler(
+        config.DISCORD_SHARD_PROCESS_MODEL_CALLS, config.SCHEDULER_SENSES, config.SCHEDULER_DEFAULT_SENSE
+    )
+    initialize_model_manager(database, scheduler)
+
+    shutdown_event = asyncio.Event()
+    sense = DiscordBotSense(
+        functools.partial(get_model_response, sense="discord_bot"),
+        shutdown_event,
+        functools.partial(stream_model_response, sense="discord_bot"),
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+    )
+    sense.logger = logging.getLogger("sense.discord_bot")
+    sense.database = database
+
+    async def run_bot():
+        # Staggered so the groups' IDENTIFYs stay within Discord's rate limit
+        await asyncio.sleep(start_delay)
+        await sense.start()
+
+    async def report():
+        await sense.ready.wait()
+        conn.send(("ready",))
+        while True:
+            conn.send(("metrics", metrics.snapshot(SHARD_METRICS)))
+            await asyncio.sleep(config.DISCORD_SHARD_METRICS_INTERVAL_SECONDS)
+
+    bot = asyncio.create_task(run_bot())
+    tasks = [
+        bot,
+        asyncio.create_task(report()),
+        asyncio.create_task(check_internet_periodically(shutdown_event)),
+    ]
+    try:
+        await asyncio.wait([bot, asyncio.create_task(parent_gone.wait())], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        shutdown_event.set()
+        sense.abandon_all()
+        try:
+            await asyncio.wait_for(sense.stop(), timeout=config.SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception:
+            log.exception("Error while stopping the Discord sense:")
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks, timeout=config.SHUTDOWN_TIMEOUT_SECONDS)
+        scheduler.shutdown()
+        await asyncio.to_thread(stop_pool)
+        await database.close()
+    return parent_gone.is_set()
+
+
+class _ShardGroup:
+    def __init__(self, group_id: int, shard_ids: List[int]):
+        self.id = group_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.restarts = []  # monotonic times of recent restarts
+        self.restart_at = None  # loop time an exited process is due to be restarted
+
+    @property
+    def label(self) -> str:
+        return f"{self.shard_ids[0]}-{self.shard_ids[-1]}"
+
+
+class ShardSupervisor:
+    """
+    Runs the Discord bot's shards in groups of `shards_per_process`, each group in
+    its own process with its own model manager and model-call budget, so the
+    bot scales out across cores as it joins more servers.
+
+    With no fixed shard count, the count Discord recommends is used and checked
+    again periodically; when it grows, every group is restarted with the new
+    count (and so with more processes). Processes that exit are restarted with
+    a back-off, like model workers, and their per-shard metrics are merged into
+    this process's registry.
+    """
+
+    def __init__(self, token: str, shard_count, shards_per_process: int):
+        if shards_per_process < 1:
+            raise ValueError(f"Shards per process must be at least 1, got {shards_per_process}.")
+        self.token = token
+        self.configured_count = shard_count
+        self.shards_per_process = shards_per_process
+        self.shard_count = 0
+        self.max_concurrency = 1
+        # Spawned rather than forked: the parent runs threads and an event loop
+        self._context = multiprocessing.get_context("spawn")
+        self._groups: List[_ShardGroup] = []
+        self._stopping = False
+        SHARD_PROCESSES_ALIVE.set_function(
+            lambda: sum(1 for g in self._groups if g.process is not None and g.process.is_alive())
+        )
+
+    def _spawn(self, group: _ShardGroup, start_delay: float = 0.0):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=shard_process_main,
+            args=(child_conn, group.id, group.shard_ids, self.shard_count, start_delay),
+            name=f"nairo-discord-shards-{group.label}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        group.process, group.conn, group.ready = process, parent_conn, False
+
+    def _start_groups(self):
+        self._groups = [
+            _ShardGroup(i, shard_ids)
+            for i, shard_ids in enumerate(shard_groups(self.shard_count, self.shards_per_process))
+        ]
+        for group in self._groups:
+            self._spawn(group, group.shard_ids[0] * IDENTIFY_INTERVAL_SECONDS / self.max_concurrency)
+        log.info(f"Started {len(self._groups)} Discord shard process(es) for {self.shard_count} shard(s).")
+
+    def _stop_groups(self, timeout: float = 5.0):
+        """Closes every group's pipe, then terminates processes that do not exit in time."""
+        for group in self._groups:
+            if group.conn is not None:
+                group.conn.close()
+        deadline = time.monotonic() + timeout
+        for group in self._groups:
+            if group.process is None:
+                continue
+            group.process.join(timeout=max(deadline - time.monotonic(), 0))
+            if group.process.is_alive():
+                log.warning(f"Discord shard process {group.label} did not stop in time; terminating it.")
+                group.process.terminate()
+                group.process.join(timeout=1)
+
+    def _restart_delay(self, group: _ShardGroup) -> float:
+        now = time.monotonic()
+        group.restarts = [t for t in group.restarts if now - t < 60]
+        return min(2 ** len(group.restarts) - 1, 30)
+
+    def _restart(self, group: _ShardGroup):
+        group.conn.close()
+        group.process.join(timeout=1)
+        self._spawn(group)
+        group.restarts.append(time.monotonic())
+        SHARD_PROCESS_RESTARTS.inc()
+
+    def _receive(self, ready_event: asyncio.Event):
+        """Takes in readiness and metrics reports from the shard processes."""
+        for group in self._groups:
+            try:
+                while group.conn.poll():
+                    message = group.conn.recv()
+                    if message[0] == "ready":
+                        group.ready = True
+                        log.info(f"Discord shards {group.label} are connected.")
+                    elif message[0] == "metrics":
+                        metrics.merge(message[1])
+            except (EOFError, OSError):
+                # The process exited; `run` restarts it
+                pass
+        if self._groups and all(group.ready for group in self._groups):
+            ready_event.set()
+
+    async def _reshard_if_needed(self):
+        try:
+            shard_count, max_concurrency = await fetch_gateway_limits(self.token)
+        except Exception as e:
+            log.warning(f"Could not check Discord's recommended shard count: {e}")
+            return
+        if shard_count <= self.shard_count:
+            return
+        log.info(f"Discord now recommends {shard_count} shards (running {self.shard_count}); resharding.")
+        await asyncio.to_thread(self._stop_groups)
+        self.shard_count, self.max_concurrency = shard_count, max_concurrency
+        await asyncio.to_thread(self._start_groups)
+
+    async def run(self, shutdown_event: asyncio.Event, ready_event: asyncio.Event, interval: float = 1.0):
+        """Starts the shard processes and keeps them running until shutdown."""
+        if self.configured_count:
+            self.shard_count = self.configured_count
+        else:
+            self.shard_count, self.max_concurrency = await fetch_gateway_limits(self.token)
+        await asyncio.to_thread(self._start_groups)
+
+        loop = asyncio.get_running_loop()
+        next_reshard_check = loop.time() + config.DISCORD_RESHARD_CHECK_SECONDS
+        while not shutdown_event.is_set():
+            self._receive(ready_event)
+            for group in self._groups:
+                if self._stopping or group.process.is_alive():
+                    continue
+                if group.restart_at is None:
+                    delay = self._restart_delay(group)
+                    log.error(
+                        f"Discord shard process {group.label} exited with code {group.process.exitcode}. "
+                        f"Restarting in {delay:.0f}s."
+                    )
+                    # Restarted on a later pass once due, so the other groups' reports keep being read
+                    group.restart_at = loop.time() + delay
+                if loop.time() >= group.restart_at:
+                    group.restart_at = None
+                    await asyncio.to_thread(self._restart, group)
+            if (
+                not self.configured_count
+                and config.DISCORD_RESHARD_CHECK_SECONDS
+                and loop.time() >= next_reshard_check
+            ):
+                next_reshard_check = loop.time() + config.DISCORD_RESHARD_CHECK_SECONDS
+                await self._reshard_if_needed()
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self, timeout: float = 5.0):
+        """Stops every shard process."""
+        self._stopping = True
+        self._stop_groups(timeout)
+        log.info("Discord shard processes stopped.")
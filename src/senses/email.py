@@ -0,0 +1,529 @@
+import asyncio
+import contextlib
+import html
+import imaplib
+import itertools
+import queue
+import re
+import select
+import smtplib
+import ssl
+import threading
+import time
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.utils import formatdate, make_msgid, parseaddr
+import config
+from core import metrics
+from core.model_manager import FailedResponse
+from core.scheduler import SchedulerOverloaded
+from senses._base import SenseModule
+
+EMAIL_COALESCE_SCOPE = config.REQUEST_COALESCING.get("email", "session")
+
+EMAILS_RECEIVED = metrics.counter(
+    "nairo_emails_total", "Emails fetched from the mailbox, by whether they were answered.", ["outcome"]
+)
+SEND_SECONDS = metrics.histogram(
+    "nairo_response_send_seconds", "Time to deliver a send or edit, including rate-limit pacing.", ["sense"]
+)
+
+_FETCH_UID = re.compile(rb"\bUID (\d+)")
+_EXISTS = re.compile(rb"^\* \d+ EXISTS")
+_MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+# The line most clients put above the quoted message in a reply
+_QUOTE_HEADER = re.compile(r"^On .+ wrote:\s*$")
+_HTML_TAG = re.compile(r"<[^>]+>")
+_DMARC_PASS = re.compile(r"\bdmarc=pass\b.*?\bheader\.from=([^\s;]+)", re.IGNORECASE)
+
+def message_text(message) -> str:
+    """The new text of an email: its plain-text body without the message it quotes or a signature."""
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return ""
+    text = part.get_content()
+    if part.get_content_type() == "text/html":
+        text = html.unescape(_HTML_TAG.sub("", text))
+    lines = []
+    for line in text.splitlines():
+        if _QUOTE_HEADER.match(line) or line == "-- ":
+            break
+        if not line.startswith(">"):
+            lines.append(line)
+    return "\n".join(lines).strip()
+
+def thread_id(message, message_id: str) -> str:
+    """The Message-ID of the email that started the conversation `message` belongs to."""
+    ancestors = _MESSAGE_ID.findall(f"{message.get('References', '')} {message.get('In-Reply-To', '')}")
+    return ancestors[0] if ancestors else message_id
+
+def dmarc_passed(message, sender: str) -> bool:
+    """
+    Whether the receiving server recorded a DMARC pass for the domain of `sender`.
+    Only the topmost Authentication-Results header counts: it is the one our own
+    server added, while those below it came with the message.
+    """
+    results = message.get("Authentication-Results")
+    if results is None:
+        return False
+    match = _DMARC_PASS.search(str(results))
+    return match is not None and match[1].lower() == sender.rpartition("@")[2].lower()
+
+def build_reply(message, text: str, sender: str) -> EmailMessage:
+    """A reply to `message` that mail clients thread under it."""
+    reply = EmailMessage()
+    reply["From"] = sender
+    reply["To"] = message.get("Reply-To") or message["From"]
+    subject = str(message.get("Subject", "")).strip()
+    reply["Subject"] = subject if subject.lower().startswith("re:") else f"Re: {subject}".strip()
+    reply["Date"] = formatdate(localtime=True)
+    reply["Message-ID"] = make_msgid(domain=sender.rpartition("@")[2] or None)
+    message_id = str(message.get("Message-ID", "")).strip()
+    if message_id:
+        reply["In-Reply-To"] = message_id
+        reply["References"] = " ".join(_MESSAGE_ID.findall(str(message.get("References", ""))) + [message_id])
+    # RFC 3834: tells other auto-responders not to answer this one
+    reply["Auto-Submitted"] = "auto-replied"
+    reply.set_content(text)
+    return reply
+
+class _Mailbox:
+    """
+    One persistent IMAP connection to the watched mailbox. Its methods block,
+    so they are run in a worker thread, one at a time.
+    """
+
+    def __init__(self, host, port, use_ssl, username, password, mailbox, timeout):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.mailbox = mailbox
+        self.timeout = timeout
+        self.imap = None
+        self.uidvalidity = None
+        self.uidnext = None
+        self.supports_idle = False
+
+    def _command(self, name, *args):
+        """Runs a UID command, raising if the server refuses it."""
+        status, data = self.imap.uid(name, *args)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID {name} failed: {data}")
+        return data
+
+    def connect(self):
+        imap_class = imaplib.IMAP4_SSL if self.use_ssl else imaplib.IMAP4
+        self.imap = imap_class(self.host, self.port, timeout=self.timeout)
+        self.imap.login(self.username, self.password)
+        # Servers may announce more capabilities once logged in
+        _, capabilities = self.imap.capability()
+        self.supports_idle = b"IDLE" in capabilities[0].upper().split()
+        status, data = self.imap.select(f'"{self.mailbox}"')
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"Cannot open mailbox {self.mailbox}: {data}")
+        self.uidvalidity = int(self.imap.response("UIDVALIDITY")[1][0])
+        uidnext = self.imap.response("UIDNEXT")[1][0]
+        if uidnext is None:
+            data = self._command("SEARCH", "ALL")
+            uidnext = max(map(int, data[0].split()), default=0) + 1
+        self.uidnext = int(uidnext)
+
+    def new_uids(self, after_uid):
+        """UIDs of messages after `after_uid`, or of unread messages if it is None, oldest first."""
+        if after_uid is None:
+            data = self._command("SEARCH", "UNSEEN")
+        else:
+            # "n:*" always matches the newest message, even one below n
+            data = self._command("SEARCH", "UID", f"{after_uid + 1}:*")
+        uids = sorted(int(uid) for uid in data[0].split())
+        return [uid for uid in uids if after_uid is None or uid > after_uid]
+
+    def fetch(self, uids):
+        """Fetches whole messages, without marking them read. Returns `[(uid, raw bytes), ...]`."""
+        data = self._command("FETCH", ",".join(map(str, uids)), "(UID BODY.PEEK[])")
+        messages = []
+        for i, item in enumerate(data):
+            if not isinstance(item, tuple):
+                continue
+            # The UID usually precedes the body, but a server may send it after
+            match = _FETCH_UID.search(item[0])
+            if match is None and i + 1 < len(data) and isinstance(data[i + 1], bytes):
+                match = _FETCH_UID.search(data[i + 1])
+            if match is not None:
+                messages.append((int(match[1]), item[1]))
+        return messages
+
+    def mark_seen(self, uids):
+        self._command("STORE", ",".join(map(str, uids)), "+FLAGS.SILENT", r"(\Seen)")
+
+    def _readable(self, timeout) -> bool:
+        # Lines the client already buffered never show up in select, so peek first
+        sock = self.imap.sock
+        sock.settimeout(0)
+        try:
+            if self.imap.file.peek(1):
+                return True
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+        finally:
+            sock.settimeout(self.timeout)
+        return bool(select.select([sock], [], [], timeout)[0])
+
+    def idle(self, seconds, stop: threading.Event) -> bool:
+        """
+        Waits in IMAP IDLE until the server reports new mail, `seconds` pass, or
+        `stop` is set. Returns whether new mail was reported. Servers without
+        IDLE are simply polled: this waits `seconds` and the caller searches again.
+        """
+        if not self.supports_idle:
+            stop.wait(seconds)
+            return False
+        tag = self.imap._new_tag()
+        self.imap.send(tag + b" IDLE\r\n")
+        line = self.imap.readline()
+        while not line.startswith(b"+"):
+            if line.startswith(tag) or not line:
+                raise imaplib.IMAP4.error(f"IDLE refused: {line!r}")
+            line = self.imap.readline()
+
+        new_mail = False
+        deadline = time.monotonic() + seconds
+        try:
+            while not stop.is_set() and time.monotonic() < deadline:
+                # Short waits, so `stop` is noticed within a second
+                if not self._readable(1.0):
+                    continue
+                line = self.imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("The IMAP server closed the connection.")
+                if _EXISTS.match(line):
+                    new_mail = True
+                    break
+        finally:
+            self.imap.send(b"DONE\r\n")
+            while True:
+                line = self.imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("The IMAP server closed the connection.")
+                if line.startswith(tag):
+                    break
+        return new_mail
+
+    def close(self):
+        if self.imap is None:
+            return
+        with contextlib.suppress(Exception):
+            self.imap.logout()
+        self.imap = None
+
+class _SmtpPool:
+    """
+    SMTP connections kept open and reused across replies. `send` blocks, so it
+    is run in a worker thread; at most `size` sends run at once.
+    """
+
+    def __init__(self, host, port, security, username, password, size, timeout):
+        self.host = host
+        self.port = port
+        self.security = security
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        if self.security == "ssl":
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                smtp.starttls(context=ssl.create_default_context())
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def send(self, message: EmailMessage):
+        with self._slots:
+            smtp = self._checkout()
+            try:
+                try:
+                    smtp.send_message(message)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # The server dropped the idle connection; one retry on a fresh one
+                    with contextlib.suppress(Exception):
+                        smtp.close()
+                    smtp = self._connect()
+                    smtp.send_message(message)
+            except BaseException:
+                with contextlib.suppress(Exception):
+                    smtp.close()
+                raise
+            self._idle.put(smtp)
+
+    def close(self):
+        while True:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with contextlib.suppress(Exception):
+                smtp.quit()
+
+class EmailSense(SenseModule):
+    """
+    Answers emails sent to the configured mailbox.
+
+    One persistent IMAP connection waits in IDLE for the server to push new
+    mail, then fetches everything past the last UID seen in batches. Each
+    conversation thread is its own session, answered one email at a time, and
+    replies go out through a pool of open SMTP connections. An email counts as
+    processed once its reply is sent (or it is ignored or given up on); the
+    Message-IDs processed and the UID below which every email is processed are
+    kept in the database, so a restart picks up any email still unanswered.
+    """
+
+    def __init__(self, model_responder, shutdown_event, model_streamer=None):
+        super().__init__(model_responder, shutdown_event, model_streamer)
+        self.address = config.EMAIL_ADDRESS
+        self.allowed_senders = {sender.lower() for sender in config.EMAIL_ALLOWED_SENDERS}
+        self._stop = threading.Event()
+        self._smtp = _SmtpPool(
+            config.EMAIL_SMTP_HOST,
+            config.EMAIL_SMTP_PORT,
+            config.EMAIL_SMTP_SECURITY,
+            config.EMAIL_USERNAME,
+            config.EMAIL_PASSWORD,
+            config.EMAIL_SMTP_POOL_SIZE,
+            config.EMAIL_TIMEOUT_SECONDS,
+        )
+        self._state_key = f"email:last_uid:{config.EMAIL_USERNAME}:{config.EMAIL_MAILBOX}"
+        self._thread_tails = {}  # thread id -> task answering its latest email
+        self._pending = {}  # message id -> (uidvalidity, uid) of emails being answered
+        self._unanswered = {}  # the same for emails given up on until the next scan comes across them
+        self._uidvalidity = None
+        self._last_uid = None
+
+    def ignore_reason(self, message, prompt):
+        """Why an email should not be answered, or None if it should."""
+        sender = parseaddr(str(message.get("From", "")))[1].lower()
+        if sender == (self.address or "").lower():
+            return "sent by NAIRO"
+        if str(message.get("Auto-Submitted", "no")).lower() != "no":
+            return "automated"
+        if message.get("List-Id") or str(message.get("Precedence", "")).lower() in ("bulk", "list", "junk"):
+            return "bulk or mailing list"
+        if "*" not in self.allowed_senders and sender not in self.allowed_senders:
+            return f"sender {sender} is not allowed"
+        if config.EMAIL_REQUIRE_DMARC_PASS and not dmarc_passed(message, sender):
+            return f"sender {sender} could not be authenticated"
+        if not prompt:
+            return "no text"
+        return None
+
+    async def _stored_last_uid(self, uidvalidity):
+        state = await self.database.get_value(self._state_key)
+        if not state:
+            return None
+        stored_validity, _, uid = state.partition(":")
+        if int(stored_validity) != uidvalidity:
+            # The server renumbered the mailbox; already-answered Message-IDs are still skipped
+            self.logger.warning("The mailbox's UIDVALIDITY changed; scanning unread messages again.")
+            return None
+        return int(uid)
+
+    async def _watch(self):
+        mailbox = _Mailbox(
+            config.EMAIL_IMAP_HOST,
+            config.EMAIL_IMAP_PORT,
+            config.EMAIL_IMAP_SSL,
+            config.EMAIL_USERNAME,
+            config.EMAIL_PASSWORD,
+            config.EMAIL_MAILBOX,
+            config.EMAIL_TIMEOUT_SECONDS,
+        )
+        await asyncio.to_thread(mailbox.connect)
+        try:
+            mode = "IDLE" if mailbox.supports_idle else f"polling every {config.EMAIL_POLL_SECONDS}s"
+            self.logger.info(f"Watching {config.EMAIL_MAILBOX} of {self.address} ({mode}).")
+            self.ready.set()
+            self._uidvalidity = mailbox.uidvalidity
+            self._last_uid = await self._stored_last_uid(mailbox.uidvalidity)
+            first_scan = self._last_uid is None
+            while not self._stop.is_set():
+                uids = await asyncio.to_thread(mailbox.new_uids, self._last_uid)
+                for start in range(0, len(uids), config.EMAIL_FETCH_BATCH_SIZE):
+                    batch = uids[start:start + config.EMAIL_FETCH_BATCH_SIZE]
+                    fetched = await asyncio.to_thread(mailbox.fetch, batch)
+                    await self._dispatch(fetched, mailbox.uidvalidity)
+                    await asyncio.to_thread(mailbox.mark_seen, batch)
+                    self._last_uid = batch[-1]
+                    await self._save_checkpoint()
+                if first_scan:
+                    # Only unread mail counts on the first scan; everything older was already there
+                    first_scan = False
+                    self._last_uid = max(self._last_uid or 0, mailbox.uidnext - 1)
+                    await self._save_checkpoint()
+                seconds = config.EMAIL_IDLE_SECONDS if mailbox.supports_idle else config.EMAIL_POLL_SECONDS
+                await asyncio.to_thread(mailbox.idle, seconds, self._stop)
+        finally:
+            await asyncio.to_thread(mailbox.close)
+
+    async def _save_checkpoint(self):
+        """
+        Stores the UID the next run scans from: the last one fetched, or just
+        below the oldest email still being answered, so a restart answers it.
+        """
+        if self._last_uid is None:
+            return
+        pending = [
+            uid for uidvalidity, uid in itertools.chain(self._pending.values(), self._unanswered.values())
+            if uidvalidity == self._uidvalidity
+        ]
+        checkpoint = min([self._last_uid, *(uid - 1 for uid in pending)])
+        await self.database.set_value(self._state_key, f"{self._uidvalidity}:{checkpoint}")
+
+    async def _dispatch(self, fetched, uidvalidity):
+        """Starts answering each fetched email that is new and addressed to NAIRO."""
+        parsed = []
+        for uid, raw in fetched:
+            message = BytesParser(policy=policy.default).parsebytes(raw)
+            message_id = str(message.get("Message-ID", "")).strip() or f"<uid-{uidvalidity}-{uid}@nairo>"
+            parsed.append((uid, message_id, message))
+
+        seen = await self.database.processed_email_ids(message_id for _, message_id, _ in parsed)
+        # Emails already being answered come round again after a reconnect
+        seen.update(self._pending)
+        ignored_ids = []
+        for uid, message_id, message in parsed:
+            if message_id in seen:
+                EMAILS_RECEIVED.inc(outcome="duplicate")
+                continue
+            seen.add(message_id)
+            try:
+                prompt = message_text(message)
+            except (LookupError, ValueError) as e:
+                self.logger.warning(f"Could not read email {message_id}: {e}")
+                prompt = ""
+            reason = self.ignore_reason(message, prompt)
+            if reason is not None:
+                EMAILS_RECEIVED.inc(outcome="ignored")
+                self.logger.debug(f"Ignoring email {message_id}: {reason}.")
+                ignored_ids.append(message_id)
+                continue
+            EMAILS_RECEIVED.inc(outcome="accepted")
+            self._unanswered.pop(message_id, None)
+            self._pending[message_id] = (uidvalidity, uid)
+            self._answer_in_thread(message_id, message, prompt)
+        await self.database.mark_emails_processed(ignored_ids)
+
+    def _answer_in_thread(self, message_id, message, prompt):
+        thread = thread_id(message, message_id)
+        previous = self._thread_tails.get(thread)
+        task = asyncio.create_task(self._answer(message_id, message, prompt, thread, previous))
+        self.track_request(message_id, task)
+        self._thread_tails[thread] = task
+
+        def forget(task):
+            if self._thread_tails.get(thread) is task:
+                del self._thread_tails[thread]
+
+        task.add_done_callback(forget)
+
+    async def _answer(self, message_id, message, prompt, thread, previous):
+        processed = False
+        try:
+            processed = await self._answer_once(message_id, message, prompt, thread, previous)
+        finally:
+            # Whatever stopped it, an unprocessed email keeps the checkpoint below it
+            location = self._pending.pop(message_id)
+            if not processed:
+                self._unanswered[message_id] = location
+        if processed:
+            await self._save_checkpoint()
+
+    async def _answer_once(self, message_id, message, prompt, thread, previous):
+        """Answers one email; returns whether it was processed (answered or given up on)."""
+        if previous is not None:
+            # Emails in one conversation are answered one at a time, in the order they arrived
+            await asyncio.wait({previous})
+        self.logger.info(f"Received email {message_id}: \"{message.get('Subject', '')}\"")
+        response = None
+        for attempt in range(1, config.EMAIL_MAX_ATTEMPTS + 1):
+            try:
+                response = await self.model_responder(
+                    prompt, session_id=f"email:{thread}", coalesce=EMAIL_COALESCE_SCOPE
+                )
+            except SchedulerOverloaded as e:
+                # Nobody is waiting on the other end, so wait for capacity instead of refusing
+                problem, delay = str(e), e.retry_after
+            else:
+                if not isinstance(response, FailedResponse):
+                    break
+                # An apology is not worth mailing; the model may be back by the next try
+                problem, delay = response, config.EMAIL_RETRY_SECONDS
+                response = None
+            if attempt == config.EMAIL_MAX_ATTEMPTS:
+                self.logger.error(f"Giving up on email {message_id} after {attempt} attempt(s): {problem}")
+                break
+            self.logger.warning(f"Email {message_id} attempt {attempt} failed ({problem}). Retrying in {delay}s.")
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.shutdown_event.wait(), timeout=delay)
+            if self.shutdown_event.is_set():
+                # Left unprocessed, so the next run answers it
+                return False
+
+        if response is not None:
+            reply = build_reply(message, response, self.address)
+            try:
+                with SEND_SECONDS.time(sense="email"):
+                    await asyncio.to_thread(self._smtp.send, reply)
+            except (smtplib.SMTPException, OSError) as e:
+                # Left unprocessed, so the next run answers it
+                self.logger.error(f"Failed to send the reply to email {message_id}: {e}")
+                return False
+        await self.database.mark_emails_processed([message_id])
+        return True
+
+    async def start(self):
+        """Watches the mailbox until shutdown, reconnecting whenever the connection drops."""
+        self.logger.info("Starting Email Sense...")
+        if not (self.address and config.EMAIL_PASSWORD and config.EMAIL_IMAP_HOST and config.EMAIL_SMTP_HOST):
+            self.logger.error(
+                "The email address, password or servers are not configured. The Email sense will not start."
+            )
+            return
+        if self.database is None:
+            self.logger.error("The Email sense needs the database to track answered emails; it will not start.")
+            return
+        if not self.allowed_senders:
+            self.logger.warning("EMAIL_ALLOWED_SENDERS is empty, so no email will be answered.")
+
+        try:
+            while not self._stop.is_set() and not self.shutdown_event.is_set():
+                try:
+                    await self._watch()
+                except (imaplib.IMAP4.error, OSError) as e:
+                    self.logger.error(
+                        f"IMAP connection failed: {e}. Reconnecting in {config.EMAIL_RECONNECT_SECONDS}s."
+                    )
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.shutdown_event.wait(), timeout=config.EMAIL_RECONNECT_SECONDS)
+        finally:
+            self.logger.info("Email sense has stopped.")
+
+    async def stop(self):
+        """Stops watching the mailbox and closes the SMTP connections."""
+        self.logger.info("Stopping Email Sense...")
+        self._stop.set()
+        self.abandon_all()
+        await asyncio.to_thread(self._smtp.close)
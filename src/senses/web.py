@@ -1,17 +1,42 @@
 import asyncio
-from quart import Quart, render_template, request, jsonify
+import contextlib
+import json
+from quart import Quart, Response, render_template, request, jsonify, websocket
 from hypercorn.config import Config
 from hypercorn.asyncio import serve
 
+import config
+from core import metrics
+from core.scheduler import SchedulerOverloaded
 from senses._base import SenseModule
 
+WEB_COALESCE_SCOPE = config.REQUEST_COALESCING.get("web", "session")
+
+WEBSOCKET_CONNECTIONS = metrics.gauge("nairo_web_websocket_connections", "Open chat WebSocket connections.")
+
 quart_app = Quart(__name__, template_folder='../web/templates', static_folder='../web/static')
 
+def session_for(data: dict) -> str:
+    """Conversations are per client when the client names one, otherwise shared."""
+    client_session = data.get('session_id')
+    return f"web:{client_session}" if client_session else "web"
+
+def overloaded_response(error: SchedulerOverloaded):
+    """Turns a scheduler overload into a 429 with a Retry-After hint."""
+    response = jsonify({"error": "NAIRO is busy right now. Please try again shortly."})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 class WebSense(SenseModule):
-    def __init__(self, model_responder, shutdown_event):
-        super().__init__(model_responder, shutdown_event)
+    def __init__(self, model_responder, shutdown_event, model_streamer=None):
+        super().__init__(model_responder, shutdown_event, model_streamer)
         self.hypercorn_task = None
 
+    @quart_app.before_serving
+    async def announce_ready():
+        quart_app.config['ready_event'].set()
+
     @quart_app.route('/')
     async def index():
         return await render_template('index.html')
@@ -26,17 +51,164 @@ class WebSense(SenseModule):
         # Since model_responder is part of the sense instance, 
         # we need a way to access it from the Quart route.
         # A simple way is to store it on the app object.
-        response = await quart_app.config['model_responder'](user_input)
+        session_id = session_for(data)
+        try:
+            # Tracked so the answer can be abandoned, e.g. on shutdown
+            response = await quart_app.config['sense'].run_request(
+                session_id,
+                quart_app.config['model_responder'](
+                    user_input, session_id=session_id, coalesce=WEB_COALESCE_SCOPE
+                ),
+            )
+        except SchedulerOverloaded as e:
+            return overloaded_response(e)
         return jsonify({"response": response})
 
+    @quart_app.route('/chat/stream', methods=['POST'])
+    async def chat_stream():
+        data = await request.get_json()
+        user_input = data.get('message')
+        if not user_input:
+            return jsonify({"error": "No message provided"}), 400
+
+        session_id = session_for(data)
+        chunks: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        async def generate():
+            stream = quart_app.config['model_streamer'](
+                user_input, session_id=session_id, coalesce=WEB_COALESCE_SCOPE
+            )
+            try:
+                async for chunk in stream:
+                    chunks.put_nowait(chunk)
+            except Exception as e:
+                chunks.put_nowait(e)
+            finally:
+                await stream.aclose()
+                chunks.put_nowait(finished)
+
+        # The model call runs in a tracked task, like /chat, so it can be abandoned (e.g. on shutdown)
+        generation = quart_app.config['sense'].track_request(session_id, asyncio.create_task(generate()))
+        # Wait for the first chunk before committing to a 200, so an overload
+        # can still be reported as a 429.
+        try:
+            first_chunk = await chunks.get()
+        except BaseException:
+            generation.cancel()
+            raise
+        if isinstance(first_chunk, SchedulerOverloaded):
+            return overloaded_response(first_chunk)
+        if isinstance(first_chunk, Exception):
+            raise first_chunk
+
+        async def events():
+            # Server-Sent Events: one JSON-encoded chunk per `data:` frame,
+            # followed by a final `done` event.
+            try:
+                chunk = first_chunk
+                while chunk is not finished:
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield f"data: {json.dumps(chunk)}\n\n".encode()
+                    chunk = await chunks.get()
+                yield b"event: done\ndata: {}\n\n"
+            finally:
+                # Stops the generation if the client went away first
+                generation.cancel()
+
+        response = Response(events(), mimetype="text/event-stream")
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.timeout = None  # Generation can outlast the default response timeout
+        return response
+
+    @quart_app.websocket('/ws')
+    async def chat_socket():
+        """
+        One persistent connection per browser session. The client sends
+        `{"type": "prompt", "id": ..., "message": ...}` (or `{"type": "cancel", "id": ...}`)
+        and several prompts may be in flight at once; every frame sent back carries
+        the id of the prompt it answers: `chunk` frames with partial output, then
+        `done`, or an `error` frame.
+        """
+        session_id = session_for({"session_id": websocket.args.get('session')})
+        in_flight = {}  # prompt id -> asyncio.Task
+
+        async def send(frame):
+            await websocket.send(json.dumps(frame))
+
+        async def answer(prompt_id, user_input):
+            try:
+                async for chunk in quart_app.config['model_streamer'](
+                    user_input, session_id=session_id, coalesce=WEB_COALESCE_SCOPE
+                ):
+                    await send({"type": "chunk", "id": prompt_id, "content": chunk})
+                await send({"type": "done", "id": prompt_id})
+            except SchedulerOverloaded as e:
+                await send({
+                    "type": "error", "id": prompt_id, "error": "busy", "retry_after": e.retry_after
+                })
+            except Exception as e:
+                quart_app.logger.warning(f"Could not deliver WebSocket answer {prompt_id!r}: {e}")
+                # Lets the client settle the prompt, unless the connection itself is gone
+                with contextlib.suppress(Exception):
+                    await send({"type": "error", "id": prompt_id, "error": "Internal error"})
+            finally:
+                in_flight.pop(prompt_id, None)
+
+        WEBSOCKET_CONNECTIONS.inc()
+        try:
+            while True:
+                try:
+                    data = json.loads(await websocket.receive())
+                    kind, prompt_id = data.get('type'), data.get('id')
+                except (ValueError, AttributeError):
+                    await send({"type": "error", "id": None, "error": "Malformed frame"})
+                    continue
+
+                if kind == 'cancel':
+                    # Stops the generation too, not just the frames sent back
+                    task = in_flight.get(prompt_id)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                if kind != 'prompt':
+                    await send({"type": "error", "id": prompt_id, "error": f"Unknown frame type: {kind}"})
+                    continue
+                if not data.get('message'):
+                    await send({"type": "error", "id": prompt_id, "error": "No message provided"})
+                    continue
+                if prompt_id in in_flight:
+                    await send({"type": "error", "id": prompt_id, "error": "Prompt id already in flight"})
+                    continue
+                if len(in_flight) >= config.WEB_SOCKET_MAX_IN_FLIGHT:
+                    await send({"type": "error", "id": prompt_id, "error": "Too many prompts in flight"})
+                    continue
+                in_flight[prompt_id] = quart_app.config['sense'].track_request(
+                    (session_id, prompt_id), asyncio.create_task(answer(prompt_id, data['message']))
+                )
+        finally:
+            # The client went away: nobody is left to read the answers
+            for task in in_flight.values():
+                task.cancel()
+            WEBSOCKET_CONNECTIONS.dec()
+
+    @quart_app.route('/metrics')
+    async def metrics_endpoint():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     async def start(self):
+        quart_app.config['sense'] = self
         quart_app.config['model_responder'] = self.model_responder
-        config = Config()
-        config.bind = ["localhost:5000"]
+        quart_app.config['model_streamer'] = self.model_streamer
+        quart_app.config['ready_event'] = self.ready
+        hypercorn_config = Config()
+        hypercorn_config.bind = [f"{config.WEB_HOST}:{config.WEB_PORT}"]
         
         self.logger.info("Starting Quart Web Sense")
         self.hypercorn_task = asyncio.create_task(
-            serve(quart_app, config, shutdown_trigger=self.shutdown_event.wait)
+            serve(quart_app, hypercorn_config, shutdown_trigger=self.shutdown_event.wait)
         )
         await self.hypercorn_task
 
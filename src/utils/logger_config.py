@@ -1,16 +1,142 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
-from discord.utils import _ColourFormatter as DiscordColourFormatter
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 
 LOG_FORMAT = (
     "[%(asctime)s] [%(levelname)-8s] [%(name)-25s] %(message)s (%(filename)s:%(lineno)d)"
 )
 
+# Background thread that formats and writes records in queued mode
+_listener = None
 
-def setup_logging(log_level=logging.INFO):
+
+class ColourFormatter(logging.Formatter):
+    """
+    Compact ANSI-coloured console format: dim timestamp, level coloured by
+    severity, magenta logger name, and tracebacks in red.
+    """
+
+    LEVEL_COLOURS = {
+        logging.DEBUG: "\x1b[40;1m",
+        logging.INFO: "\x1b[34;1m",
+        logging.WARNING: "\x1b[33;1m",
+        logging.ERROR: "\x1b[31m",
+        logging.CRITICAL: "\x1b[41m",
+    }
+
+    FORMATS = {
+        level: logging.Formatter(
+            f"\x1b[30;1m%(asctime)s\x1b[0m {colour}%(levelname)-8s\x1b[0m \x1b[35m%(name)s\x1b[0m %(message)s",
+            "%Y-%m-%d %H:%M:%S",
+        )
+        for level, colour in LEVEL_COLOURS.items()
+    }
+
+    def format(self, record):
+        formatter = self.FORMATS.get(record.levelno, self.FORMATS[logging.DEBUG])
+        if record.exc_info:
+            record.exc_text = f"\x1b[31m{formatter.formatException(record.exc_info)}\x1b[0m"
+        output = formatter.format(record)
+        # Other handlers format the traceback themselves
+        record.exc_text = None
+        return output
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queues records for the listener thread without formatting them. The stock
+    `prepare` formats each record on the logging thread (the event loop) and
+    drops its traceback; this one only resolves the message arguments, which
+    may change later, and leaves formatting, tracebacks included, to the
+    listener's handlers.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Caps how often any single call site may log at or below `max_level`, so a
+    hot path cannot flood the log. Each call site (file and line) gets a token
+    bucket refilled at `per_second` with room for `burst` records. The first
+    record let through after a quiet spell reports how many were dropped.
+    """
+
+    def __init__(self, per_second, burst, max_level=logging.INFO):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self.max_level = max_level
+        self._buckets = {}  # (pathname, lineno) -> [tokens, updated, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar message(s) suppressed)"
+            record.args = None
+        return True
+
+
+def setup_logging(log_level=logging.INFO, use_queue=False, json_format=False, rate_limit_per_second=0,
+                  rate_limit_burst=20):
+    """
+    Configures the root logger with a colour console handler and a rotating file handler.
+
+    With `use_queue`, the root logger only enqueues records and a `QueueListener`
+    thread does the formatting and disk writes, keeping file I/O off the event
+    loop; call `shutdown_logging()` to flush it. `json_format` writes the log file
+    as JSON lines. A non-zero `rate_limit_per_second` limits each call site's
+    INFO and DEBUG records (see `RateLimitFilter`).
+    """
+    global _listener
+    shutdown_logging()
 
     log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'logs')
     if not os.path.exists(log_dir):
@@ -28,20 +154,17 @@ def setup_logging(log_level=logging.INFO):
         root_logger.handlers.clear()
     
     root_logger.setLevel(log_level)
+    handlers = []
 
 
     try:
         console_handler = logging.StreamHandler(sys.stdout)
 
-        console_formatter = DiscordColourFormatter(
-            LOG_FORMAT,
-            datefmt="%Y-%m-%d %H:%M:%S",
-            style="%"
-        )
+        console_formatter = ColourFormatter()
 
         console_handler.setFormatter(console_formatter)
         console_handler.setLevel(log_level)
-        root_logger.addHandler(console_handler)
+        handlers.append(console_handler)
 
     except Exception as e:
         print(f"Error setting up console logging: {e}")
@@ -52,18 +175,35 @@ def setup_logging(log_level=logging.INFO):
             log_file_path, maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8'
         )
 
-        file_formatter = logging.Formatter(
-            LOG_FORMAT,
-            datefmt="%Y-%m-%d %H:%M:%S",
-            style="%",
-        )
+        if json_format:
+            file_formatter = JsonFormatter()
+        else:
+            file_formatter = logging.Formatter(
+                LOG_FORMAT,
+                datefmt="%Y-%m-%d %H:%M:%S",
+                style="%",
+            )
 
         file_handler.setFormatter(file_formatter)
         file_handler.setLevel(logging.DEBUG)
-        root_logger.addHandler(file_handler)
+        handlers.append(file_handler)
     
     except Exception as e:
         print(f"Error setting up file logging: {e}")
+
+    if use_queue:
+        # Records are formatted by the listener thread, which also applies each handler's level
+        log_queue = queue.SimpleQueue()
+        root_handlers = [_DeferredQueueHandler(log_queue)]
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        root_handlers = handlers
+
+    for handler in root_handlers:
+        if rate_limit_per_second:
+            handler.addFilter(RateLimitFilter(rate_limit_per_second, rate_limit_burst))
+        root_logger.addHandler(handler)
     
     logging.getLogger("discord").setLevel(logging.WARNING)
     logging.getLogger("asyncio").setLevel(logging.WARNING)
@@ -72,7 +212,34 @@ def setup_logging(log_level=logging.INFO):
 
 
     initial_logger = logging.getLogger(__name__)
-    initial_logger.info(f"Logger configured. Log file at: {log_file_path}")
+    initial_logger.info(
+        f"Logger configured{' (queued)' if use_queue else ''}. Log file at: {log_file_path}"
+    )
+
+
+def shutdown_logging():
+    """
+    Stops the queue listener, if any, after it has written every pending record.
+    Its handlers are then attached to the root logger directly, so anything
+    logged afterwards is still written.
+    """
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, QueueHandler):
+            root_logger.removeHandler(handler)
+    for handler in listener.handlers:
+        handler.flush()
+        root_logger.addHandler(handler)
+
+
+# Records still queued at interpreter exit are written rather than lost
+atexit.register(shutdown_logging)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import importlib
+import logging
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimeline:
+    """
+    Records when startup steps finished, relative to the first import of this
+    module, and how long the timed ones took, for a report logged on boot.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = []  # (seconds since start, label, duration or None)
+
+    def mark(self, label: str, duration: float = None):
+        self.events.append((time.perf_counter() - self.started, label, duration))
+
+    def import_module(self, name: str):
+        """Imports `name` and records how long it took, unless it was already loaded."""
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        self.mark(f"imported {name}", time.perf_counter() - started)
+        return module
+
+    def report(self) -> str:
+        lines = []
+        for offset, label, duration in sorted(self.events, key=lambda event: event[0]):
+            took = f" (took {duration:.3f}s)" if duration is not None else ""
+            lines.append(f"  {offset:8.3f}s  {label}{took}")
+        return "\n".join(lines)
+
+    def log_report(self):
+        log.info("Startup timeline:\n" + self.report())
+
+
+timeline = StartupTimeline()
@@ -5,6 +5,20 @@ document.getElementById('user-input').addEventListener('keypress', function (e)
     }
 });
 
+// Identifies this browser's conversation across page loads
+const sessionId = getSessionId();
+
+function getSessionId() {
+    let id = localStorage.getItem('nairo-session');
+    if (!id) {
+        id = window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        localStorage.setItem('nairo-session', id);
+    }
+    return id;
+}
+
 async function sendMessage() {
     const userInput = document.getElementById('user-input');
     const message = userInput.value;
@@ -13,25 +27,191 @@ async function sendMessage() {
     addMessage('User', message);
     userInput.value = '';
 
+    const reply = new Reply();
+    try {
+        await chatSocket.send(message, reply);
+        return;
+    } catch (socketError) {
+        // Once part of the answer is shown, retrying over HTTP would repeat it
+        if (socketError instanceof BusyError || reply.started) {
+            addMessage('Error', socketError.message);
+            return;
+        }
+        console.warn('WebSocket failed, falling back to HTTP:', socketError);
+    }
+
     try {
-        const response = await fetch('/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ message: message })
+        await streamMessage(message, reply);
+    } catch (streamError) {
+        if (streamError instanceof BusyError || reply.started) {
+            addMessage('Error', streamError.message);
+            return;
+        }
+        console.warn('Streaming failed, falling back to /chat:', streamError);
+        try {
+            await postMessage(message);
+        } catch (error) {
+            console.error('Error:', error);
+            addMessage('Error', error instanceof BusyError ? error.message : 'Failed to get response from NAIRO.');
+        }
+    }
+}
+
+class BusyError extends Error {}
+
+function busyError(retryAfter) {
+    return new BusyError(`NAIRO is busy. Please try again in ${retryAfter || 'a few'} seconds.`);
+}
+
+// Accumulates one streamed answer into a single chat message
+class Reply {
+    constructor() {
+        this.text = '';
+        this.element = null;
+    }
+
+    get started() {
+        return this.element !== null;
+    }
+
+    append(chunk) {
+        this.text += chunk;
+        if (!this.element) {
+            this.element = addMessage('NAIRO', this.text);
+        } else {
+            updateMessage(this.element, 'NAIRO', this.text);
+        }
+    }
+}
+
+// One persistent WebSocket per page. Prompts are multiplexed over it by id, so
+// several can be answered at once, and partial output is pushed as it arrives.
+class ChatSocket {
+    constructor(url) {
+        this.url = url;
+        this.socket = null;
+        this.opened = null;
+        this.pending = new Map();  // prompt id -> { reply, resolve, reject }
+        this.nextId = 1;
+    }
+
+    connect() {
+        if (this.socket) return this.opened;
+
+        const socket = new WebSocket(this.url);
+        this.socket = socket;
+        this.opened = new Promise((resolve, reject) => {
+            socket.addEventListener('open', resolve, { once: true });
+            socket.addEventListener('error', () => reject(new Error('WebSocket connection failed')), { once: true });
+        });
+        socket.addEventListener('message', (event) => this.receive(JSON.parse(event.data)));
+        socket.addEventListener('close', () => {
+            if (this.socket !== socket) return;
+            this.socket = null;
+            for (const request of this.pending.values()) {
+                request.reject(new Error('WebSocket closed'));
+            }
+            this.pending.clear();
+        });
+        return this.opened;
+    }
+
+    async send(message, reply) {
+        if (!('WebSocket' in window)) {
+            throw new Error('WebSockets are not supported');
+        }
+        await this.connect();
+        const id = String(this.nextId++);
+        return new Promise((resolve, reject) => {
+            this.pending.set(id, { reply, resolve, reject });
+            this.socket.send(JSON.stringify({ type: 'prompt', id: id, message: message }));
         });
+    }
+
+    receive(frame) {
+        const request = this.pending.get(frame.id);
+        if (!request) return;
+
+        if (frame.type === 'chunk') {
+            request.reply.append(frame.content);
+            return;
+        }
+        this.pending.delete(frame.id);
+        if (frame.type === 'done') {
+            request.resolve();
+        } else if (frame.error === 'busy') {
+            request.reject(busyError(frame.retry_after));
+        } else {
+            request.reject(new Error(frame.error));
+        }
+    }
+}
+
+const chatSocket = new ChatSocket(
+    `${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}/ws?session=${encodeURIComponent(sessionId)}`
+);
+
+async function streamMessage(message, reply) {
+    const response = await fetch('/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ message: message, session_id: sessionId })
+    });
+
+    if (response.status === 429) {
+        throw busyError(response.headers.get('Retry-After'));
+    }
+
+    if (!response.ok || !response.body) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
 
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-Sent Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            if (frame.startsWith('event: done')) return;
+
+            for (const line of frame.split('\n')) {
+                if (!line.startsWith('data: ')) continue;
+                reply.append(JSON.parse(line.slice(6)));
+            }
         }
+    }
+}
 
-        const data = await response.json();
-        addMessage('NAIRO', data.response);
-    } catch (error) {
-        console.error('Error:', error);
-        addMessage('Error', 'Failed to get response from NAIRO.');
+async function postMessage(message) {
+    const response = await fetch('/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ message: message, session_id: sessionId })
+    });
+
+    if (response.status === 429) {
+        throw busyError(response.headers.get('Retry-After'));
     }
+
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const data = await response.json();
+    addMessage('NAIRO', data.response);
 }
 
 function addMessage(sender, message) {
@@ -41,4 +221,11 @@ function addMessage(sender, message) {
     messageElement.innerText = `${sender}: ${message}`;
     chatBox.appendChild(messageElement);
     chatBox.scrollTop = chatBox.scrollHeight;
+    return messageElement;
+}
+
+function updateMessage(messageElement, sender, message) {
+    const chatBox = document.getElementById('chat-box');
+    messageElement.innerText = `${sender}: ${message}`;
+    chatBox.scrollTop = chatBox.scrollHeight;
 }